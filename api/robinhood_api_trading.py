@@ -5,16 +5,50 @@ from typing import Any, Dict, Optional
 import uuid
 import requests
 from nacl.signing import SigningKey
+import threading
+import time
 import os 
 from dotenv import load_dotenv
 from src.log import log
 
 l = log(__file__)
 
+
+class TokenBucket:
+    """
+    Client side request budget. Robinhood allows 100 requests per minute with
+    bursts of up to 300, so every request through one RobinhoodCryptoAPI client
+    takes a token and waits only when the bucket is empty.
+    """
+    def __init__(self, rate_per_minute: float = 100, burst: int = 300):
+        self.rate_per_second = rate_per_minute / 60
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__last_refill = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__last_refill) * self.rate_per_second)
+                self.__last_refill = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate_per_second
+            time.sleep(wait)
+
+
 class RobinhoodCryptoAPI:
-    def __init__(self):
+    def __init__(self, rate_per_minute: float = 100, burst: int = 300):
         self.__set_environmental_variables()
         self.base_url = "https://trading.robinhood.com"
+        # A single keep-alive session so order requests reuse an already open
+        # TLS connection instead of doing a handshake on the hot path.
+        self.session = requests.Session()
+        # Shared by every strategy, collector and engine that uses this client
+        self.rate_limiter = TokenBucket(rate_per_minute, burst)
         self.__validate_api_working()
 
     def __set_environmental_variables(self):
@@ -50,6 +84,7 @@ class RobinhoodCryptoAPI:
         return "?" + "&".join(params)
 
     def make_api_request(self, method: str, path: str, body: str = "") -> Any:
+        self.rate_limiter.acquire()
         timestamp = self._get_current_timestamp()
         headers = self.get_authorization_header(method, path, body, timestamp)
         url = self.base_url + path
@@ -59,9 +94,9 @@ class RobinhoodCryptoAPI:
             try:
                 response = {}
                 if method == "GET":
-                    response = requests.get(url, headers=headers, timeout=10)
+                    response = self.session.get(url, headers=headers, timeout=10)
                 elif method == "POST":
-                    response = requests.post(url, headers=headers, json=json.loads(body), timeout=10)
+                    response = self.session.post(url, headers=headers, json=json.loads(body) if body else None, timeout=10)
                 if response.status_code == 401:
                     if __oos_env_var == "retryingRequest":
                         raise requests.RequestException(response.status_code)
@@ -0,0 +1,326 @@
+"""
+Offline benchmarks for the data collection and strategy hot paths.
+
+Usage:
+  python3 -m benchmarks.run --scales 1000,100000 --output benchmarks/results/latest.json
+  python3 -m benchmarks.run --baseline benchmarks/results/baseline.json
+
+The Robinhood API is replaced by a stub so nothing here touches the network.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import src.datacollection as datacollection_module
+from benchmarks.synthetic import generate_ohlc, to_backtest_frame, write_ohlc_csv
+
+TICKER = "BENCH-USD"
+
+
+class StubRobinhoodCryptoAPI:
+  """Answers the calls DataCollection and RobinCrypto make without any I/O."""
+  def __init__(self, price: float=100000.0):
+    self.price = price
+
+  def get_account(self):
+    return {"buying_power": "100000"}
+
+  def get_holdings(self, *asset_codes):
+    return {"results": []}
+
+  def get_best_bid_ask(self, *symbols):
+    return {"results": [{"symbol": s, "price": str(self.price), "bid_inclusive_of_sell_spread": str(self.price), "ask_inclusive_of_buy_spread": str(self.price)} for s in symbols]}
+
+  def get_estimated_price(self, symbol, side, quantity):
+    return {"results": []}
+
+  def place_order(self, **kwargs):
+    return {"id": "bench"}
+
+  def get_order(self, order_id):
+    return {"state": "filled"}
+
+  def cancel_order(self, order_id):
+    return {}
+
+  def get_orders(self):
+    return {"results": []}
+
+
+def _install_stub_api() -> None:
+  datacollection_module.RobinhoodCryptoAPI = StubRobinhoodCryptoAPI
+
+
+def measure(fn: Callable[[], Optional[int]], repeat: int=3) -> Dict[str, float]:
+  """
+  Runs fn `repeat` times and reports the best wall time, the number of items the
+  call reported processing and the peak Python allocation of one extra traced run.
+  """
+  best = float("inf")
+  items = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    items = fn()
+    best = min(best, time.perf_counter() - start)
+
+  tracemalloc.start()
+  fn()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  result = {"seconds": best, "peak_mb": peak / 1024 / 1024}
+  if items:
+    result["items"] = items
+    result["items_per_sec"] = items / best if best > 0 else float("inf")
+  return result
+
+
+def bench_datacollection(folderpath: str, rows: int, repeat: int) -> Dict[str, Dict]:
+  filepath = os.path.join(folderpath, f"{TICKER}-1min-data.csv")
+  write_ohlc_csv(filepath, rows)
+  results = {}
+
+  def load():
+    dc = datacollection_module.DataCollection(folderpath)
+    return dc._try_load_inmemory_ohcl(TICKER)
+  results["try_load_inmemory_ohcl"] = measure(load, repeat)
+
+  dc = datacollection_module.DataCollection(folderpath)
+  dc._try_load_inmemory_ohcl(TICKER)
+
+  def get_df():
+    for _ in range(1000):
+      dc.get_ticker_df(TICKER, max=250)
+    return 1000
+  results["get_ticker_df_max250"] = measure(get_df, repeat)
+
+  def get_last_line():
+    for _ in range(1000):
+      dc._DataCollection__get_last_line(TICKER)
+    return 1000
+  results["get_last_line"] = measure(get_last_line, repeat)
+
+  appends = min(rows, 2000)
+  candles = generate_ohlc(appends, seed=1)
+  values = list(candles.itertuples(index=False, name=None))
+
+  def add_inmemory():
+    dc_append = datacollection_module.DataCollection(folderpath)
+    dc_append._try_load_inmemory_ohcl(TICKER)
+    for timestamp, open_, high_, low_, close_ in values:
+      dc_append._DataCollection__add_inmemory_ohlc(TICKER, timestamp, open_, high_, low_, close_)
+    return appends
+  results["add_inmemory_ohlc"] = measure(add_inmemory, repeat)
+  return results
+
+
+def bench_archive(folderpath: str, rows: int, repeat: int) -> Dict[str, Dict]:
+  import shutil
+  import pandas as pd
+  from src.archive import CandleArchive
+
+  filepath = os.path.join(folderpath, f"{TICKER}-1min-data.csv")
+  csv_copy = os.path.join(folderpath, "full-history.csv")
+  write_ohlc_csv(filepath, rows)
+  shutil.copyfile(filepath, csv_copy)
+  results = {}
+
+  def scan_csv():
+    return len(pd.read_csv(csv_copy))
+  results["history_scan_csv"] = measure(scan_csv, repeat)
+
+  archive = CandleArchive(folderpath)
+  archive.roll(TICKER, keep_days=0)
+
+  def scan_archive():
+    return len(archive.load(TICKER))
+  results["history_scan_archive"] = measure(scan_archive, repeat)
+
+  archive_bytes = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(archive.archive_folderpath) for name in names)
+  results["history_scan_archive"]["archive_bytes"] = archive_bytes + os.path.getsize(filepath)
+  results["history_scan_csv"]["csv_bytes"] = os.path.getsize(csv_copy)
+  return results
+
+
+def bench_ingest(ticks: int, repeat: int, tickers: int=4, ticks_per_minute: int=60) -> Dict[str, Dict]:
+  """
+  Replays synthetic ticks through DataCollection as fast as possible, through
+  candle building, CSV writes and a candle listener that wakes a strategy
+  thread the way StrategyHost does.
+  """
+  import concurrent.futures
+  from src.metrics import metrics
+  from src.sources import ReplaySource, synthetic_ticks
+
+  symbols = [f"BENCH{i}-USD" for i in range(tickers)]
+  wakeups: List[float] = []
+
+  def ingest():
+    wakeups.clear()
+    with tempfile.TemporaryDirectory() as folderpath, concurrent.futures.ThreadPoolExecutor(max_workers=1) as strategy:
+      source = ReplaySource(synthetic_ticks(symbols, ticks, ticks_per_minute=ticks_per_minute, start=1_700_000_000))
+      dc = datacollection_module.DataCollection(folderpath, tickers=list(symbols), api=StubRobinhoodCryptoAPI(), source=source)
+
+      def on_candle(ticker):
+        closed_at = dc.get_candle_closed_at(ticker)
+        strategy.submit(lambda: wakeups.append(time.perf_counter() - closed_at))
+      for symbol in symbols:
+        dc.add_candle_listener(symbol, on_candle)
+      dc.run()
+    return ticks
+  results = {"replay_ingest": measure(ingest, repeat)}
+
+  wakeups.sort()
+  if wakeups:
+    results["replay_ingest"]["candles"] = len(wakeups)
+    results["replay_ingest"]["wakeup_p50_ms"] = wakeups[len(wakeups) // 2] * 1000
+    results["replay_ingest"]["wakeup_p99_ms"] = wakeups[min(len(wakeups) - 1, int(len(wakeups) * 0.99))] * 1000
+  finalize = metrics.timer("data.candle_finalize").summary()
+  if "p50_ms" in finalize:
+    results["replay_ingest"]["finalize_p50_ms"] = finalize["p50_ms"]
+  return results
+
+
+def bench_indicators(rows: int, repeat: int) -> Dict[str, Dict]:
+  from src import backtest
+
+  df = generate_ohlc(rows)
+  high, low, close = (df[c].to_numpy() for c in ("High", "Low", "Close"))
+  indicators = {
+    "ema": lambda: backtest.ema(close, 21),
+    "rsi": lambda: backtest.rsi(close),
+    "adx": lambda: backtest.adx(high, low, close),
+    "ao": lambda: backtest.ao(high, low),
+    "bbands": lambda: backtest.bbands(close),
+    "atr": lambda: backtest.atr(high, low, close),
+  }
+  results = {}
+  for name, fn in indicators.items():
+    results[f"indicator_{name}"] = measure(lambda fn=fn: (fn(), rows)[1], repeat)
+  return results
+
+
+def bench_covariance(rows: int, repeat: int, tickers: int=100) -> Dict[str, Dict]:
+  """Streams up to `rows` minutes of returns for `tickers` tickers through both covariance estimators."""
+  from src.covariance import ReturnCovariance
+
+  minutes = min(rows, 20000)
+  returns = np.random.default_rng(0).normal(0, 1e-3, (minutes, tickers))
+  start = np.datetime64("2024-01-01T00:00")
+  symbols = [f"BENCH{i}-USD" for i in range(tickers)]
+  results = {}
+  for name, settings in (("ew", {"half_life": 60}), ("window", {"half_life": None, "window": 240})):
+    def stream(settings=settings):
+      covariance = ReturnCovariance(symbols, **settings)
+      for i in range(minutes):
+        covariance.update(start + i, returns[i])
+      return minutes
+    results[f"covariance_{name}_update"] = measure(stream, repeat)
+  return results
+
+
+def bench_backtest(rows: int, repeat: int, optimize_rows: int) -> Dict[str, Dict]:
+  from backtesting import Backtest
+  from src.backtest import CryptoBacktest
+
+  df = to_backtest_frame(generate_ohlc(rows))
+  results = {}
+
+  def run():
+    Backtest(df, CryptoBacktest, cash=1000000, exclusive_orders=True).run()
+    return rows
+  results["backtest_run"] = measure(run, repeat)
+
+  if rows <= optimize_rows:
+    def optimize():
+      bt = Backtest(df, CryptoBacktest, cash=1000000, exclusive_orders=True)
+      bt.optimize(sl=[0.005, 0.01], tp=[0.005, 0.01], maximize="Sharpe Ratio")
+      return rows * 4
+    results["backtest_optimize"] = measure(optimize, 1)
+  return results
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+  regressions = []
+  for scale, benches in current["results"].items():
+    for name, result in benches.items():
+      base = baseline.get("results", {}).get(scale, {}).get(name)
+      if not base:
+        continue
+      ratio = result["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+      marker = "REGRESSION" if ratio > threshold else ""
+      print(f"{scale:>10} {name:<28} {base['seconds']*1000:10.2f}ms -> {result['seconds']*1000:10.2f}ms  x{ratio:5.2f} {marker}")
+      if ratio > threshold:
+        regressions.append(f"{scale}/{name}")
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmarks for zorro's data and strategy hot paths.")
+  parser.add_argument("--scales", default="1000,10000,100000", help="Comma separated row counts, up to 10000000.")
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--suites", default="data,archive,ingest,indicators,covariance,backtest")
+  parser.add_argument("--max-backtest-rows", type=int, default=200000, help="Skip backtests above this many rows.")
+  parser.add_argument("--max-optimize-rows", type=int, default=20000, help="Skip optimize() above this many rows.")
+  parser.add_argument("--output", default="benchmarks/results/latest.json")
+  parser.add_argument("--baseline", default=None, help="Results JSON to compare against.")
+  parser.add_argument("--threshold", type=float, default=1.10, help="Slowdown ratio reported as a regression.")
+  args = parser.parse_args()
+
+  _install_stub_api()
+  warnings.filterwarnings("ignore", message="Some trades remain open")
+  suites = set(args.suites.split(","))
+  scales = [int(s) for s in args.scales.split(",")]
+
+  output = {
+    "created": datetime.datetime.now().isoformat(),
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "results": {},
+  }
+  for rows in scales:
+    results = {}
+    if "data" in suites:
+      with tempfile.TemporaryDirectory() as folderpath:
+        results.update(bench_datacollection(folderpath, rows, args.repeat))
+    if "archive" in suites:
+      with tempfile.TemporaryDirectory() as folderpath:
+        results.update(bench_archive(folderpath, rows, args.repeat))
+    if "ingest" in suites:
+      results.update(bench_ingest(rows, args.repeat))
+    if "indicators" in suites:
+      results.update(bench_indicators(rows, args.repeat))
+    if "covariance" in suites:
+      results.update(bench_covariance(rows, args.repeat))
+    if "backtest" in suites and rows <= args.max_backtest_rows:
+      results.update(bench_backtest(rows, args.repeat, args.max_optimize_rows))
+    output["results"][str(rows)] = results
+    for name, result in results.items():
+      throughput = f"{result['items_per_sec']:,.0f}/s" if "items_per_sec" in result else ""
+      print(f"{rows:>10} {name:<28} {result['seconds']*1000:10.2f}ms {throughput:>16} {result['peak_mb']:8.1f}MB")
+
+  os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+  with open(args.output, "w") as f:
+    json.dump(output, f, indent=2)
+  print(f"Saved results to {args.output}")
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(output, baseline, args.threshold)
+    if regressions:
+      raise SystemExit(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,93 @@
+import datetime
+import os
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["Timestamp", "Open", "High", "Low", "Close"]
+
+# (per-minute drift, per-minute volatility) for calm, trending and volatile markets
+DEFAULT_REGIMES: Sequence[Tuple[float, float]] = (
+  (0.0, 0.0004),
+  (0.00005, 0.0008),
+  (-0.00008, 0.0025),
+)
+
+
+def generate_ohlc(rows: int,
+                  start_price: float=100000.0,
+                  end: Optional[datetime.datetime]=None,
+                  regimes: Sequence[Tuple[float, float]]=DEFAULT_REGIMES,
+                  mean_regime_length: int=240,
+                  seed: int=0) -> pd.DataFrame:
+  """
+  Generates a one-minute OHLC random walk that switches between (drift, volatility)
+  regimes, with the last candle ending right before `end` (the current minute by
+  default) so DataCollection sees the data as contiguous.
+  """
+  rng = np.random.default_rng(seed)
+  if end is None:
+    end = datetime.datetime.now().replace(second=0, microsecond=0)
+  end = end.replace(second=59) - datetime.timedelta(minutes=1)
+
+  # Regime switches happen with probability 1 / mean_regime_length each minute
+  switches = rng.random(rows) < 1.0 / mean_regime_length
+  regime_idx = (np.cumsum(switches) + rng.integers(len(regimes))) % len(regimes)
+  drift = np.asarray([r[0] for r in regimes])[regime_idx]
+  vol = np.asarray([r[1] for r in regimes])[regime_idx]
+
+  log_returns = drift + vol * rng.standard_normal(rows)
+  close = start_price * np.exp(np.cumsum(log_returns))
+  open_ = np.empty(rows)
+  open_[0] = start_price
+  open_[1:] = close[:-1]
+  wick = vol * np.abs(rng.standard_normal((2, rows)))
+  high = np.maximum(open_, close) * (1 + wick[0])
+  low = np.minimum(open_, close) * (1 - wick[1])
+
+  timestamps = pd.date_range(end=end, periods=rows, freq="min")
+  return pd.DataFrame({
+    "Timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+    "Open": open_,
+    "High": high,
+    "Low": low,
+    "Close": close,
+  }, columns=COLUMNS)
+
+
+def write_ohlc_csv(filepath: str, rows: int, chunk_rows: int=1_000_000, **kwargs) -> str:
+  """
+  Writes `rows` synthetic candles to `filepath` in the collector's CSV format.
+  Large files are generated in chunks so 10M rows do not need to fit in memory
+  at once.
+  """
+  os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+  end = kwargs.pop("end", None)
+  if end is None:
+    end = datetime.datetime.now().replace(second=0, microsecond=0)
+  seed = kwargs.pop("seed", 0)
+  start_price = kwargs.pop("start_price", 100000.0)
+
+  with open(filepath, "w") as file:
+    file.write(",".join(COLUMNS) + "\n")
+    written = 0
+    chunk = 0
+    while written < rows:
+      n = min(chunk_rows, rows - written)
+      chunk_end = end - datetime.timedelta(minutes=rows - written - n)
+      df = generate_ohlc(n, start_price=start_price, end=chunk_end, seed=seed + chunk, **kwargs)
+      df.to_csv(file, header=False, index=False, float_format="%.10g")
+      start_price = float(df["Close"].iloc[-1])
+      written += n
+      chunk += 1
+  return filepath
+
+
+def to_backtest_frame(df: pd.DataFrame) -> pd.DataFrame:
+  """Converts a generated frame to the Date indexed layout backtest.py reads."""
+  frame = df.copy()
+  frame["Date"] = pd.to_datetime(frame.pop("Timestamp"))
+  frame["Volume"] = 1.0
+  return frame.set_index("Date")
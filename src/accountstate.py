@@ -0,0 +1,126 @@
+import threading
+import time
+
+from typing import Dict, Optional
+
+from src.log import log
+l = log(__file__)
+
+
+class AccountSnapshot:
+  """
+    Immutable view of the account at one point in time. AccountState swaps in a
+    new snapshot on every refresh or fill so readers never see a half update.
+  """
+  __slots__ = ("buying_power", "holdings", "available", "updated_at")
+
+  def __init__(self, buying_power: float, holdings: Dict[str, float], available: Dict[str, float], updated_at: float):
+    self.buying_power: float = buying_power
+    self.holdings: Dict[str, float] = holdings
+    self.available: Dict[str, float] = available
+    self.updated_at: float = updated_at
+
+
+class AccountState:
+  """
+    Caches buying power and holdings so order entry does not need an account
+    round-trip. A background thread refreshes the cache every refresh_interval
+    seconds, which also keeps the API connection warm, and fills are applied
+    immediately so sizing between refreshes stays close to the real account.
+
+    Usage:
+      account = AccountState(api)
+      account.start()
+      account.buying_power
+  """
+  def __init__(self, api, refresh_interval: float=15.0):
+    self.refresh_interval: float = refresh_interval
+
+    self.__api = api
+    self.__snapshot: Optional[AccountSnapshot] = None
+    self.__write_lock = threading.Lock()
+    self.__stop_event = threading.Event()
+    self.__refresh_thread: Optional[threading.Thread] = None
+
+  def start(self) -> None:
+    if self.__refresh_thread is not None and self.__refresh_thread.is_alive():
+      return
+    self.refresh()
+    self.__refresh_thread = threading.Thread(target=self.__run_refresh, daemon=True)
+    self.__refresh_thread.start()
+
+  @property
+  def snapshot(self) -> Optional[AccountSnapshot]:
+    """The cached account, refreshed on demand. None while the account could never be read."""
+    snapshot = self.__snapshot
+    if snapshot is None:
+      snapshot = self.refresh()
+    return snapshot
+
+  @property
+  def buying_power(self) -> float:
+    """0.0 while the account could never be read, so nothing gets sized off an unknown balance."""
+    snapshot = self.snapshot
+    return snapshot.buying_power if snapshot is not None else 0.0
+
+  def holding(self, asset_code: str) -> float:
+    """The total quantity held, including coins locked by resting orders such as a bracket's stop-loss."""
+    snapshot = self.snapshot
+    return snapshot.holdings.get(asset_code, 0.0) if snapshot is not None else 0.0
+
+  def available(self, asset_code: str) -> float:
+    """The quantity free to trade, which leaves out coins locked by resting orders."""
+    snapshot = self.snapshot
+    return snapshot.available.get(asset_code, 0.0) if snapshot is not None else 0.0
+
+  def refresh(self) -> Optional[AccountSnapshot]:
+    account_data = self.__api.get_account()
+    if not account_data or "buying_power" not in account_data:
+      l.warn(f"Could not refresh account state: {account_data}")
+      return self.__snapshot
+
+    holdings: Dict[str, float] = {}
+    available: Dict[str, float] = {}
+    holdings_data = self.__api.get_holdings()
+    if holdings_data and "results" in holdings_data:
+      for holding in holdings_data["results"]:
+        total = float(holding.get("total_quantity", 0) or 0)
+        holdings[holding["asset_code"]] = total
+        available[holding["asset_code"]] = float(holding.get("quantity_available_for_trading", total) or 0)
+    elif self.__snapshot is not None:
+      holdings = self.__snapshot.holdings
+      available = self.__snapshot.available
+
+    with self.__write_lock:
+      self.__snapshot = AccountSnapshot(float(account_data["buying_power"]), holdings, available, time.monotonic())
+    return self.__snapshot
+
+  def apply_fill(self, ticker: str, side: str, asset_quantity: float, price: float) -> None:
+    """
+    Updates the cached buying power and holdings for a filled order until the
+    next refresh reconciles them with the account.
+    """
+    asset_code = ticker.split("-")[0]
+    sign = 1 if side == "buy" else -1
+    with self.__write_lock:
+      snapshot = self.__snapshot
+      if snapshot is None:
+        return
+      holdings = dict(snapshot.holdings)
+      holdings[asset_code] = max(0.0, holdings.get(asset_code, 0.0) + sign * asset_quantity)
+      # Whether a sold quantity was locked by a stop is unknown here, so the
+      # available quantity is only kept within the total until the next refresh
+      available = dict(snapshot.available)
+      available[asset_code] = min(available.get(asset_code, 0.0) + max(sign, 0) * asset_quantity, holdings[asset_code])
+      buying_power = snapshot.buying_power - sign * asset_quantity * price
+      self.__snapshot = AccountSnapshot(buying_power, holdings, available, snapshot.updated_at)
+
+  def __run_refresh(self) -> None:
+    while not self.__stop_event.wait(self.refresh_interval):
+      try:
+        self.refresh()
+      except Exception as e:
+        l.warn(f"Account state refresh failed: {e}")
+
+  def stop(self) -> None:
+    self.__stop_event.set()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from backtesting import Backtest, Strategy
 import talib
@@ -8,6 +9,9 @@ import pprint
 import multiprocessing as mp
 mp.set_start_method('fork')
 
+from src import intrabar
+from src.robustness import returns_from_stats, robustness
+
 def ema(series, period):
     return talib.EMA(series, timeperiod=period)
 
@@ -30,21 +34,62 @@ def bbands(close, period=5, nbdev=2):
 def atr(high, low, close, period=14):
     return talib.ATR(high, low, close, timeperiod=period)
 
+def shift(series, periods):
+    """The value `periods` bars back at every bar, NaN where there is none."""
+    series = np.asarray(series, dtype=float)
+    shifted = np.full_like(series, np.nan)
+    if periods < len(series):
+        shifted[periods:] = series[:len(series) - periods]
+    return shifted
+
+def rules_to_mask(reject=(), require=()):
+    """
+    Combines per-bar boolean rule arrays into one entry mask: True on bars where
+    every `require` rule holds and no `reject` rule does. Comparisons against
+    NaN are False in NumPy just like the scalar comparisons they replace, so a
+    missing indicator value neither rejects nor satisfies a rule.
+
+    Compute the masks once in Strategy.init() and look them up by bar index in
+    next(), e.g. `self.long_mask[len(self.data) - 1]`.
+    """
+    rules = [np.asarray(rule, dtype=bool) for rule in require] + [~np.asarray(rule, dtype=bool) for rule in reject]
+    if not rules:
+        raise ValueError("rules_to_mask needs at least one rule.")
+    mask = rules[0].copy()
+    for rule in rules[1:]:
+        mask &= rule
+    return mask
+
 
 class CryptoBacktest(Strategy):
     """
     Example strategy with sl and tp as hyper-parameters.
     You can run optimize() to find the best combination.
+
+    backtesting.py fills the stop loss whenever a bar touches both levels. With
+    resolve_intrabar=True such bars are decided like intrabar.resolve() does
+    (from intrabar_ticks, a (times, prices) pair from intrabar.load_ticks, when
+    they cross a level and from the modeled path otherwise) by lifting the stop
+    for a bar where the take profit comes first. The equity path and the size
+    of every later trade then follow from the corrected fills.
     """
 
     # -- Declare these as *class attributes* to allow optimization --
     sl = 0.02   # default stop-loss ratio
     tp = 0.01   # default take-profit ratio
+    resolve_intrabar = False
+    intrabar_ticks = None
 
     def init(self):
         close = self.data.Close
         high  = self.data.High
         low   = self.data.Low
+        # init() sees every bar; next() only the bars up to the current one
+        self.full_df = self.data.df
+        self.bar_open = self.full_df["Open"].to_numpy(dtype=float)
+        self.bar_high = self.full_df["High"].to_numpy(dtype=float)
+        self.bar_low  = self.full_df["Low"].to_numpy(dtype=float)
+        self.deferred_sl = None
 
         self.ema5    = self.I(ema, close, 5)
         self.ema21   = self.I(ema, close, 21)
@@ -55,57 +100,86 @@ class CryptoBacktest(Strategy):
         self.b_upper, self.b_mid, self.b_lower = self.I(bbands, close, 5, 2)
         self.atr_arr = self.I(atr, high, low, close, 14)
 
+        self.long_mask, self.short_mask = self.signal_masks()
+
+    def signal_masks(self):
+        close   = np.asarray(self.data.Close)
+        ema5    = np.asarray(self.ema5)
+        ema21   = np.asarray(self.ema21)
+        ema50   = np.asarray(self.ema50)
+        ema200  = np.asarray(self.ema200)
+        adx_val = np.asarray(self.adx_arr)
+        ao_val  = np.asarray(self.ao_arr)
+        upper   = np.asarray(self.b_upper)
+        lower   = np.asarray(self.b_lower)
+        atr_val = np.asarray(self.atr_arr)
+        atr_val10 = shift(atr_val, 9)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bb_ratio = (close - lower) / (upper - lower)
+        band_width = upper != lower
+
+        long_mask = rules_to_mask(reject=(
+            ema50 <= ema200,
+            ema5 <= ema21,
+            np.where(band_width, bb_ratio, 0) < 0.75,
+            adx_val < 15,
+            ao_val < 0.25,
+            atr_val <= atr_val10,
+        ))
+        short_mask = rules_to_mask(reject=(
+            ema50 >= ema200,
+            ema5 >= ema21,
+            np.where(band_width, bb_ratio, 1) > 0.25,
+            adx_val < 15,
+            ao_val > -0.25,
+            atr_val <= atr_val10,
+        ))
+        return long_mask, short_mask
+
     def find_position(self):
-        ema5    = self.ema5[-1]
-        ema21   = self.ema21[-1]
-        ema50   = self.ema50[-1]
-        ema200  = self.ema200[-1]
-        adx_val = self.adx_arr[-1]
-        ao_val  = self.ao_arr[-1]
-        upper   = self.b_upper[-1]
-        lower   = self.b_lower[-1]
-        close   = self.data.Close[-1]
-        atr_val = self.atr_arr[-1]
-        atr_val10 = self.atr_arr[-10]
-
-        def should_long():
-            bb_percent = (close - lower) / (upper - lower) if upper != lower else 0
-            if (
-                ema50 <= ema200
-                or ema5 <= ema21
-                or bb_percent < 0.75
-                or (adx_val is None or adx_val < 15)
-                or (ao_val is None or ao_val < 0.25)
-                or (atr_val <= atr_val10)
-            ):
-                return False
-            return True
-
-        def should_short():
-            bb_percent = (close - lower) / (upper - lower) if upper != lower else 1
-            if (
-                ema50 >= ema200
-                or ema5 >= ema21
-                or bb_percent > 0.25
-                or (adx_val is None or adx_val < 15)
-                or (ao_val is None or ao_val > -0.25)
-                or (atr_val <= atr_val10)
-            ):
-                return False
-            return True
-
-        long_trade = should_long()
-        short_trade = should_short()
-        return long_trade, short_trade
+        i = len(self.data) - 1
+        return self.long_mask[i], self.short_mask[i]
+
+    def tp_first(self, bar, size, sl, tp):
+        # Most bars don't touch both levels, so they are ruled out here before
+        # intrabar.tp_first builds its frame and looks up ticks
+        upper, lower = (tp, sl) if size > 0 else (sl, tp)
+        if not (self.bar_high[bar] >= upper and self.bar_low[bar] <= lower and lower < self.bar_open[bar] < upper):
+            return None
+        times, prices = self.intrabar_ticks if self.intrabar_ticks is not None else (None, None)
+        return intrabar.tp_first(self.full_df, bar, size, sl, tp, times, prices)
+
+    def resolve_next_bar(self):
+        """Lifts the stop of open trades for the next bar when it reaches the take profit first."""
+        for trade in self.trades:
+            # A stop lifted for the entry bar goes back on once that bar is past
+            if trade.sl is None and self.deferred_sl is not None:
+                trade.sl = self.deferred_sl
+        self.deferred_sl = None
+        bar = len(self.data)
+        if bar >= len(self.full_df):
+            return
+        for trade in self.trades:
+            if trade.sl is not None and trade.tp is not None and self.tp_first(bar, trade.size, trade.sl, trade.tp):
+                trade.sl = None
 
     def next(self):
+        if self.resolve_intrabar:
+            self.resolve_next_bar()
         long_trade, short_trade = self.find_position()
         close = self.data.Close[-1]
 
         if long_trade:
             sl_price = (1 - self.sl) * close
             tp_price = (1 + self.tp) * close
-            self.buy(sl=sl_price, tp=tp_price)
+            bar = len(self.data)
+            # The entry fills at the next bar's open and can exit in that same bar
+            if self.resolve_intrabar and bar < len(self.full_df) and self.tp_first(bar, 1, sl_price, tp_price):
+                self.buy(tp=tp_price)
+                self.deferred_sl = sl_price
+            else:
+                self.buy(sl=sl_price, tp=tp_price)
 
         # if short_trade:
         #     sl_price = (1 + self.sl) * close
@@ -113,7 +187,12 @@ class CryptoBacktest(Strategy):
         #     self.sell(sl=sl_price, tp=tp_price)
 
 
-def save_stats(name, csv_file, df, stats, sl = None, tp = None):
+def save_stats(name, csv_file, df, stats, sl = None, tp = None, resamples = 0):
+    """
+    Saves the stats of a run to saved_states/. With resamples > 0 the trade
+    returns are also bootstrap, block and shuffle resampled that many times and
+    the confidence intervals are saved under "Robustness".
+    """
     clean_stats = dict(stats)
 
     clean_stats.pop('_equity_curve', None)
@@ -134,6 +213,10 @@ def save_stats(name, csv_file, df, stats, sl = None, tp = None):
     stats_dict['StartDate'] = str(start_date)
     stats_dict['EndDate']   = str(end_date)
 
+    if resamples and len(stats['_trades']) >= 2:
+        returns, periods_per_year = returns_from_stats(stats, on='trades')
+        stats_dict['Robustness'] = robustness(returns, periods_per_year, resamples=resamples)
+
     with open(f'saved_states/{name}-{now_str}-{str(start_date)}-{str(end_date)}-{csv_file.split("/")[-1]}.json', 'w') as f:
         json.dump(stats_dict, f, indent=4)
 
@@ -160,4 +243,4 @@ if __name__ == '__main__':
     )
     pprint.pprint(optimized_stats)
     print(optimized_stats._strategy.sl, optimized_stats._strategy.tp)
-    save_stats("optimization",csv_file, df, optimized_stats, sl=optimized_stats._strategy.sl, tp=optimized_stats._strategy.tp)
+    save_stats("optimization",csv_file, df, optimized_stats, sl=optimized_stats._strategy.sl, tp=optimized_stats._strategy.tp, resamples=10000)
@@ -0,0 +1,107 @@
+import threading
+import pickle
+import time
+import os
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.log import log
+l = log(__file__)
+
+CHECKPOINT_VERSION = 4
+
+
+class Checkpointer:
+  """
+    Periodically snapshots the state of registered components to a single file
+    so a restarted collector or strategy process can pick up where it stopped.
+
+    Each component registers a save function returning picklable state and a
+    restore function taking that state back. The file is written to a temporary
+    path and swapped in with os.replace, so a crash mid-write never leaves a
+    torn checkpoint behind.
+
+    Usage:
+      checkpointer = Checkpointer("state/collector.ckpt", interval=5)
+      checkpointer.register("data", data.checkpoint_state, data.restore_checkpoint)
+      checkpointer.restore()
+      checkpointer.start()
+  """
+  def __init__(self, path: str, interval: float=5.0):
+    self.path: str = path
+    self.interval: float = interval
+
+    self.__components: Dict[str, Tuple[Callable[[], Any], Callable[[Any], None]]] = {}
+    self.__stop_event = threading.Event()
+    self.__thread: Optional[threading.Thread] = None
+    self.__save_lock = threading.Lock()
+
+  def register(self, name: str, save: Callable[[], Any], restore: Callable[[Any], None]) -> None:
+    self.__components[name] = (save, restore)
+
+  def start(self) -> None:
+    if self.__thread is not None and self.__thread.is_alive():
+      return
+    self.__thread = threading.Thread(target=self.__run, name="checkpointer", daemon=True)
+    self.__thread.start()
+
+  def save(self) -> None:
+    state = {"version": CHECKPOINT_VERSION, "saved_at": time.time(), "components": {}}
+    for name, (save, _) in list(self.__components.items()):
+      try:
+        state["components"][name] = save()
+      except Exception as e:
+        l.warn(f"Could not checkpoint {name}: {e}")
+
+    with self.__save_lock:
+      os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+      tmp_path = f"{self.path}.tmp"
+      with open(tmp_path, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, self.path)
+
+  def load(self) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(self.path):
+      return None
+    try:
+      with open(self.path, "rb") as file:
+        state = pickle.load(file)
+    except Exception as e:
+      l.warn(f"Ignoring unreadable checkpoint {self.path}: {e}")
+      return None
+    if state.get("version") != CHECKPOINT_VERSION:
+      l.warn(f"Ignoring checkpoint {self.path} with version {state.get('version')}")
+      return None
+    return state
+
+  def restore(self, state: Optional[Dict[str, Any]]=None) -> bool:
+    """
+    Restores every registered component found in the checkpoint, or in state
+    when it was already load()ed. Returns False if there was none.
+    """
+    if state is None:
+      state = self.load()
+    if state is None:
+      return False
+    start = time.perf_counter()
+    for name, (_, restore) in self.__components.items():
+      if name not in state["components"]:
+        continue
+      try:
+        restore(state["components"][name])
+      except Exception as e:
+        l.warn(f"Could not restore {name} from checkpoint: {e}")
+    l.info(f"Restored checkpoint from {time.time() - state['saved_at']:.1f}s ago in {(time.perf_counter() - start) * 1000:.1f}ms")
+    return True
+
+  def __run(self) -> None:
+    while not self.__stop_event.wait(self.interval):
+      try:
+        self.save()
+      except Exception as e:
+        l.warn(f"Checkpoint to {self.path} failed: {e}")
+
+  def stop(self, final_save: bool=True) -> None:
+    self.__stop_event.set()
+    if final_save:
+      self.save()
@@ -0,0 +1,240 @@
+import math
+import threading
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.log import log
+l = log(__file__)
+
+_MINUTE = np.timedelta64(1, "m")
+
+
+class CovarianceSnapshot:
+  """
+    Immutable covariance and correlation of one-minute log returns as of one
+    minute. Pairs with fewer than min_periods common observations are NaN.
+
+    Attributes:
+      minute (Optional[np.datetime64]): Newest minute included.
+      tickers (List[str]): Ticker of every row and column.
+      covariance (np.ndarray): (ticker, ticker) read-only covariance matrix.
+      correlation (np.ndarray): (ticker, ticker) read-only correlation matrix.
+      observations (np.ndarray): Number of minutes both tickers of every pair had a return.
+  """
+  __slots__ = ("minute", "tickers", "covariance", "correlation", "observations", "_index")
+
+  def __init__(self,
+               minute: Optional[np.datetime64],
+               tickers: List[str],
+               covariance: np.ndarray,
+               correlation: np.ndarray,
+               observations: np.ndarray):
+    for array in (covariance, correlation, observations):
+      array.flags.writeable = False
+    self.minute: Optional[np.datetime64] = minute
+    self.tickers: List[str] = tickers
+    self.covariance: np.ndarray = covariance
+    self.correlation: np.ndarray = correlation
+    self.observations: np.ndarray = observations
+    self._index: Dict[str, int] = {ticker: i for i, ticker in enumerate(tickers)}
+
+  def __setattr__(self, name, value):
+    if hasattr(self, name):
+      raise AttributeError("CovarianceSnapshot is immutable.")
+    object.__setattr__(self, name, value)
+
+  @property
+  def volatility(self) -> np.ndarray:
+    """Standard deviation of one-minute log returns of every ticker."""
+    return np.sqrt(np.diag(self.covariance))
+
+  def correlation_between(self, a: str, b: str) -> float:
+    return float(self.correlation[self._index[a], self._index[b]])
+
+  def correlated_exposure(self, ticker: str, exposures: Dict[str, float]) -> float:
+    """
+    Sum of the exposures (position values) weighted by their positive
+    correlation with ticker. A ticker with no estimate yet counts fully, so an
+    unknown relationship never loosens a limit.
+    """
+    i = self._index.get(ticker)
+    total = 0.0
+    for other, exposure in exposures.items():
+      j = self._index.get(other)
+      correlation = 1.0 if i is None or j is None else self.correlation[i, j]
+      total += exposure * (1.0 if math.isnan(correlation) else max(correlation, 0.0))
+    return total
+
+
+class ReturnCovariance:
+  """
+    Streaming covariance and correlation matrices of one-minute log returns
+    for a universe of tickers, fed one completed minute at a time.
+
+    Both estimators keep weighted sums of the common observations of every pair
+    (count, sum of squared weights, sum and sum of squares of each side, sum of
+    products), so a minute costs O(tickers^2) no matter how long the history is,
+    and a ticker missing a minute only drops out of the pairs it is part of.
+    Covariances are unbiased (pandas' default bias=False) and correlations use
+    each pair's variances over the same common minutes, so they stay within
+    [-1, 1] with missing data:
+
+      half_life: exponentially weighted, each minute's weight halving after
+                 half_life minutes.
+      window:    equally weighted over the last `window` minutes, kept in a
+                 ring buffer. The sums are rebuilt from the buffer once per
+                 lap so rounding errors from subtracting old rows don't pile up.
+
+    Every update publishes a new CovarianceSnapshot with one reference swap,
+    so snapshot() is free and readers never need a lock.
+
+    Usage:
+      covariance = ReturnCovariance(["BTC-USD", "ETH-USD"], half_life=60)
+      covariance.attach(data.get_panel(["BTC-USD", "ETH-USD"]))
+      covariance.snapshot().correlation_between("BTC-USD", "ETH-USD")
+  """
+  def __init__(self,
+               tickers: Sequence[str],
+               half_life: Optional[float]=60.0,
+               window: Optional[int]=None,
+               min_periods: int=30):
+    if (half_life is None) == (window is None):
+      raise ValueError("Use either half_life (exponentially weighted) or window (rolling), not both.")
+    if window is not None and window < 2:
+      raise ValueError("window must be at least 2 minutes.")
+    self.tickers: List[str] = list(tickers)
+    self.half_life: Optional[float] = half_life
+    self.window: Optional[int] = window
+    self.min_periods: int = min_periods
+
+    n = len(self.tickers)
+    self.__decay: float = 0.5 ** (1 / half_life) if half_life is not None else 1.0
+    self.__count = np.zeros((n, n))
+    self.__square_weights = np.zeros((n, n))
+    self.__sums = np.zeros((n, n))
+    self.__sum_squares = np.zeros((n, n))
+    self.__products = np.zeros((n, n))
+    self.__observations = np.zeros((n, n))
+    if window is not None:
+      self.__returns = np.zeros((window, n))
+      self.__valid = np.zeros((window, n))
+      self.__head: int = 0
+    self.__last_minute: Optional[np.datetime64] = None
+    self.__lock = threading.Lock()
+    self.__snapshot: CovarianceSnapshot = self.__build_snapshot()
+
+  def snapshot(self) -> CovarianceSnapshot:
+    return self.__snapshot
+
+  def attach(self, panel) -> "ReturnCovariance":
+    """Seeds from a CandlePanel's history and then updates on every minute it completes."""
+    view = panel.view()
+    if panel.tickers != self.tickers:
+      raise ValueError("The panel must have the same tickers, in the same order.")
+    if len(view) > 1:
+      with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.log(view.close[1:] / view.close[:-1])
+      self.seed(returns, view.times[-1])
+
+    def __on_minute(minute):
+      view = panel.view()
+      row = len(view) - 1 - int((view.times[-1] - minute) // _MINUTE)
+      if row < 1:
+        return
+      with np.errstate(divide="ignore", invalid="ignore"):
+        self.update(minute, np.log(view.close[row] / view.close[row - 1]))
+
+    panel.add_listener(__on_minute)
+    return self
+
+  def seed(self, returns: np.ndarray, minute: Optional[np.datetime64]=None) -> None:
+    """Replaces the state with a (minutes, tickers) array of returns, oldest first, NaN where missing."""
+    returns = np.asarray(returns, dtype=np.float64)
+    with self.__lock:
+      if self.window is not None:
+        returns = returns[-self.window:]
+        rows = len(returns)
+        self.__returns[:] = 0
+        self.__valid[:] = 0
+        self.__returns[:rows], self.__valid[:rows] = _split(returns)
+        self.__head = rows % self.window
+        self.__rebuild()
+      else:
+        values, valid = _split(returns)
+        weights = self.__decay ** np.arange(len(returns) - 1, -1, -1)[:, None]
+        self.__count = (weights * valid).T @ valid
+        self.__square_weights = (weights * weights * valid).T @ valid
+        self.__sums = (weights * values).T @ valid
+        self.__sum_squares = (weights * values * values).T @ valid
+        self.__products = (weights * values).T @ values
+        self.__observations = valid.T @ valid
+      self.__last_minute = minute
+      self.__snapshot = self.__build_snapshot()
+
+  def update(self, minute: np.datetime64, returns: np.ndarray) -> CovarianceSnapshot:
+    """Adds one minute of returns (NaN where a ticker has none) and publishes the new snapshot."""
+    value, valid = _split(np.asarray(returns, dtype=np.float64))
+    with self.__lock:
+      if self.__last_minute is not None and minute <= self.__last_minute:
+        return self.__snapshot
+      if self.window is not None:
+        old_value, old_valid = self.__returns[self.__head].copy(), self.__valid[self.__head].copy()
+        self.__returns[self.__head], self.__valid[self.__head] = value, valid
+        self.__head = (self.__head + 1) % self.window
+        if self.__head == 0:
+          self.__rebuild()
+        else:
+          self.__count += np.outer(valid, valid) - np.outer(old_valid, old_valid)
+          self.__sums += np.outer(value, valid) - np.outer(old_value, old_valid)
+          self.__sum_squares += np.outer(value * value, valid) - np.outer(old_value * old_value, old_valid)
+          self.__products += np.outer(value, value) - np.outer(old_value, old_value)
+      else:
+        self.__count *= self.__decay
+        self.__square_weights *= self.__decay * self.__decay
+        self.__sums *= self.__decay
+        self.__sum_squares *= self.__decay
+        self.__products *= self.__decay
+        self.__count += np.outer(valid, valid)
+        self.__square_weights += np.outer(valid, valid)
+        self.__sums += np.outer(value, valid)
+        self.__sum_squares += np.outer(value * value, valid)
+        self.__products += np.outer(value, value)
+        self.__observations += np.outer(valid, valid)
+      self.__last_minute = minute
+      self.__snapshot = self.__build_snapshot()
+      return self.__snapshot
+
+  def __rebuild(self) -> None:
+    values, valid = self.__returns, self.__valid
+    self.__count = valid.T @ valid
+    self.__sums = values.T @ valid
+    self.__sum_squares = (values * values).T @ valid
+    self.__products = values.T @ values
+
+  def __build_snapshot(self) -> CovarianceSnapshot:
+    count = self.__count
+    # A rolling pair's weights are all 1, so its weighted count is its number
+    # of common minutes and so is its sum of squared weights
+    observations = count if self.window is not None else self.__observations
+    square_weights = count if self.window is not None else self.__square_weights
+    with np.errstate(divide="ignore", invalid="ignore"):
+      # sums[i, j] is the sum of i's returns over the minutes both i and j have one
+      means = self.__sums / count
+      # Weighted bias correction V1^2 / (V1^2 - V2), count / (count - 1) when unweighted
+      correction = count * count / (count * count - square_weights)
+      covariance = (self.__products / count - means * means.T) * correction
+      # i's variance over the minutes it shares with j, for the correlation of the pair
+      variance = (self.__sum_squares / count - means * means) * correction
+      correlation = covariance / np.sqrt(variance * variance.T)
+      too_few = observations < max(self.min_periods, 2)
+      covariance[too_few] = np.nan
+      correlation[too_few] = np.nan
+    return CovarianceSnapshot(self.__last_minute, self.tickers, covariance, correlation, observations.copy())
+
+
+def _split(returns: np.ndarray):
+  """Returns with NaN and inf replaced by 0, and the 1/0 mask of which were real."""
+  valid = np.isfinite(returns)
+  return np.where(valid, returns, 0.0), valid.astype(np.float64)
@@ -5,24 +5,174 @@ import threading
 import concurrent
 import asyncio
 
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
 import pandas as pd
 import aiofiles
 
 from api.robinhood_api_trading import RobinhoodCryptoAPI
 
+from src.archive import live_file_lock
+from src.checkpoint import Checkpointer
+from src.covariance import ReturnCovariance
+from src.metrics import metrics
+from src.panel import CandlePanel
+from src.quotecache import QuoteCache
+from src.sources import MarketDataSource, RobinhoodSource, Tick
 from src.log import log
 l = log(__file__)
 
+# Longest gap an event-time source may leave that is still filled with
+# interpolated candles; beyond that the replay is treated as a new session.
+_MAX_INTERPOLATED_MINUTES = 60
+FIELDS = ["Open", "High", "Low", "Close"]
+
+
+class PartialCandle(NamedTuple):
+  """
+    The candle being built for the current minute. Each price sample publishes
+    a new tuple, so readers always see a consistent Open/High/Low/Close.
+  """
+  minute: int
+  open: float
+  high: float
+  low: float
+  close: float
+
+  def add(self, price: float) -> "PartialCandle":
+    return PartialCandle(self.minute, self.open, max(self.high, price), min(self.low, price), price)
+
+
+class CandleWindow:
+  """
+    Immutable, versioned snapshot of a ticker's in-memory candles. Readers keep
+    using the window they got, with no locking and no copying.
+
+    Candles live in append-only buffers: datetime64[ns] timestamps and a
+    (4, capacity) array holding each of Open, High, Low and Close as one
+    contiguous row, ready for talib. A window only covers the first `length`
+    rows, which are never written again, so a new candle is written past them
+    and published as a new window over the same buffers. Full buffers are
+    copied into ones twice the size, and earlier windows keep the old ones.
+
+    The arrays and the DataFrame are shared by every reader and are read-only.
+
+    Attributes:
+      version (int): Increases by one with every candle added.
+      times (np.ndarray): datetime64[ns] timestamp of every candle.
+      values (np.ndarray): (4, candles) Open, High, Low and Close.
+      last (Optional[Tuple]): (timestamp, open, high, low, close) of the newest candle.
+  """
+  __slots__ = ("version", "times", "values", "last", "_times_buffer", "_values_buffer", "_df", "_tails")
+
+  def __init__(self, version: int, times_buffer: np.ndarray, values_buffer: np.ndarray, length: int):
+    times = times_buffer[:length]
+    values = values_buffer[:, :length]
+    times.flags.writeable = False
+    values.flags.writeable = False
+    self.version: int = version
+    self.times: np.ndarray = times
+    self.values: np.ndarray = values
+    self.last: Optional[Tuple] = (times[-1], *(float(v) for v in values[:, -1])) if length else None
+    self._times_buffer: np.ndarray = times_buffer
+    self._values_buffer: np.ndarray = values_buffer
+    self._df: Optional[pd.DataFrame] = None
+    self._tails: Dict[int, pd.DataFrame] = {}
+
+  def __setattr__(self, name, value):
+    if hasattr(self, name):
+      raise AttributeError("CandleWindow is immutable.")
+    object.__setattr__(self, name, value)
+
+  @classmethod
+  def from_rows(cls, timestamps, ohlc, version: int=0, dtype=np.float64, spare: int=1440) -> "CandleWindow":
+    """Window over new buffers holding the given candles, with room for `spare` more."""
+    times = np.asarray(timestamps, dtype="datetime64[ns]")
+    length = len(times)
+    times_buffer = np.empty(length + spare, dtype="datetime64[ns]")
+    values_buffer = np.empty((len(FIELDS), length + spare), dtype=dtype)
+    times_buffer[:length] = times
+    if length:
+      values_buffer[:, :length] = np.asarray(ohlc).T
+    return cls(version, times_buffer, values_buffer, length)
+
+  def append(self, timestamp: np.datetime64, open_: float, high_: float, low_: float, close_: float) -> "CandleWindow":
+    """The next window with one more candle. Only call it on the newest window of a ticker."""
+    length = len(self.times)
+    times_buffer, values_buffer = self._times_buffer, self._values_buffer
+    if length == len(times_buffer):
+      capacity = max(2 * length, 64)
+      times_buffer = np.empty(capacity, dtype=times_buffer.dtype)
+      values_buffer = np.empty((len(FIELDS), capacity), dtype=values_buffer.dtype)
+      times_buffer[:length] = self.times
+      values_buffer[:, :length] = self.values
+    times_buffer[length] = timestamp
+    values_buffer[:, length] = (open_, high_, low_, close_)
+    return CandleWindow(self.version + 1, times_buffer, values_buffer, length + 1)
+
+  @property
+  def df(self) -> pd.DataFrame:
+    """Open, High, Low and Close columns over the window's arrays, indexed by Timestamp. Built once per window."""
+    if self._df is None:
+      index = pd.DatetimeIndex(self.times, name="Timestamp", copy=False)
+      df = pd.DataFrame({field: self.values[i] for i, field in enumerate(FIELDS)}, index=index, copy=False)
+      object.__setattr__(self, "_df", df)
+    return self._df
+
+  def tail(self, max: Optional[int]=None) -> pd.DataFrame:
+    """The newest `max` rows of df. Strategies ask for the same few sizes every candle, so the views are kept."""
+    if not max:
+      return self.df
+    tail = self._tails.get(max)
+    if tail is None:
+      tail = self._tails.setdefault(max, self.df.iloc[-max:])
+    return tail
+
+  def arrays(self, max: Optional[int]=None) -> Dict[str, np.ndarray]:
+    """
+    Views of the newest `max` rows. talib only takes float64, so float32
+    windows are upcast here, which copies the requested rows on every call.
+    """
+    start = -max if max else 0
+    arrays = {"Timestamp": self.times[start:]}
+    if self.values.dtype == np.float64:
+      arrays.update({field: self.values[i, start:] for i, field in enumerate(FIELDS)})
+      return arrays
+    for i, field in enumerate(FIELDS):
+      column = self.values[i, start:].astype(np.float64)
+      column.flags.writeable = False
+      arrays[field] = column
+    return arrays
+
+
+def _parse_lines(lines: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+  """Timestamps and (rows, 4) OHLC of collector CSV lines."""
+  rows = [line.strip().split(",", 1) for line in lines]
+  timestamps = np.array([row[0] for row in rows], dtype="datetime64[ns]")
+  # One C-level parse of every price instead of a float() call per value
+  ohlc = np.fromstring(",".join([row[1] for row in rows]), sep=",") if rows else np.empty(0)
+  return timestamps, ohlc.reshape(len(rows), len(FIELDS))
+
+
+def _format_timestamp(timestamp: np.datetime64) -> str:
+  """The collector's "%Y-%m-%d %H:%M:%S" form of a window timestamp."""
+  return pd.Timestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
 
 class DataCollection:
   """
     Collects ticker data every k seconds and stores it in a csv file given by the user. 
     Also allows an interface that gives a threading.Event() signal that signals when new data came in
 
+    Prices come from a MarketDataSource, polling Robinhood by default. A
+    ReplaySource streams recorded or synthetic ticks instead, with minutes
+    finalized in event time.
+
     Attributes:
       folderpath (str): The path to the folder where the files will be created.
       tickers (List[str]): A list of strings containing tickers whose data will be collected.
+      dtype (np.dtype): Storage type of the in-memory prices. float32 halves their memory, but
+                        get_arrays() then upcasts the requested rows to float64 on every call.
 
     Usage:
       Run this class using the run() function to have the program collecting data.
@@ -30,13 +180,21 @@ class DataCollection:
   def __init__(self, 
                folderpath: str,
                tickers=None, 
-               interpolate_missing_data=True):
+               interpolate_missing_data=True,
+               quote_cache: Optional[QuoteCache]=None,
+               estimate_quantities: Optional[List[float]]=None,
+               estimate_interval: float=30.0,
+               api: Optional[RobinhoodCryptoAPI]=None,
+               source: Optional[MarketDataSource]=None,
+               dtype=np.float64):
     if not tickers:
       tickers = []
     if not isinstance(tickers, list):
       raise ValueError('Tickers should be a list of string. EG: ["BTC-USD", "ETH-USD"]')
-    if len(tickers) > 10:
+    if len(tickers) > 10 and (source is None or isinstance(source, RobinhoodSource)):
       raise ValueError("Cannot track more than 5 tickers at a time due to API limitations.")
+    if np.dtype(dtype) not in (np.float64, np.float32):
+      raise ValueError("dtype must be float64 or float32.")
     
     if folderpath[-1] != "/":
       folderpath += "/"
@@ -45,125 +203,305 @@ class DataCollection:
     self.tickers: List[str] = tickers
     self.folderpath: str = folderpath
     self.interpolate_missing_data: bool = interpolate_missing_data
-
-    self.__robinhood_api = RobinhoodCryptoAPI()
-    self.__inmemory_ohlc: Dict[str, Optional[pd.Dataframe]] = {}
-    if self.interpolate_missing_data:
-      self.__backup_price: Dict[str, float] = { ticker: -1 for ticker in self.tickers }
+    self.estimate_interval: float = estimate_interval
+    self.dtype: np.dtype = np.dtype(dtype)
+
+    self.__robinhood_api = api if api is not None else RobinhoodCryptoAPI()
+    self.source: MarketDataSource = source if source is not None else RobinhoodSource(self.__robinhood_api)
+    self.quotes: QuoteCache = quote_cache if quote_cache is not None else QuoteCache(self.__robinhood_api, estimate_quantities=estimate_quantities)
+    self.__last_estimate_refresh: Dict[str, float] = {}
+    # Both dicts only ever have whole immutable values swapped in, so readers
+    # never need a lock. Windows are written by the finalizer or the signal
+    # thread of a ticker, partial candles only by the source thread.
+    self.__windows: Dict[str, CandleWindow] = {}
+    self.__window_lock = threading.Lock()
+    self.__partial_candles: Dict[str, PartialCandle] = {}
+    # A tick of the next minute can arrive before the wall clock finalizer runs,
+    # so the candle it replaced is kept here until the finalizer has used it
+    self.__closed_partials: Dict[str, PartialCandle] = {}
     self.__current_price: Dict[str, float] = { ticker: -1 for ticker in self.tickers }
-    self.__minute_ohlc_data = {
-      ticker: {
-        "Open": None,
-        "High": float("-inf"),
-        "Low": float("inf"),
-        "Close": None,
-      } for ticker in self.tickers
-    }
 
     self.__ticker_signals: Dict[threading.Event] = {ticker: threading.Event() for ticker in self.tickers}
     self.__is_ticker_running = {ticker: False for ticker in self.tickers}
     self.__is_ticker_signal_active = {ticker: False for ticker in self.tickers}
     self.__ticker_threads: List = []
+    self.__price_listeners: List[Callable[[str, float], None]] = []
+    self.__candle_listeners: Dict[str, List[Callable[[str], None]]] = {}
+    self.__panels: Dict[tuple, CandlePanel] = {}
+    self.__covariances: Dict[tuple, ReturnCovariance] = {}
+    self.__covariance_lock = threading.Lock()
+    self.__candle_closed_at: Dict[str, float] = {}
     self.__stop_event: threading.Event = threading.Event()
     self.__candle_finalizer_executor = concurrent.futures.ThreadPoolExecutor()
 
-  def run(self):
+  def run(self, checkpoint_path: Optional[str]=None, checkpoint_interval: float=5.0):
     if self.tickers == []:
       raise RuntimeError("Cannot use run() if no tickers are set. Use set_tickers() or initialize the class with tickers to use the run() function.")
 
+    checkpointer = None
+    if checkpoint_path:
+      checkpointer = Checkpointer(checkpoint_path, interval=checkpoint_interval)
+      checkpointer.register("data", self.checkpoint_state, self.restore_checkpoint)
+      checkpointer.restore()
+      checkpointer.start()
+
     for ticker in self.tickers:
       self._try_load_inmemory_ohcl(ticker)
 
-    threading.Thread(target=self.__run_collect_minute_data).start()
+    source_thread = threading.Thread(target=self.__run_source, daemon=self.source.event_time)
+    source_thread.start()
 
     self.__ticker_threads = []
     for ticker in self.tickers:
       if ticker not in self.__is_ticker_running:
         self._add_ticker(ticker)
-      if not self.__is_ticker_running[ticker]:
+      # Event-time sources finalize minutes themselves as the ticks roll over
+      if not self.__is_ticker_running[ticker] and not self.source.event_time:
         self.__ticker_threads.append(self.__candle_finalizer_executor.submit(self.__run_finalize_minute_data, ticker))
   
     try:
-      concurrent.futures.wait(self.__ticker_threads)
+      if self.source.event_time:
+        source_thread.join()
+      else:
+        concurrent.futures.wait(self.__ticker_threads)
     except KeyboardInterrupt:
       self.stop()
+    finally:
+      if checkpointer is not None:
+        checkpointer.stop()
+
+  def checkpoint_state(self, max_rows: int=5000) -> Dict:
+    """
+    Compact snapshot of the in-progress candles and the newest max_rows of every
+    in-memory window, for Checkpointer.
+    """
+    windows = {}
+    for ticker, window in list(self.__windows.items()):
+      windows[ticker] = (
+        window.times[-max_rows:].copy(),
+        window.values[:, -max_rows:].T.astype(np.float64),
+      )
+    return {
+      "partial_candles": {ticker: tuple(candle) for ticker, candle in list(self.__partial_candles.items())},
+      "windows": windows,
+    }
+
+  def restore_checkpoint(self, state: Dict) -> None:
+    """
+    Restores a checkpoint_state() snapshot. The in-progress candle is only
+    restored when the checkpoint is from the current minute, and windows are
+    topped up with the lines written to the CSV since the checkpoint. A window
+    that is no longer contiguous up to now is left for _try_load_inmemory_ohcl.
+    """
+    minute = int(time.time() // 60)
+    for ticker, saved in state["partial_candles"].items():
+      saved = PartialCandle(*saved)
+      if saved.minute != minute:
+        continue
+      current = self.__partial_candles.get(ticker)
+      if current is None or current.minute != minute:
+        self.__partial_candles[ticker] = saved
+      else:
+        self.__partial_candles[ticker] = PartialCandle(minute, saved.open, max(saved.high, current.high), min(saved.low, current.low), current.close)
+
+    curr_minute = self.__get_curr_time_data()
+    restored = 0
+    for ticker, (timestamps, ohlc) in state["windows"].items():
+      if ticker in self.__windows or len(timestamps) == 0 or not os.path.exists(self._get_filepath(ticker)):
+        continue
+      newer_lines = self.__read_lines_after(ticker, _format_timestamp(timestamps[-1]))
+      if newer_lines:
+        newer_timestamps, newer_ohlc = _parse_lines(newer_lines)
+        timestamps = np.concatenate([timestamps, newer_timestamps])
+        ohlc = np.concatenate([ohlc, newer_ohlc])
+      if (pd.Timestamp(timestamps[-1]).minute + 1) % 60 != curr_minute:
+        continue
+      self.__windows.setdefault(ticker, CandleWindow.from_rows(timestamps, ohlc, dtype=self.dtype))
+      restored += 1
+    l.info(f"Restored {restored} in-memory windows from checkpoint")
+
+  def __read_lines_after(self, ticker: str, last_timestamp: str, block_size: int=65536) -> List[str]:
+    """
+    Returns the CSV lines with a timestamp after last_timestamp by reading the
+    file backwards in blocks, so only the tail written since then is parsed.
+    """
+    with open(self._get_filepath(ticker), "rb") as file:
+      file.seek(0, 2)
+      position = file.tell()
+      tail = b""
+      while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        file.seek(position)
+        tail = file.read(read_size) + tail
+        lines = tail.split(b"\n")
+        # lines[0] may be partial unless the start of the file was reached
+        complete = lines if position == 0 else lines[1:]
+        if any(line and line.split(b",")[0].decode() <= last_timestamp for line in complete):
+          break
+
+    newer = []
+    for line in reversed(tail.decode().split("\n")):
+      line = line.strip()
+      if not line:
+        continue
+      timestamp = line.split(",")[0]
+      if timestamp <= last_timestamp or not timestamp[:1].isdigit():
+        break
+      newer.append(line)
+    newer.reverse()
+    return newer
 
   def __run_finalize_minute_data(self, ticker: str):
     last_minute = None
     last_time = None
 
     while not self.__stop_event.is_set():
-      self.now = time.localtime()
-      current_minute = self.now.tm_min
+      now = time.time()
+      self.now = time.localtime(now)
+      current_minute = int(now // 60)
 
       if last_minute is not None and current_minute != last_minute:
-        asyncio.run(self.__finalize_ohlc(ticker, last_time))
+        asyncio.run(self.__finalize_ohlc(ticker, last_time, last_minute))
 
       last_minute = current_minute
       last_time = self.now
 
       time.sleep(0.1)
 
-  def __run_collect_minute_data(self):
-    while not self.__stop_event.is_set():
-      self.__collect_minute_data()
-      time.sleep(2)
-
-  def __collect_minute_data(self):
-    # TODO: Potentially get a better estimate with estimate_price api endpoint
-    resp = self.__robinhood_api.get_best_bid_ask(*self.tickers)
+  def __run_source(self):
+    try:
+      self.source.run(self.tickers, self.__on_ticks, self.__stop_event)
+    except Exception as e:
+      l.warn(f"Market data source {type(self.source).__name__} stopped: {e}")
+      return
+    # No later tick will roll the last replayed minute over, so close it here
+    if self.source.event_time and not self.__stop_event.is_set():
+      for ticker, partial in list(self.__partial_candles.items()):
+        asyncio.run(self.__finalize_ohlc(ticker, time.localtime(partial.minute * 60 + 59), partial.minute))
+
+  def __on_ticks(self, ticks: List[Tick]):
+    start = time.perf_counter()
+    for tick in ticks:
+      ticker = tick.ticker
+      if ticker not in self.__current_price:
+        continue
+      minute = int(tick.timestamp // 60)
+      if self.source.event_time:
+        self.__advance_event_time(ticker, minute)
+
+      current_price = tick.price
+      self.quotes.update(ticker, current_price, tick.bid, tick.ask)
+      partial = self.__partial_candles.get(ticker)
+      # Late samples from an older minute are folded into the current candle
+      if partial is None or minute > partial.minute:
+        if partial is not None:
+          self.__closed_partials[ticker] = partial
+        self.__partial_candles[ticker] = PartialCandle(minute, current_price, current_price, current_price, current_price)
+      else:
+        self.__partial_candles[ticker] = partial.add(current_price)
+      self.__current_price[ticker] = current_price
 
-    if not resp or not resp["results"]:
-      l.warn(f"Robinhood API is not responding at this time")
+      for listener in self.__price_listeners:
+        try:
+          listener(ticker, current_price)
+        except Exception as e:
+          l.warn(lambda: f"[{ticker}] price listener raised: {e}")
+
+    metrics.counter("data.ticks").inc(len(ticks))
+    metrics.timer("data.ingest_batch").record(time.perf_counter() - start)
+
+    if self.quotes.estimate_quantities:
+      now = time.monotonic()
+      for ticker in self.tickers:
+        if now - self.__last_estimate_refresh.get(ticker, float("-inf")) >= self.estimate_interval:
+          self.__last_estimate_refresh[ticker] = now
+          self.quotes.refresh_estimates(ticker)
+
+  def __advance_event_time(self, ticker: str, minute: int):
+    """Finalizes the ticker's candle when a tick from a later minute arrives."""
+    partial = self.__partial_candles.get(ticker)
+    if partial is None or minute <= partial.minute:
       return
+    # Stamped with the last second of the minute, like the wall clock finalizer
+    asyncio.run(self.__finalize_ohlc(ticker, time.localtime(partial.minute * 60 + 59), partial.minute))
+    if self.interpolate_missing_data:
+      for missing in range(partial.minute + 1, min(minute, partial.minute + 1 + _MAX_INTERPOLATED_MINUTES)):
+        asyncio.run(self.__finalize_ohlc(ticker, time.localtime(missing * 60 + 59), missing))
 
-    for resp_data in resp["results"]:
-      ticker = resp_data["symbol"]
-      current_price = float(resp_data["price"])
-      if self.__minute_ohlc_data[ticker]["Open"] is None:
-        self.__minute_ohlc_data[ticker]["Open"] = current_price
+  def add_candle_listener(self, ticker: str, callback: Callable[[str], None]) -> None:
+    """
+    Registers a callback that is called with the ticker every time a new candle
+    for it is added to the in-memory window. Unlike the candle signal Event,
+    every listener sees every candle, so any number of consumers can share it.
+    """
+    self.__candle_listeners.setdefault(ticker, []).append(callback)
 
-      if current_price > self.__minute_ohlc_data[ticker]["High"]:
-        self.__minute_ohlc_data[ticker]["High"] = current_price
+  def __notify_candle(self, ticker: str) -> None:
+    self.__ticker_signals[ticker].set()
+    for listener in self.__candle_listeners.get(ticker, ()):
+      try:
+        listener(ticker)
+      except Exception as e:
+        l.warn(lambda: f"[{ticker}] candle listener raised: {e}")
 
-      if current_price < self.__minute_ohlc_data[ticker]["Low"]:
-        self.__minute_ohlc_data[ticker]["Low"] = current_price
-        
-      self.__minute_ohlc_data[ticker]["Close"] = current_price
-      self.__current_price[ticker] = current_price
+  def add_price_listener(self, callback: Callable[[str, float], None]) -> None:
+    """
+    Registers a callback that is called with (ticker, price) for every price
+    sample the collector receives, before the sample is folded into a candle.
+    """
+    self.__price_listeners.append(callback)
 
-  async def __finalize_ohlc(self, ticker: str, now: str):
+  async def __finalize_ohlc(self, ticker: str, now: time.struct_time, minute: int):
+    closed_at = time.perf_counter()
     timestamp = self.get_timestamp(now)
 
-    curr_minute_ohlc = self.__minute_ohlc_data[ticker]
-    open_, high_, low_, close_ = curr_minute_ohlc["Open"], curr_minute_ohlc["High"], curr_minute_ohlc["Low"], curr_minute_ohlc["Close"]
-
-    if open_ is None:
-      if not self.interpolate_missing_data:
-        self.__reset_minute_ohlc_data(ticker)
+    partial = self.__partial_candles.get(ticker)
+    if partial is None or partial.minute != minute:
+      partial = self.__closed_partials.get(ticker)
+    if partial is not None and partial.minute == minute:
+      open_, high_, low_, close_ = partial.open, partial.high, partial.low, partial.close
+      if self.__closed_partials.get(ticker) is partial:
+        del self.__closed_partials[ticker]
+    else:
+      window = self.__windows.get(ticker)
+      if not self.interpolate_missing_data or window is None or window.last is None:
+        l.warn(f"[{ticker}] data was not collected over the minute. Leaving a gap")
+        return
       l.warn(f"[{ticker}] data was not collected over the minute. Utilizing backup data")
-      backup_minute_ohlc = self.__backup_price[ticker]
-      open_, high_, low_, close_ = backup_minute_ohlc["Open"], backup_minute_ohlc["High"], backup_minute_ohlc["Low"], backup_minute_ohlc["Close"]
+      _, open_, high_, low_, close_ = window.last
 
+    self.__candle_closed_at[ticker] = closed_at
     self.__add_inmemory_ohlc(ticker, timestamp, open_, high_, low_, close_)
 
     filepath = self._get_filepath(ticker)
-    if not os.path.exists(filepath):
-      async with aiofiles.open(filepath, "w") as file:
-        await file.write("Timestamp,Open,High,Low,Close\n")
+    # Held only for the append, so an archive roll in another process can't swap
+    # the file out between copying its tail and replacing it
+    with live_file_lock(filepath):
+      if not os.path.exists(filepath):
+        async with aiofiles.open(filepath, "w") as file:
+          await file.write("Timestamp,Open,High,Low,Close\n")
 
-    async with aiofiles.open(filepath, "a") as file:
-      await file.write(f"{timestamp},{open_},{high_},{low_},{close_}\n")
+      async with aiofiles.open(filepath, "a") as file:
+        await file.write(f"{timestamp},{open_},{high_},{low_},{close_}\n")
 
-    self.__reset_minute_ohlc_data(ticker)
-    self.__ticker_signals[ticker].set()
+    metrics.timer("data.candle_finalize").record(time.perf_counter() - closed_at)
+    self.__notify_candle(ticker)
+
+  def get_candle_closed_at(self, ticker: str) -> Optional[float]:
+    """
+    time.perf_counter() at which the newest candle of ticker was closed, or seen
+    in the CSV when following another collector process. Used to measure how
+    long strategies take to wake up for a candle.
+    """
+    return self.__candle_closed_at.get(ticker)
 
   def _try_load_inmemory_ohcl(self, ticker) -> int:
-    if ticker in self.__inmemory_ohlc:
+    if ticker in self.__windows:
       return -1
     filepath: str = self._get_filepath(ticker)
     if not os.path.exists(filepath):
-      self.__inmemory_ohlc[ticker] = pd.DataFrame(columns=["Timestamp", "Open", "High", "Low", "Close"])
+      self.__windows.setdefault(ticker, CandleWindow.from_rows([], (), dtype=self.dtype))
       with open(filepath, "w") as file:
         file.write("Timestamp,Open,High,Low,Close\n")
       l.info(f"Loaded 0 lines of previous contiguous {ticker} data (UNCOLLECTED DATA)")
@@ -186,13 +524,8 @@ class DataCollection:
         break
       i += 1
     
-    if i == 1:
-      self.__inmemory_ohlc[ticker] = pd.DataFrame(columns=["Timestamp", "Open", "High", "Low", "Close"])
-    else:
-      self.__inmemory_ohlc[ticker] = pd.DataFrame(
-          [[v if i == 0 else float(v) for i, v in enumerate(line.strip().split(","))] for line in prev_k_contiguous_lines[-i + 1:]],
-          columns=["Timestamp", "Open", "High", "Low", "Close"]
-      )
+    timestamps, ohlc = _parse_lines(prev_k_contiguous_lines[-i + 1:] if i > 1 else [])
+    self.__windows.setdefault(ticker, CandleWindow.from_rows(timestamps, ohlc, dtype=self.dtype))
     return i-1
 
   def __get_curr_time_data(self) -> float:
@@ -208,30 +541,53 @@ class DataCollection:
                           high_: float,
                           low_: float,
                           close_: float):
-    new_row: Dict = {
-      "Timestamp": timestamp,
-      "Open": open_,
-      "High": high_,
-      "Low": low_,
-      "Close": close_,
-    }
+    # The candle goes past the end of the rows current readers see, and the new
+    # window is swapped in whole, so readers holding the previous one are never affected
+    with self.__window_lock:
+      window = self.__windows[ticker]
+      self.__windows[ticker] = window.append(np.datetime64(timestamp, "ns"), open_, high_, low_, close_)
 
-    df: pd.DataFrame = self.__inmemory_ohlc[ticker]
-    if not df.empty:
-      self.__inmemory_ohlc[ticker] = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    else:
-      self.__inmemory_ohlc[ticker] = pd.DataFrame([new_row], columns=["Timestamp", "Open", "High", "Low", "Close"])
+    for panel in list(self.__panels.values()):
+      panel.add(ticker, timestamp, open_, high_, low_, close_)
 
-    if self.interpolate_missing_data:
-      self.__backup_price[ticker] = new_row
-
-  def __reset_minute_ohlc_data(self, ticker: str):
-    self.__minute_ohlc_data[ticker] = {
-      "Open": None,
-      "High": float("-inf"),
-      "Low": float("inf"),
-      "Close": None,
-    }
+  def get_panel(self, tickers: List[str], capacity: int=1440) -> CandlePanel:
+    """
+    Returns the aligned time x ticker x OHLC panel for this universe of tickers,
+    creating it from the in-memory windows on first use. It is then kept up to
+    date with every candle added to the in-memory windows.
+    """
+    key = tuple(tickers)
+    panel = self.__panels.get(key)
+    if panel is None:
+      panel = CandlePanel(tickers, capacity=capacity)
+      for ticker in tickers:
+        self._try_load_inmemory_ohcl(ticker)
+        window = self.__windows[ticker]
+        panel.seed(ticker, window.times[-capacity:], window.values[:, -capacity:].T)
+      panel = self.__panels.setdefault(key, panel)
+    return panel
+
+  def get_covariance(self,
+                     tickers: List[str],
+                     half_life: Optional[float]=60.0,
+                     window: Optional[int]=None,
+                     capacity: int=1440) -> ReturnCovariance:
+    """
+    Returns the streaming return covariance of this universe of tickers,
+    seeded from and then fed by its panel. Strategies asking for the same
+    universe and settings share one.
+    """
+    key = (tuple(tickers), half_life, window)
+    covariance = self.__covariances.get(key)
+    if covariance is None:
+      panel = self.get_panel(tickers, capacity=capacity)
+      # Created under a lock so a universe never gets two estimators attached to its panel
+      with self.__covariance_lock:
+        covariance = self.__covariances.get(key)
+        if covariance is None:
+          covariance = ReturnCovariance(tickers, half_life=half_life, window=window).attach(panel)
+          self.__covariances[key] = covariance
+    return covariance
 
   def _get_filepath(self, ticker: str):
     return os.path.join(self.folderpath, f"{ticker}-1min-data.csv")
@@ -291,28 +647,51 @@ class DataCollection:
   def __minute_from_timestamp(self, timestamp: str) -> int:
     return int(timestamp.split(":")[-2])
   
-  def get_price_estimate(self, ticker: str):
-    # TODO: Ensure this works
-    # l.warn("Cannot get active price estimate with data collection running in background. Giving candlestick close.")
-    if ticker not in self.__minute_ohlc_data:
+  def get_quote(self, ticker: str, max_age: Optional[float]=None):
+    """
+    Returns the cached Quote (price, bid, ask and estimated prices) for a ticker,
+    fetching a new one only if the cached quote is older than max_age seconds.
+    """
+    return self.quotes.get(ticker, max_age=max_age)
+
+  def get_price_estimate(self, ticker: str, max_age: Optional[float]=None) -> float:
+    if ticker not in self.__current_price:
       raise ValueError("Cannot get data for ticker not in data collection.")
-    if not self.__minute_ohlc_data[ticker] or self.__minute_ohlc_data[ticker] == { "Open": None, "High": float("-inf"), "Low": float("inf"), "Close": None,}:
-      last_line = self.__get_last_line(ticker)
-      return float(last_line.split(",")[-1])
-    return self.__current_price[ticker]
+    quote = self.quotes.get(ticker, max_age=max_age)
+    if quote is not None:
+      return quote.price
+    if self.__current_price.get(ticker, -1) > 0:
+      return self.__current_price[ticker]
+    # Last resort when the API is unreachable and nothing was ever cached
+    last_line = self.__get_last_line(ticker)
+    return float(last_line.split(",")[-1])
   
-  def get_ticker_df(self, ticker: str, max=None) -> pd.DataFrame:
+  def get_window(self, ticker: str) -> CandleWindow:
+    """
+    The current immutable snapshot of a ticker's in-memory candles. It stays
+    consistent no matter how many candles are added after it was taken.
+    """
     self._try_load_inmemory_ohcl(ticker)
-    if ticker not in self.__inmemory_ohlc:
-      # l.warn("Attempting to get OHCL data that has not been collected. Returning empty df")
-      self.__inmemory_ohlc[ticker] = pd.DataFrame(columns=["Timestamp", "Open", "High", "Low", "Close"])
-      
-    if self.__inmemory_ohlc[ticker].empty:
+    return self.__windows[ticker]
+
+  def get_ticker_df(self, ticker: str, max=None) -> pd.DataFrame:
+    """
+    Read-only Open, High, Low and Close of the ticker's in-memory candles with
+    a DatetimeIndex, as a view of the window's arrays (nothing is copied).
+    """
+    window = self.get_window(ticker)
+    if not len(window.times):
       l.warn("Attempting to get OHCL data that either has no data or is not currently contiguous.")
 
-    if max:
-      return self.__inmemory_ohlc[ticker].iloc[-max:]
-    return self.__inmemory_ohlc[ticker]
+    return window.tail(max)
+
+  def get_arrays(self, ticker: str, max=None) -> Dict[str, np.ndarray]:
+    """
+    Read-only Timestamp (datetime64[ns]), Open, High, Low and Close arrays of
+    the ticker's in-memory candles, each contiguous, to hand to talib directly.
+    They are float64 views, or float64 copies when dtype is float32.
+    """
+    return self.get_window(ticker).arrays(max)
 
   def _add_ticker(self, ticker: str) -> None:
     filepath: str = self._get_filepath(ticker)
@@ -323,13 +702,6 @@ class DataCollection:
     if ticker not in self.__current_price:
       self.__current_price[ticker] = -1
 
-    if ticker not in self.__minute_ohlc_data:
-      self.__minute_ohlc_data[ticker] = {
-        "Open": None,
-        "High": float("-inf"),
-        "Low": float("inf"),
-        "Close": None,
-      }
     if ticker not in self.__is_ticker_running:
       self.__is_ticker_running[ticker] = False
 
@@ -342,7 +714,10 @@ class DataCollection:
 
   def get_candle_signal(self, ticker: str) -> threading.Event:
     if self.__can_activate_candle_signal(ticker):
-      threading.Thread(target=self.__activate_candle_signal, args=(ticker,)).start()
+      # Marked active before the thread starts so concurrent callers can't
+      # start a second polling thread for the same ticker.
+      self.__is_ticker_signal_active[ticker] = True
+      threading.Thread(target=self.__activate_candle_signal, args=(ticker,), daemon=True).start()
     return self.__ticker_signals[ticker]
 
   def __can_activate_candle_signal(self, ticker: str) -> bool:
@@ -354,16 +729,13 @@ class DataCollection:
     return True
 
   def __activate_candle_signal(self, ticker: str, check_interval=0.1) -> None:
-    if not self.__can_activate_candle_signal(ticker):
-      return
-    self.__is_ticker_signal_active[ticker] = True
-
     last_minute = self.__minute_from_timestamp(self.__get_last_timestamp(ticker))
     while not self.__stop_event.is_set():
       curr_minute = self.__minute_from_timestamp(self.__get_last_timestamp(ticker))
       if curr_minute != last_minute:
+        self.__candle_closed_at[ticker] = time.perf_counter()
         self.__add_last_line(ticker)
-        self.__ticker_signals[ticker].set()
+        self.__notify_candle(ticker)
       last_minute = curr_minute
       time.sleep(check_interval)
 
@@ -395,9 +767,29 @@ if __name__ == "__main__":
   if "interpolate_missing_data" not in datacollection_config or datacollection_config["interpolate_missing_data"] is None:
     raise ValueError('"interpolate_missing_data" is not in the data-collection-config.yaml file. Please enter true or false for interpolate_missing_data.')
 
+  from src.accountstate import AccountState
+  from src.pollscheduler import PollScheduler
+  from src.sources import TickRecorder
+
+  api = RobinhoodCryptoAPI()
+  # The collector runs apart from the strategies, so open positions are read
+  # from the account's total holdings, stop-locked coins included, to keep
+  # those tickers in every poll
+  account = AccountState(api, refresh_interval=60.0)
+  account.start()
+  scheduler = PollScheduler(
+    requests_per_minute=int(datacollection_config.get("poll_requests_per_minute") or 28),
+    has_position=lambda ticker: account.holding(ticker.split("-")[0]) > 0,
+  )
+  source = RobinhoodSource(api, scheduler)
+  if datacollection_config.get("record_ticks_filepath"):
+    source = TickRecorder(source, datacollection_config["record_ticks_filepath"])
+
   cd = DataCollection(
     folderpath=datacollection_config["ticker_data_folderpath"],
     tickers=list(datacollection_config["tickers"]),
     interpolate_missing_data=bool(datacollection_config["interpolate_missing_data"]),
+    api=api,
+    source=source,
   )
-  cd.run()
+  cd.run(checkpoint_path=datacollection_config.get("checkpoint_path"))
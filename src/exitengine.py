@@ -0,0 +1,486 @@
+import concurrent.futures
+import itertools
+import threading
+import bisect
+import time
+import uuid
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.log import log
+l = log(__file__)
+
+_bracket_ids = itertools.count(1)
+
+_OPEN_STATES = ("open", "pending", "confirmed", "partially_filled")
+
+
+class Bracket:
+  """
+    An open long position and the levels it should be closed at.
+
+    Attributes:
+      ticker (str): The trading pair the position is in.
+      asset_quantity (float): Quantity that is sold when the bracket closes.
+      stop_loss (Optional[float]): Close when the price is at or below this level.
+      take_price (Optional[float]): Close when the price is at or above this level.
+      trailing_percent (Optional[float]): Trails the stop this far below the highest price seen.
+      high (float): Highest price seen since the bracket was opened, starting at entry_price.
+      stop_loss_order_id (Optional[str]): Exchange side stop-loss order that gets cancelled on close.
+      strategy (Optional[str]): Name of the strategy that opened the position.
+      closed_event (threading.Event): Set once the closing order went through.
+  """
+  def __init__(self,
+               ticker: str,
+               asset_quantity: float,
+               entry_price: float,
+               stop_loss: Optional[float]=None,
+               take_price: Optional[float]=None,
+               trailing_percent: Optional[float]=None,
+               stop_loss_order_id: Optional[str]=None,
+               client_order_id: Optional[str]=None,
+               closed_event: Optional[threading.Event]=None,
+               strategy: Optional[str]=None):
+    self.id: int = next(_bracket_ids)
+    self.ticker: str = ticker
+    self.asset_quantity: float = asset_quantity
+    self.entry_price: float = entry_price
+    self.take_price: Optional[float] = take_price
+    self.trailing_percent: Optional[float] = trailing_percent
+    self.stop_loss_order_id: Optional[str] = stop_loss_order_id
+    self.client_order_id: Optional[str] = client_order_id
+    self.strategy: Optional[str] = strategy
+    self.closed_event: threading.Event = closed_event if closed_event is not None else threading.Event()
+    self.high: float = entry_price
+
+    self.stop_loss: Optional[float] = stop_loss
+    if trailing_percent:
+      trailing_stop = entry_price * (1 - trailing_percent)
+      if stop_loss is None or trailing_stop > stop_loss:
+        self.stop_loss = trailing_stop
+
+
+class _TickerBook:
+  """
+    Price sorted exit levels for a single ticker. Both lists hold (level, bracket_id)
+    tuples in ascending order so a price sample only has to bisect to find every
+    triggered level.
+  """
+  def __init__(self):
+    self.stops: List[Tuple[float, int]] = []
+    self.takes: List[Tuple[float, int]] = []
+    self.trailing: Dict[int, Bracket] = {}
+    # Lowest high of the trailing brackets; a price at or below it raises none of them
+    self.trailing_floor: float = float("inf")
+
+  def __len__(self):
+    return len(self.stops) + len(self.takes) + len(self.trailing)
+
+  def insert(self, bracket: Bracket):
+    if bracket.stop_loss is not None:
+      bisect.insort(self.stops, (bracket.stop_loss, bracket.id))
+    if bracket.take_price is not None:
+      bisect.insort(self.takes, (bracket.take_price, bracket.id))
+    if bracket.trailing_percent:
+      self.trailing[bracket.id] = bracket
+      self.trailing_floor = min(self.trailing_floor, bracket.high)
+
+  def remove(self, bracket: Bracket):
+    if bracket.stop_loss is not None:
+      self.__discard(self.stops, (bracket.stop_loss, bracket.id))
+    if bracket.take_price is not None:
+      self.__discard(self.takes, (bracket.take_price, bracket.id))
+    if self.trailing.pop(bracket.id, None) is not None and not self.trailing:
+      self.trailing_floor = float("inf")
+
+  def raise_trailing_stops(self, price: float):
+    # Only runs when the price is above some bracket's high, so a flat or
+    # falling market never touches the trailing brackets.
+    if price <= self.trailing_floor:
+      return
+    for bracket in self.trailing.values():
+      if price <= bracket.high:
+        continue
+      bracket.high = price
+      new_stop = price * (1 - bracket.trailing_percent)
+      if bracket.stop_loss is None or new_stop > bracket.stop_loss:
+        if bracket.stop_loss is not None:
+          self.__discard(self.stops, (bracket.stop_loss, bracket.id))
+        bracket.stop_loss = new_stop
+        bisect.insort(self.stops, (new_stop, bracket.id))
+    self.trailing_floor = min(bracket.high for bracket in self.trailing.values())
+
+  def pop_triggered(self, price: float) -> Tuple[List[int], List[int]]:
+    stop_idx = bisect.bisect_left(self.stops, (price, -1))
+    stopped = [bracket_id for _, bracket_id in self.stops[stop_idx:]]
+    take_idx = bisect.bisect_right(self.takes, (price, float("inf")))
+    taken = [bracket_id for _, bracket_id in self.takes[:take_idx]]
+    return stopped, taken
+
+  @staticmethod
+  def __discard(levels: List[Tuple[float, int]], entry: Tuple[float, int]):
+    idx = bisect.bisect_left(levels, entry)
+    if idx < len(levels) and levels[idx] == entry:
+      del levels[idx]
+
+
+class ExitEngine:
+  """
+    Holds every open bracket (stop-loss, take-price and trailing stop) across all
+    tickers and closes positions as soon as a price sample crosses one of their levels.
+
+    Prices come in through on_price(), either from a DataCollection price listener
+    or from the engine's own poller which requests the best bid/ask for the tickers
+    with open brackets once every poll_interval seconds and publishes them to the
+    quote cache when one is given. Evaluating a sample is a bisect on the ticker's
+    sorted levels, and closing orders are sent from a small shared pool so no
+    thread is kept per position.
+
+    Usage:
+      engine = ExitEngine(api)
+      engine.start()
+      bracket = engine.add(Bracket("BTC-USD", 0.001, 98000.0, stop_loss=96000.0, take_price=99000.0))
+      bracket.closed_event.wait()
+  """
+  def __init__(self,
+               api,
+               quote_cache=None,
+               poll_interval: float=1.0,
+               max_order_workers: int=4,
+               order_retries: int=10):
+    self.poll_interval: float = poll_interval
+    self.order_retries: int = order_retries
+
+    self.__api = api
+    self.__quote_cache = quote_cache
+    self.__books: Dict[str, _TickerBook] = {}
+    self.__brackets: Dict[int, Bracket] = {}
+    self.__pending: Dict[str, Bracket] = {}
+    self.__lock = threading.Lock()
+    self.__has_brackets = threading.Condition(self.__lock)
+    self.__stop_event = threading.Event()
+    self.__poll_thread: Optional[threading.Thread] = None
+    self.__order_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_order_workers)
+    self.__on_close_callbacks: List[Callable[[Bracket, str, float], None]] = []
+
+  def start(self) -> None:
+    if self.__poll_thread is not None and self.__poll_thread.is_alive():
+      return
+    self.__poll_thread = threading.Thread(target=self.__run_poll, daemon=True)
+    self.__poll_thread.start()
+
+  def add(self, bracket: Bracket) -> Bracket:
+    if bracket.stop_loss is None and bracket.take_price is None:
+      raise ValueError("A bracket needs at least a stop_loss, take_price or trailing_percent to be tracked.")
+    with self.__lock:
+      book = self.__books.setdefault(bracket.ticker, _TickerBook())
+      book.insert(bracket)
+      self.__brackets[bracket.id] = bracket
+      if bracket.client_order_id is not None:
+        self.__pending.pop(bracket.client_order_id, None)
+      self.__has_brackets.notify_all()
+    l.info(f"[{bracket.ticker}] Tracking bracket {bracket.id} [SL: {bracket.stop_loss}][TP: {bracket.take_price}][TRAIL: {bracket.trailing_percent}]")
+    return bracket
+
+  def remove(self, bracket: Bracket, strategy: Optional[str]=None) -> bool:
+    """Stops tracking a bracket. With strategy, only a bracket that strategy opened is removed."""
+    if strategy is not None and bracket.strategy != strategy:
+      l.warn(f"[{bracket.ticker}] {strategy} cannot remove bracket {bracket.id} of {bracket.strategy}.")
+      return False
+    with self.__lock:
+      return self.__pop_bracket(bracket.id) is not None
+
+  def open_brackets(self, ticker: Optional[str]=None, strategy: Optional[str]=None) -> List[Bracket]:
+    with self.__lock:
+      return [b for b in self.__brackets.values()
+              if (ticker is None or b.ticker == ticker) and (strategy is None or b.strategy == strategy)]
+
+  def add_pending(self, bracket: Bracket) -> Bracket:
+    """
+    Records the bracket of an entry order that was sent but has not filled yet,
+    so a checkpoint taken in between can still recover the position. Adding a
+    bracket with the same client_order_id, or discard_pending(), clears it.
+    """
+    with self.__lock:
+      self.__pending[bracket.client_order_id] = bracket
+    return bracket
+
+  def discard_pending(self, client_order_id: str) -> None:
+    with self.__lock:
+      self.__pending.pop(client_order_id, None)
+
+  def checkpoint_state(self) -> Dict[str, List[Dict]]:
+    with self.__lock:
+      return {
+        "brackets": [_bracket_state(b) for b in self.__brackets.values()],
+        "pending": [_bracket_state(b) for b in self.__pending.values()],
+      }
+
+  def restore_checkpoint(self, state: Dict[str, List[Dict]]) -> None:
+    """
+    Re-attaches checkpointed brackets after reconciling them with the account:
+    brackets whose stop-loss filled while the process was down are dropped, and
+    so are brackets whose asset is no longer held, after cancelling their
+    now orphaned stop-loss order.
+
+    Entries that had not filled yet are looked up by their client_order_id:
+    filled ones get their stop-loss placed and their bracket tracked, open ones
+    are watched until they fill or fail, and the rest are dropped.
+    """
+    if not state or not (state["brackets"] or state["pending"]):
+      return
+    orders_resp = self.__api.get_orders() or {}
+    orders = {order["id"]: order for order in orders_resp.get("results", [])}
+    entry_orders = {order["client_order_id"]: order for order in orders.values() if order.get("client_order_id")}
+    holdings_resp = self.__api.get_holdings() or {}
+    available: Dict[str, float] = {
+      holding["asset_code"]: float(holding.get("quantity_available_for_trading", holding.get("total_quantity", 0)))
+      for holding in holdings_resp.get("results", [])
+    }
+    # Holdings locked by the resting stop-loss orders are not "available"
+    for order in orders.values():
+      if order.get("side") == "sell" and order.get("state") in _OPEN_STATES:
+        asset_code = order.get("symbol", "").split("-")[0]
+        config = order.get(f"{order.get('type')}_order_config") or {}
+        available[asset_code] = available.get(asset_code, 0.0) + float(config.get("asset_quantity", 0) or 0)
+
+    for saved in state["brackets"]:
+      ticker = saved["ticker"]
+      asset_code = ticker.split("-")[0]
+      stop_loss_order_id = saved["stop_loss_order_id"]
+      stop_loss_state = orders.get(stop_loss_order_id, {}).get("state") if stop_loss_order_id else None
+
+      if stop_loss_state == "filled":
+        l.info(f"[{ticker}]: Stop-loss for {saved['client_order_id']} filled while stopped. Not restoring its bracket.")
+        continue
+      if available.get(asset_code, 0.0) + 1e-9 < saved["asset_quantity"]:
+        l.warn(f"[{ticker}]: {saved['asset_quantity']} {asset_code} for {saved['client_order_id']} is no longer held. Dropping its bracket.")
+        if stop_loss_state in ("open", "pending", "confirmed"):
+          self.__api.cancel_order(stop_loss_order_id)
+        continue
+      available[asset_code] -= saved["asset_quantity"]
+      if stop_loss_state in ("canceled", "cancelled", "failed"):
+        stop_loss_order_id = None
+
+      bracket = _bracket_from_state(saved)
+      bracket.stop_loss_order_id = stop_loss_order_id
+      self.add(bracket)
+
+    for saved in state["pending"]:
+      ticker = saved["ticker"]
+      asset_code = ticker.split("-")[0]
+      entry_order = entry_orders.get(saved["client_order_id"])
+      entry_state = entry_order.get("state") if entry_order is not None else None
+
+      if entry_state in _OPEN_STATES:
+        bracket = self.add_pending(_bracket_from_state(saved))
+        self.__order_executor.submit(self.__await_entry, bracket, entry_order["id"])
+      elif entry_state != "filled":
+        l.info(f"[{ticker}]: Entry {saved['client_order_id']} did not fill ({entry_state}). Not restoring its bracket.")
+      elif available.get(asset_code, 0.0) + 1e-9 < saved["asset_quantity"]:
+        l.warn(f"[{ticker}]: Entry {saved['client_order_id']} filled while stopped but {saved['asset_quantity']} {asset_code} is no longer held. Dropping its bracket.")
+      else:
+        available[asset_code] -= saved["asset_quantity"]
+        l.info(f"[{ticker}]: Entry {saved['client_order_id']} filled while stopped. Placing its exits.")
+        self.__arm_entry(_bracket_from_state(saved))
+
+  def __await_entry(self, bracket: Bracket, order_id: str) -> None:
+    while not self.__stop_event.is_set():
+      try:
+        order_status = self.__api.get_order(order_id) or {}
+      except Exception as e:
+        l.warn(f"[{bracket.ticker}]: Could not check entry {bracket.client_order_id}: {e}")
+        order_status = {}
+      entry_state = order_status.get("state")
+      if entry_state == "filled":
+        self.__arm_entry(bracket)
+        return
+      if entry_state in ("canceled", "cancelled", "failed"):
+        l.info(f"[{bracket.ticker}]: Entry {bracket.client_order_id} {entry_state}. Not tracking its bracket.")
+        self.discard_pending(bracket.client_order_id)
+        bracket.closed_event.set()
+        return
+      self.__stop_event.wait(1.0)
+
+  def __arm_entry(self, bracket: Bracket) -> None:
+    if bracket.stop_loss is not None:
+      self.__place_stop_loss(bracket)
+    self.add(bracket)
+
+  def add_close_listener(self, callback: Callable[[Bracket, str, float], None]) -> None:
+    self.__on_close_callbacks.append(callback)
+
+  def on_price(self, ticker: str, price: float) -> None:
+    if price is None or price <= 0:
+      return
+    with self.__lock:
+      book = self.__books.get(ticker)
+      if book is None or not len(book):
+        return
+      if book.trailing:
+        book.raise_trailing_stops(price)
+      stopped, taken = book.pop_triggered(price)
+      if not stopped and not taken:
+        return
+      triggered = []
+      for reason, bracket_ids in (("stop_loss", stopped), ("take_price", taken)):
+        for bracket_id in bracket_ids:
+          bracket = self.__pop_bracket(bracket_id)
+          if bracket is not None:
+            triggered.append((bracket, reason))
+
+    for bracket, reason in triggered:
+      self.__order_executor.submit(self.__close, bracket, reason, price)
+
+  def __pop_bracket(self, bracket_id: int) -> Optional[Bracket]:
+    bracket = self.__brackets.pop(bracket_id, None)
+    if bracket is not None:
+      self.__books[bracket.ticker].remove(bracket)
+    return bracket
+
+  def __close(self, bracket: Bracket, reason: str, price: float) -> None:
+    # One id for every attempt, so a retry after a lost response can't sell twice
+    close_order_id = str(uuid.uuid4())
+    stop_loss_cancelled = False
+    try:
+      if bracket.stop_loss_order_id is not None:
+        self.__api.cancel_order(bracket.stop_loss_order_id)
+        stop_loss_cancelled = True
+        stop_loss_status = self.__api.get_order(bracket.stop_loss_order_id)
+        if stop_loss_status and stop_loss_status.get("state") == "filled":
+          l.info(f"[{bracket.ticker}]: Stop-loss order filled for {bracket.client_order_id} at {price}. SL was {bracket.stop_loss}.")
+          self.__finish(bracket, "stop_loss", price)
+          return
+
+      retries = self.order_retries
+      while retries >= 0 and not self.__stop_event.is_set():
+        order_response = self.__api.place_order(
+          client_order_id=close_order_id,
+          side="sell",
+          order_type="market",
+          symbol=bracket.ticker,
+          order_config={
+            "asset_quantity": bracket.asset_quantity
+          }
+        )
+        if order_response and "id" in order_response:
+          l.info(f"[{bracket.ticker}]: {reason} executed for {bracket.client_order_id} at {price} [SL: {bracket.stop_loss}][TP: {bracket.take_price}]")
+          self.__finish(bracket, reason, price)
+          return
+        retries -= 1
+        time.sleep(0.5)
+      l.warn(f"[{bracket.ticker}]: Could not place the closing order for bracket {bracket.id} ({reason} at {price}).")
+    except Exception as e:
+      l.warn(f"[{bracket.ticker}]: Closing bracket {bracket.id} failed: {e}")
+    self.__rearm(bracket, reason, price, close_order_id, stop_loss_cancelled)
+
+  def __rearm(self, bracket: Bracket, reason: str, price: float, close_order_id: str, stop_loss_cancelled: bool) -> None:
+    """
+    Puts a bracket whose closing order did not go through back under watch and
+    re-places the exchange stop-loss that was cancelled for it, unless the
+    closing order turns out to have reached the exchange after all.
+    """
+    try:
+      orders_resp = self.__api.get_orders() or {}
+      for order in orders_resp.get("results", []):
+        if order.get("client_order_id") == close_order_id and order.get("state") not in ("canceled", "cancelled", "failed"):
+          l.info(f"[{bracket.ticker}]: Closing order for bracket {bracket.id} was accepted after all.")
+          self.__finish(bracket, reason, price)
+          return
+    except Exception as e:
+      l.warn(f"[{bracket.ticker}]: Could not look up the closing order of bracket {bracket.id}: {e}")
+
+    if stop_loss_cancelled and bracket.stop_loss is not None:
+      self.__place_stop_loss(bracket)
+    self.add(bracket)
+
+  def __place_stop_loss(self, bracket: Bracket) -> None:
+    """Places the exchange side stop-loss at the bracket's current stop and records its id."""
+    bracket.stop_loss_order_id = None
+    try:
+      stop_loss_response = self.__api.place_order(
+        client_order_id=str(uuid.uuid4()),
+        side="sell",
+        order_type="stop_loss",
+        symbol=bracket.ticker,
+        order_config={
+          "asset_quantity": bracket.asset_quantity,
+          "stop_price": f"{bracket.stop_loss:.2f}",
+          "time_in_force": "gtc"
+        },
+      )
+      if stop_loss_response and "id" in stop_loss_response:
+        bracket.stop_loss_order_id = stop_loss_response["id"]
+    except Exception as e:
+      l.warn(f"[{bracket.ticker}]: Placing the stop-loss of bracket {bracket.id} failed: {e}")
+    if bracket.stop_loss_order_id is None:
+      l.warn(f"[{bracket.ticker}]: Bracket {bracket.id} has no exchange stop-loss.")
+
+  def __finish(self, bracket: Bracket, reason: str, price: float) -> None:
+    bracket.closed_event.set()
+    for callback in self.__on_close_callbacks:
+      try:
+        callback(bracket, reason, price)
+      except Exception as e:
+        l.warn(f"Exit engine close listener raised: {e}")
+
+  def __run_poll(self) -> None:
+    next_poll = time.monotonic()
+    while not self.__stop_event.is_set():
+      with self.__lock:
+        while not self.__brackets and not self.__stop_event.is_set():
+          self.__has_brackets.wait(timeout=1.0)
+          next_poll = time.monotonic()
+        tickers = [ticker for ticker, book in self.__books.items() if len(book)]
+
+      if tickers:
+        resp = self.__api.get_best_bid_ask(*tickers)
+        if self.__quote_cache is not None:
+          self.__quote_cache.update_from_best_bid_ask(resp)
+        if resp and resp.get("results"):
+          for resp_data in resp["results"]:
+            self.on_price(resp_data["symbol"], float(resp_data["price"]))
+
+      next_poll += self.poll_interval
+      sleep_for = next_poll - time.monotonic()
+      if sleep_for > 0:
+        self.__stop_event.wait(sleep_for)
+      else:
+        next_poll = time.monotonic()
+
+  def stop(self) -> None:
+    self.__stop_event.set()
+    with self.__lock:
+      self.__has_brackets.notify_all()
+    self.__order_executor.shutdown(wait=False)
+
+
+def _bracket_state(bracket: Bracket) -> Dict:
+  return {
+    "ticker": bracket.ticker,
+    "asset_quantity": bracket.asset_quantity,
+    "entry_price": bracket.entry_price,
+    "stop_loss": bracket.stop_loss,
+    "take_price": bracket.take_price,
+    "trailing_percent": bracket.trailing_percent,
+    "high": bracket.high,
+    "stop_loss_order_id": bracket.stop_loss_order_id,
+    "client_order_id": bracket.client_order_id,
+    "strategy": bracket.strategy,
+  }
+
+
+def _bracket_from_state(saved: Dict) -> Bracket:
+  bracket = Bracket(
+    ticker=saved["ticker"],
+    asset_quantity=saved["asset_quantity"],
+    entry_price=saved["entry_price"],
+    stop_loss=saved["stop_loss"],
+    take_price=saved["take_price"],
+    trailing_percent=saved["trailing_percent"],
+    stop_loss_order_id=saved["stop_loss_order_id"],
+    client_order_id=saved["client_order_id"],
+    strategy=saved["strategy"],
+  )
+  bracket.high = saved["high"]
+  return bracket
@@ -0,0 +1,251 @@
+import concurrent.futures
+import traceback
+import threading
+import time
+import os
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from api.robinhood_api_trading import RobinhoodCryptoAPI
+from src.accountstate import AccountState
+from src.checkpoint import Checkpointer
+from src.datacollection import DataCollection
+from src.exitengine import ExitEngine
+from src.metrics import metrics
+from src.quotecache import QuoteCache
+
+from src.log import log
+l = log(__file__)
+
+
+class StrategyHost:
+  """
+    Runs several RobinCrypto strategies in one process on top of a single API
+    client (and so a single rate budget), account cache, quote cache, exit engine
+    and DataCollection. Each ticker has one candle feed and one in-memory window
+    no matter how many strategies use it, and every new candle is fanned out to
+    the subscribed strategies.
+
+    Strategies stay isolated from each other: each has its own instance state,
+    its own callback executor and its own name on the brackets it opens, and an
+    exception in one strategy's callback is logged without affecting the others.
+    A strategy's callback never runs twice at once for the same ticker; a candle
+    that arrives while the previous one is still being handled is skipped.
+
+    Usage:
+      host = StrategyHost()
+      trend = host.load(TrendAlgo)
+      rotation = host.load(RotationAlgo)
+      trend.algo(["BTC-USD", "ETH-USD"])
+      rotation.algo(["BTC-USD", "ETH-USD", "DOGE-USD"])
+  """
+  _loading = threading.local()
+
+  def __init__(self,
+               ticker_data_folderpath: str=None,
+               max_risk: float=None,
+               api: Optional[RobinhoodCryptoAPI]=None,
+               checkpoint_path: Optional[str]=None,
+               checkpoint_interval: float=5.0,
+               estimate_quantities: Optional[List[float]]=None):
+    if ticker_data_folderpath is None or max_risk is None:
+      import yaml
+      with open("data-collection-config.yaml") as stream:
+        try:
+            datacollection_config = yaml.safe_load(stream)
+        except yaml.YAMLError as exc:
+            print(exc)
+      if ticker_data_folderpath is None:
+        if "ticker_data_folderpath" not in datacollection_config or datacollection_config["ticker_data_folderpath"] is None:
+          raise ValueError('"ticker_data_folderpath" is not in the data-collection-config.yaml file. Please enter a valid folderpath or enter an argument for this value.')
+        ticker_data_folderpath = datacollection_config["ticker_data_folderpath"]
+      if max_risk is None:
+        if "max_risk" not in datacollection_config or datacollection_config["max_risk"] is None:
+          raise ValueError('"max_risk" is not in the data-collection-config.yaml file. Please enter a valid total risk percentage or enter an argument for this value.')
+        max_risk = datacollection_config["max_risk"]
+
+    if not os.path.exists(ticker_data_folderpath):
+      raise ValueError(f"Folderpath {ticker_data_folderpath} does not exist. Please enter a valid path containing your collected data.")
+
+    self.ticker_data_folderpath: str = ticker_data_folderpath
+    self.max_risk: float = max_risk
+
+    self.ct = api if api is not None else RobinhoodCryptoAPI()
+    self.account = AccountState(self.ct)
+    self.account.start()
+    # With estimate_quantities the collector keeps estimated execution prices
+    # for those asset quantities cached, and long() sizes entries off them.
+    self.quotes = QuoteCache(self.ct, estimate_quantities=estimate_quantities)
+    # Candles come from the collector's CSV files, and the exit engine polls the
+    # prices of the tickers with open brackets itself
+    self.data = DataCollection(ticker_data_folderpath, quote_cache=self.quotes, api=self.ct)
+    self.exits = ExitEngine(self.ct, quote_cache=self.quotes)
+    self.exits.add_close_listener(self.__on_bracket_closed)
+    self.exits.start()
+
+    self.__process_runner = None
+    self.strategies: List = []
+    self.__subscriptions: Dict[str, List[Tuple[object, Callable[[str], None]]]] = {}
+    self.__executors: Dict[int, concurrent.futures.ThreadPoolExecutor] = {}
+    self.__names: Dict[int, str] = {}
+    self.__running: Dict[Tuple[int, str], threading.Lock] = {}
+    self.__lock = threading.Lock()
+
+    # Windows and brackets are restored before any strategy subscribes, so the
+    # feeds start from the checkpoint instead of re-reading history, and open
+    # positions are re-attached to the exit engine.
+    self.checkpointer: Optional[Checkpointer] = None
+    self.__checkpoint: Dict = {}
+    if checkpoint_path:
+      self.checkpointer = Checkpointer(checkpoint_path, interval=checkpoint_interval)
+      self.checkpointer.register("data", self.data.checkpoint_state, self.data.restore_checkpoint)
+      self.checkpointer.register("exits", self.exits.checkpoint_state, self.exits.restore_checkpoint)
+      checkpoint = self.checkpointer.load()
+      self.__checkpoint = (checkpoint or {}).get("components", {})
+      self.checkpointer.restore(checkpoint)
+      self.checkpointer.start()
+
+  @classmethod
+  def current(cls) -> Optional["StrategyHost"]:
+    """The host whose load() is constructing a strategy on this thread, if any."""
+    return getattr(cls._loading, "host", None)
+
+  def load(self, strategy_cls, *args, **kwargs):
+    """
+    Instantiates strategy_cls on this host. The strategy's __init__ can keep
+    calling super().__init__() without arguments and still gets the shared
+    components.
+    """
+    StrategyHost._loading.host = self
+    try:
+      strategy = strategy_cls(*args, **kwargs)
+    finally:
+      StrategyHost._loading.host = None
+    return strategy
+
+  def register(self, strategy) -> None:
+    with self.__lock:
+      if strategy in self.strategies:
+        return
+      self.strategies.append(strategy)
+      # The n-th instance of a class is "Class#n", so names stay stable across
+      # restarts as long as strategies are loaded in the same order
+      taken = set(self.__names.values())
+      name, n = type(strategy).__name__, 1
+      while (name if n == 1 else f"{name}#{n}") in taken:
+        n += 1
+      if n > 1:
+        name = f"{name}#{n}"
+      self.__names[id(strategy)] = name
+      self.__executors[id(strategy)] = concurrent.futures.ThreadPoolExecutor(thread_name_prefix=type(strategy).__name__)
+
+    if self.checkpointer is not None:
+      key = f"strategy:{name}"
+      self.checkpointer.register(key, strategy.checkpoint_state, strategy.restore_checkpoint)
+      if self.__checkpoint.get(key) is not None:
+        strategy.restore_checkpoint(self.__checkpoint[key])
+
+  def strategy_name(self, strategy) -> str:
+    """The name the strategy is registered under, which also tags the brackets it opens."""
+    self.register(strategy)
+    with self.__lock:
+      return self.__names[id(strategy)]
+
+  def subscribe(self, strategy, ticker: str, callback: Callable[[str], None]) -> None:
+    """Calls callback(ticker) on the strategy's executor for every new candle of ticker."""
+    self.register(strategy)
+    with self.__lock:
+      first_subscriber = ticker not in self.__subscriptions
+      self.__subscriptions.setdefault(ticker, []).append((strategy, callback))
+
+    if first_subscriber:
+      self.__start_feed(ticker)
+      self.data.add_candle_listener(ticker, self.__on_candle)
+
+  def subscribe_batch(self, strategy, tickers: List[str], callback: Callable, capacity: int=1440) -> None:
+    """
+    Calls callback(panel) on the strategy's executor once per minute, after all
+    of the tickers have their candle for it (see CandlePanel for the grace period).
+    """
+    self.register(strategy)
+    for ticker in tickers:
+      self.__start_feed(ticker)
+    panel = self.data.get_panel(tickers, capacity=capacity)
+
+    def __on_minute(minute):
+      with self.__lock:
+        executor = self.__executors.get(id(strategy))
+      if executor is not None:
+        executor.submit(self.__dispatch, strategy, "BATCH", lambda _: callback(panel))
+
+    panel.add_listener(__on_minute)
+
+  def __start_feed(self, ticker: str) -> None:
+    self.data._add_ticker(ticker)
+    self.data._try_load_inmemory_ohcl(ticker)
+    self.data.get_candle_signal(ticker)
+
+  def process_runner(self):
+    """
+    The process pool shared by every strategy using executor="process", created
+    on first use. Each call passes its own window size.
+    """
+    with self.__lock:
+      if self.__process_runner is None:
+        from src.processpool import ProcessCallbackRunner
+        self.__process_runner = ProcessCallbackRunner()
+      return self.__process_runner
+
+  def unload(self, strategy) -> None:
+    with self.__lock:
+      for ticker, subscribers in self.__subscriptions.items():
+        self.__subscriptions[ticker] = [s for s in subscribers if s[0] is not strategy]
+      if strategy in self.strategies:
+        self.strategies.remove(strategy)
+      executor = self.__executors.pop(id(strategy), None)
+      self.__names.pop(id(strategy), None)
+      self.__running = {key: lock for key, lock in self.__running.items() if key[0] != id(strategy)}
+    if executor is not None:
+      executor.shutdown(wait=False)
+
+  def __on_candle(self, ticker: str) -> None:
+    with self.__lock:
+      subscribers = list(self.__subscriptions.get(ticker, ()))
+      executors = dict(self.__executors)
+    closed_at = self.data.get_candle_closed_at(ticker)
+    for strategy, callback in subscribers:
+      executor = executors.get(id(strategy))
+      if executor is not None:
+        executor.submit(self.__dispatch, strategy, ticker, callback, closed_at)
+
+  def __on_bracket_closed(self, bracket, reason: str, price: float) -> None:
+    # Keeps the cached holdings and buying power in step with the exits until
+    # the next account refresh
+    self.account.apply_fill(bracket.ticker, "sell", bracket.asset_quantity, price)
+
+  def __dispatch(self, strategy, ticker: str, callback: Callable[[str], None], closed_at: Optional[float]=None) -> None:
+    with self.__lock:
+      running = self.__running.setdefault((id(strategy), ticker), threading.Lock())
+    if not running.acquire(blocking=False):
+      metrics.counter("strategy.skipped").inc()
+      l.warn(lambda: f"[{ticker}] {type(strategy).__name__} is still handling the previous candle. Skipping this one.")
+      return
+    try:
+      if closed_at is not None:
+        metrics.timer("strategy.wakeup").record(time.perf_counter() - closed_at)
+      callback(ticker)
+    except Exception:
+      l.warn(f"[{ticker}] {type(strategy).__name__} callback raised:\n{traceback.format_exc()}")
+    finally:
+      running.release()
+
+  def stop(self) -> None:
+    if self.checkpointer is not None:
+      self.checkpointer.stop()
+    for strategy in list(self.strategies):
+      self.unload(strategy)
+    if self.__process_runner is not None:
+      self.__process_runner.shutdown()
+    self.data.stop()
+    self.exits.stop()
+    self.account.stop()
@@ -0,0 +1,194 @@
+import itertools
+import time
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.log import log
+l = log(__file__)
+
+
+def load_ticks(filepaths: Sequence[str], ticker: str) -> Tuple[np.ndarray, np.ndarray]:
+  """Epoch second timestamps and prices of one ticker from TickRecorder files, sorted by time."""
+  frames = [pd.read_csv(filepath, usecols=["Timestamp", "Ticker", "Price"], float_precision="round_trip") for filepath in filepaths]
+  ticks = pd.concat(frames, ignore_index=True)
+  ticks = ticks[ticks["Ticker"] == ticker].sort_values("Timestamp", kind="stable")
+  return ticks["Timestamp"].to_numpy(dtype=float), ticks["Price"].to_numpy(dtype=float)
+
+
+def ambiguous_exits(trades: pd.DataFrame, df: pd.DataFrame) -> np.ndarray:
+  """
+  Trades whose exit bar touched both the stop loss and the take profit after
+  opening between them, so the bar alone can't tell which filled first.
+  backtesting.py always assumes the stop loss did.
+  """
+  bars = trades["ExitBar"].to_numpy()
+  open_, high_, low_ = (df[column].to_numpy(dtype=float)[bars] for column in ("Open", "High", "Low"))
+  sl, tp = trades["SL"].to_numpy(dtype=float), trades["TP"].to_numpy(dtype=float)
+  is_long = trades["Size"].to_numpy() > 0
+  upper, lower = np.where(is_long, tp, sl), np.where(is_long, sl, tp)
+  return (high_ >= upper) & (low_ <= lower) & (open_ < upper) & (open_ > lower)
+
+
+def modeled_tp_first(trades: pd.DataFrame, df: pd.DataFrame) -> np.ndarray:
+  """
+  Whether the take profit fills first on a modeled path through each exit bar:
+  Open -> Low -> High -> Close for bars that close up, Open -> High -> Low ->
+  Close for bars that close down, and the extreme nearest the open first for
+  flat bars.
+  """
+  bars = trades["ExitBar"].to_numpy()
+  open_, high_, low_, close_ = (df[column].to_numpy(dtype=float)[bars] for column in ("Open", "High", "Low", "Close"))
+  high_first = np.where(close_ != open_, close_ < open_, high_ - open_ < open_ - low_)
+  is_long = trades["Size"].to_numpy() > 0
+  return np.where(is_long, high_first, ~high_first)
+
+
+def tick_tp_first(trades: pd.DataFrame,
+                  df: pd.DataFrame,
+                  tick_times: np.ndarray,
+                  tick_prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """
+  Replays the recorded ticks inside each trade's exit bar minute. Returns
+  whether the take profit was crossed before the stop loss, and whether the
+  ticks crossed either level at all (bars the 2 second samples don't resolve
+  are left to the model).
+  """
+  count = len(trades)
+  bar_times = df.index[trades["ExitBar"].to_numpy()]
+  # Bar timestamps are local time, like the collector writes them
+  starts = np.array([time.mktime(t.floor("min").timetuple()) for t in bar_times], dtype=float)
+  first = np.searchsorted(tick_times, starts, side="left")
+  lengths = np.searchsorted(tick_times, starts + 60, side="left") - first
+
+  segments = np.repeat(np.arange(count), lengths)
+  positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+  prices = tick_prices[np.repeat(first, lengths) + positions]
+
+  is_long = (trades["Size"].to_numpy() > 0)[segments]
+  sl, tp = trades["SL"].to_numpy(dtype=float)[segments], trades["TP"].to_numpy(dtype=float)[segments]
+  tp_hit = np.where(is_long, prices >= tp, prices <= tp)
+  sl_hit = np.where(is_long, prices <= sl, prices >= sl)
+
+  first_tp = np.full(count, np.iinfo(np.int64).max)
+  first_sl = np.full(count, np.iinfo(np.int64).max)
+  np.minimum.at(first_tp, segments[tp_hit], positions[tp_hit])
+  np.minimum.at(first_sl, segments[sl_hit], positions[sl_hit])
+  resolved = (first_tp != np.iinfo(np.int64).max) | (first_sl != np.iinfo(np.int64).max)
+  return first_tp < first_sl, resolved
+
+
+def tp_first(df: pd.DataFrame,
+             bar: int,
+             size: float,
+             sl: float,
+             tp: float,
+             tick_times: Optional[np.ndarray]=None,
+             tick_prices: Optional[np.ndarray]=None) -> Optional[bool]:
+  """
+  For one position (the sign of size is its side) and its levels: None when
+  bar doesn't touch both levels after opening between them, otherwise whether
+  the take profit fills first, from the ticks when they cross a level and from
+  the modeled path otherwise. Lets a strategy decide inside the backtest.
+  """
+  trades = pd.DataFrame({"ExitBar": [bar], "Size": [size], "SL": [sl], "TP": [tp]})
+  if not ambiguous_exits(trades, df)[0]:
+    return None
+  first = modeled_tp_first(trades, df)
+  if tick_times is not None and len(tick_times):
+    from_ticks, resolved = tick_tp_first(trades, df, tick_times, tick_prices)
+    first = np.where(resolved, from_ticks, first)
+  return bool(first[0])
+
+
+def resolve(stats,
+            df: pd.DataFrame,
+            tick_times: Optional[np.ndarray]=None,
+            tick_prices: Optional[np.ndarray]=None) -> Dict:
+  """
+  Re-decides every ambiguous stop loss / take profit exit of a backtesting.py
+  run, from recorded ticks where they cross a level and the modeled intrabar
+  path otherwise, and corrects the trades and equity curve to match. The exit
+  bar is the same either way, so no trade moves, but only each changed trade's
+  PnL is adjusted: later trades keep the size they were given off the
+  uncorrected equity. That makes this a quick estimate for ranking parameters;
+  for exact results run CryptoBacktest with resolve_intrabar=True, which makes
+  the same decision inside the backtest.
+
+  Returns a dict with the corrected "_trades" and "_equity_curve" (so it can be
+  passed to robustness.returns_from_stats) and the headline stats.
+
+  Usage:
+    stats = Backtest(df, CryptoBacktest, cash=1000000, exclusive_orders=True).run()
+    times, prices = load_ticks(["data/ticks.csv"], "BTC-USD")
+    corrected = resolve(stats, df, times, prices)
+  """
+  trades = stats["_trades"].copy()
+  equity = stats["_equity_curve"][["Equity"]].copy()
+  result = {"Intrabar Ambiguous": 0, "Intrabar From Ticks": 0, "Intrabar Changed": 0}
+
+  ambiguous = ambiguous_exits(trades, df) if len(trades) else np.zeros(0, dtype=bool)
+  if ambiguous.any():
+    candidates = trades[ambiguous]
+    tp_first = modeled_tp_first(candidates, df)
+    if tick_times is not None and len(tick_times):
+      from_ticks, resolved = tick_tp_first(candidates, df, tick_times, tick_prices)
+      tp_first = np.where(resolved, from_ticks, tp_first)
+      result["Intrabar From Ticks"] = int(resolved.sum())
+
+    old_exit = candidates["ExitPrice"].to_numpy(dtype=float)
+    new_exit = np.where(tp_first, candidates["TP"].to_numpy(dtype=float), candidates["SL"].to_numpy(dtype=float))
+    size = candidates["Size"].to_numpy(dtype=float)
+    pnl_change = size * (new_exit - old_exit)
+
+    index = trades.index[ambiguous]
+    trades.loc[index, "ExitPrice"] = new_exit
+    trades.loc[index, "PnL"] = candidates["PnL"].to_numpy(dtype=float) + pnl_change
+    trades.loc[index, "ReturnPct"] = candidates["ReturnPct"].to_numpy(dtype=float) + np.sign(size) * (new_exit - old_exit) / candidates["EntryPrice"].to_numpy(dtype=float)
+
+    changes = np.zeros(len(equity))
+    np.add.at(changes, candidates["ExitBar"].to_numpy(), pnl_change)
+    equity["Equity"] = equity["Equity"].to_numpy() + np.cumsum(changes)
+    result["Intrabar Ambiguous"] = int(ambiguous.sum())
+    result["Intrabar Changed"] = int(np.count_nonzero(new_exit != old_exit))
+
+  values = equity["Equity"].to_numpy()
+  equity["DrawdownPct"] = 1 - values / np.maximum.accumulate(values)
+  result.update({
+    "_trades": trades,
+    "_equity_curve": equity,
+    "# Trades": len(trades),
+    "Return [%]": float((values[-1] / values[0] - 1) * 100),
+    "Max. Drawdown [%]": float(-equity["DrawdownPct"].max() * 100),
+    "Win Rate [%]": float((trades["PnL"] > 0).mean() * 100) if len(trades) else np.nan,
+  })
+  return result
+
+
+def optimize_sl_tp(bt,
+                   df: pd.DataFrame,
+                   sl: Sequence[float],
+                   tp: Sequence[float],
+                   tick_times: Optional[np.ndarray]=None,
+                   tick_prices: Optional[np.ndarray]=None,
+                   maximize: str="Return [%]") -> pd.DataFrame:
+  """
+  Runs every sl/tp combination like Backtest.optimize, but ranks them by the
+  intrabar corrected results. Tight grids are where the bar-only fills are the
+  most wrong.
+  """
+  rows = []
+  for sl_value, tp_value in itertools.product(sl, tp):
+    stats = bt.run(sl=sl_value, tp=tp_value)
+    corrected = resolve(stats, df, tick_times, tick_prices)
+    rows.append({
+      "sl": sl_value,
+      "tp": tp_value,
+      f"Bar {maximize}": stats[maximize],
+      maximize: corrected[maximize],
+      "Intrabar Ambiguous": corrected["Intrabar Ambiguous"],
+      "Intrabar Changed": corrected["Intrabar Changed"],
+    })
+  return pd.DataFrame(rows).sort_values(maximize, ascending=False, ignore_index=True)
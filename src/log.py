@@ -1,50 +1,206 @@
 import pprint
 import threading
+import atexit
+import queue
+import json
+import time
+import sys
 from datetime import datetime
 from dotenv import load_dotenv
 import os
 
+from typing import Any, Optional, TextIO, Tuple
+
+_COLORS = {
+  "INFO": "\033[94m",
+  "WARNING": "\033[91m",
+}
+
+
+class _LogWriter:
+  """
+    Background writer shared by every log instance. Callers format their message
+    and push it onto a bounded queue; timestamps, stdout and the JSON-lines file
+    are all handled on the writer thread so a slow terminal never stalls trading
+    threads. When the queue is full records are dropped rather than blocking the
+    caller, and the number dropped is logged once the writer catches up.
+
+    Environment:
+      LOG_FILE: path of a JSON-lines log file. Not written when unset.
+      LOG_MAX_BYTES: size in bytes at which LOG_FILE is rotated (default 10MB).
+      LOG_BACKUP_COUNT: number of rotated files kept (default 5).
+      LOG_STDOUT: set to 0/false to stop printing to stdout.
+      LOG_QUEUE_SIZE: number of records that can wait for the writer (default 10000).
+  """
+  def __init__(self):
+    load_dotenv()
+    self.filepath: Optional[str] = os.getenv("LOG_FILE") or None
+    self.max_bytes: int = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+    self.backup_count: int = int(os.getenv("LOG_BACKUP_COUNT", 5))
+    self.to_stdout: bool = os.getenv("LOG_STDOUT", "1").lower() not in ("0", "false", "no")
+    self.dropped: int = 0
+
+    self.__queue: "queue.Queue[Any]" = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    self.__reported_dropped: int = 0
+    self.__file: Optional[TextIO] = None
+    self.__file_size: int = 0
+    self.__thread = threading.Thread(target=self.__run, name="log-writer", daemon=True)
+    self.__thread.start()
+    atexit.register(self.close)
+
+  def put(self, record: Tuple) -> None:
+    try:
+      self.__queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+  def flush(self, timeout: float=5.0) -> None:
+    flushed = threading.Event()
+    self.__queue.put(flushed)
+    flushed.wait(timeout)
+
+  def close(self) -> None:
+    if self.__thread.is_alive():
+      self.__queue.put(None)
+      self.__thread.join(timeout=5)
+
+  def __run(self) -> None:
+    while True:
+      record = self.__queue.get()
+      if record is None:
+        break
+      if isinstance(record, threading.Event):
+        sys.stdout.flush()
+        if self.__file is not None:
+          self.__file.flush()
+        record.set()
+        continue
+      try:
+        if self.dropped != self.__reported_dropped:
+          dropped, self.__reported_dropped = self.dropped - self.__reported_dropped, self.dropped
+          self.__write(record[0], "WARNING", "log.py", "log-writer", f"log queue was full, dropped {dropped} records", "\n", False)
+        self.__write(*record)
+      except Exception as e:
+        sys.stderr.write(f"log writer failed to write record: {e}\n")
+    if self.__file is not None:
+      self.__file.close()
+
+  def __write(self, created: float, level: str, filename: str, thread: str, message: str, end: str, pretty: bool) -> None:
+    timestamp = datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    if self.to_stdout:
+      if level in _COLORS:
+        sys.stdout.write(f"{_COLORS[level]}[{timestamp} {filename} {level}]\033[00m  {message}{end}")
+      elif pretty:
+        sys.stdout.write(f"[{timestamp} {filename}] \n{message}\n")
+      else:
+        sys.stdout.write(f"[{timestamp} {filename}]  {message}{end}")
+      if self.__queue.empty():
+        sys.stdout.flush()
+
+    if self.filepath is not None:
+      line = json.dumps({
+        "ts": timestamp,
+        "level": level,
+        "file": filename,
+        "thread": thread,
+        "msg": message,
+      }) + "\n"
+      self.__write_file(line)
+
+  def __write_file(self, line: str) -> None:
+    if self.__file is None:
+      self.__file = open(self.filepath, "a", encoding="utf-8")
+      self.__file_size = self.__file.tell()
+    size = len(line.encode("utf-8"))
+    if self.__file_size + size > self.max_bytes and self.__file_size > 0:
+      self.__rotate()
+    self.__file.write(line)
+    self.__file_size += size
+    if self.__queue.empty():
+      self.__file.flush()
+
+  def __rotate(self) -> None:
+    self.__file.close()
+    for i in range(self.backup_count - 1, 0, -1):
+      src = f"{self.filepath}.{i}"
+      if os.path.exists(src):
+        os.replace(src, f"{self.filepath}.{i + 1}")
+    if self.backup_count > 0:
+      os.replace(self.filepath, f"{self.filepath}.1")
+    else:
+      os.remove(self.filepath)
+    self.__file = open(self.filepath, "a", encoding="utf-8")
+    self.__file_size = 0
+
+
+_writer: Optional[_LogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _LogWriter:
+  global _writer
+  if _writer is None:
+    with _writer_lock:
+      if _writer is None:
+        _writer = _LogWriter()
+  return _writer
+
+
 class log:
-  _print_lock = threading.Lock()
+  """
+    Per-module logger. DEBUG enables every level, INFO enables info and warn,
+    and WARN enables warn only. print and pprint are debug output.
+
+    The message is formatted on the calling thread, so it shows the arguments as
+    they were at the call even if they change before the writer gets to it. An
+    argument that is a callable is only called once the level is known to be on,
+    so polling and per-tick paths pay nothing for a message that is filtered out:
+      l.info(lambda: f"{order_id}: Waiting to fill. State is {state}")
+  """
 
   def __init__(self, filename: str):
     if not filename.endswith(".py"):
       raise ValueError("Filename must be a .py file")
 
     load_dotenv()
-    try: 
+    try:
       self.is_debug_on = bool(os.getenv("DEBUG"))
-      self.is_warn_on = bool(os.getenv("WARN"))
-      self.is_info_on = bool(os.getenv("INFO"))
+      self.is_info_on = self.is_debug_on or bool(os.getenv("INFO"))
+      self.is_warn_on = self.is_info_on or bool(os.getenv("WARN"))
     except:
       self.is_debug_on = False
       self.is_warn_on = False
       self.is_info_on = False
     self.filename = os.path.basename(filename)
 
-  def __datetime_filename(self):
-    return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3] + " " + self.filename
+  def __emit(self, level: str, message: str, end: str, pretty: bool=False) -> None:
+    _get_writer().put((time.time(), level, self.filename, threading.current_thread().name, message, end, pretty))
+
+  @staticmethod
+  def __format(args: Tuple[Any, ...], sep: Optional[str]) -> str:
+    return (" " if sep is None else sep).join(str(arg() if callable(arg) else arg) for arg in args)
 
   def info(self, *args, end="\n", sep=None):
-    if self.is_debug_on:
-      with self._print_lock:
-        print(f"\033[94m[{self.__datetime_filename()} INFO]\033[00m ", *args, end=end, sep=sep)
+    if self.is_info_on:
+      self.__emit("INFO", self.__format(args, sep), end)
 
   def warn(self, *args, end="\n", sep=None):
-    if self.is_debug_on:
-      with self._print_lock:
-        print(f"\033[91m[{self.__datetime_filename()} WARNING]\033[00m ", *args, end=end, sep=sep)
+    if self.is_warn_on:
+      self.__emit("WARNING", self.__format(args, sep), end)
 
   def print(self, *args, end="\n", sep=None):
     if self.is_debug_on:
-      with self._print_lock:
-        print(f"[{self.__datetime_filename()}] ", *args, end=end, sep=sep)
+      self.__emit("DEBUG", self.__format(args, sep), end)
 
   def pprint(self, arg, indent=1, width=80):
     if self.is_debug_on:
-      with self._print_lock:
-        print(f"[{self.__datetime_filename()}] ")
-        pprint.pprint(arg, indent=indent, width=width)
+      self.__emit("DEBUG", pprint.pformat(arg, indent=indent, width=width), "\n", pretty=True)
+
+  @staticmethod
+  def flush() -> None:
+    """Blocks until everything queued so far is written. Used at shutdown."""
+    if _writer is not None:
+      _writer.flush()
 
 if __name__ == "__main__":
-  log.print_red("test")
+  log(__file__).warn("test")
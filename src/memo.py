@@ -0,0 +1,171 @@
+import collections
+import sys
+import threading
+
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.log import log
+l = log(__file__)
+
+
+class CandleMemo:
+  """
+    Process wide cache of values derived from a ticker's candles (indicators,
+    rolling stats, ...), keyed by (ticker, timestamp of the newest candle,
+    function, arguments). Every strategy in the process shares it, so a value
+    several strategies need for the same candle is computed once.
+
+    A ticker's entries are dropped as soon as a lookup for a newer candle of it
+    comes in, and the least recently used entries are dropped whenever the
+    cached values add up to more than `budget_bytes`. Concurrent lookups of the
+    same missing key wait for the one computing it instead of repeating the work.
+
+    Cached values are shared between threads and strategies and must be treated
+    as read-only; NumPy arrays are marked read-only when they are stored.
+
+    Usage:
+      from src.memo import memo
+      value = memo.get_or_compute("BTC-USD", "2025-01-01 12:00:59", "ao", (250,), compute)
+      memo.stats()  # {"hits": ..., "misses": ..., "hit_rate": ..., ...}
+  """
+  def __init__(self, budget_bytes: int=64 * 1024 * 1024):
+    self.budget_bytes: int = budget_bytes
+    self.bytes: int = 0
+    self.hits: int = 0
+    self.misses: int = 0
+    self.evictions: int = 0
+
+    self.__entries: "collections.OrderedDict[Tuple, Tuple[Any, int]]" = collections.OrderedDict()
+    self.__ticker_keys: Dict[str, Set[Tuple]] = {}
+    self.__newest: Dict[str, str] = {}
+    self.__compute_locks: Dict[Tuple, threading.Lock] = {}
+    self.__function_stats: Dict[str, list] = {}
+    self.__lock = threading.Lock()
+
+  def get_or_compute(self, ticker: str, timestamp: str, name: str, args: Tuple, compute: Callable[[], Any]) -> Any:
+    key = (ticker, timestamp, name, args)
+    with self.__lock:
+      newest = self.__newest.get(ticker)
+      # A slow reader still on an older candle gets its value computed but not kept
+      stale = newest is not None and timestamp < newest
+      if stale:
+        self.__count(name, hit=False)
+      else:
+        if newest is None or timestamp > newest:
+          self.__evict_ticker(ticker)
+          self.__newest[ticker] = timestamp
+        entry = self.__entries.get(key)
+        if entry is not None:
+          self.__entries.move_to_end(key)
+          self.__count(name, hit=True)
+          return entry[0]
+        compute_lock = self.__compute_locks.setdefault(key, threading.Lock())
+    if stale:
+      return compute()
+
+    with compute_lock:
+      with self.__lock:
+        # Another thread may have computed it while this one waited
+        entry = self.__entries.get(key)
+        if entry is not None:
+          self.__entries.move_to_end(key)
+          self.__count(name, hit=True)
+          return entry[0]
+        self.__count(name, hit=False)
+      try:
+        value = compute()
+      finally:
+        with self.__lock:
+          self.__compute_locks.pop(key, None)
+      self.__store(key, _freeze(value))
+      return value
+
+  def __store(self, key: Tuple, value: Any) -> None:
+    size = _nbytes(value)
+    if size > self.budget_bytes:
+      return
+    ticker, timestamp = key[0], key[1]
+    with self.__lock:
+      # The ticker may have moved on to a newer candle during the computation
+      if self.__newest.get(ticker) != timestamp or key in self.__entries:
+        return
+      self.__entries[key] = (value, size)
+      self.__ticker_keys.setdefault(ticker, set()).add(key)
+      self.bytes += size
+      while self.bytes > self.budget_bytes:
+        old_key, (_, old_size) = self.__entries.popitem(last=False)
+        self.__ticker_keys[old_key[0]].discard(old_key)
+        self.bytes -= old_size
+        self.evictions += 1
+
+  def __evict_ticker(self, ticker: str) -> None:
+    for key in self.__ticker_keys.pop(ticker, ()):
+      _, size = self.__entries.pop(key)
+      self.bytes -= size
+      self.evictions += 1
+
+  def __count(self, name: str, hit: bool) -> None:
+    counts = self.__function_stats.setdefault(name, [0, 0])
+    if hit:
+      self.hits += 1
+      counts[0] += 1
+    else:
+      self.misses += 1
+      counts[1] += 1
+
+  def clear(self) -> None:
+    with self.__lock:
+      self.__entries.clear()
+      self.__ticker_keys.clear()
+      self.__newest.clear()
+      self.bytes = 0
+
+  def stats(self) -> Dict[str, Any]:
+    """Hit/miss counts and rates overall and per cached function, plus the current size of the cache."""
+    with self.__lock:
+      functions = {name: {"hits": hits, "misses": misses, "hit_rate": _rate(hits, misses)} for name, (hits, misses) in self.__function_stats.items()}
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": _rate(self.hits, self.misses),
+        "entries": len(self.__entries),
+        "bytes": self.bytes,
+        "evictions": self.evictions,
+        "functions": functions,
+      }
+
+
+def _rate(hits: int, misses: int) -> Optional[float]:
+  return hits / (hits + misses) if hits + misses else None
+
+
+def _freeze(value: Any) -> Any:
+  if isinstance(value, np.ndarray):
+    value.flags.writeable = False
+  elif isinstance(value, (tuple, list)):
+    for item in value:
+      _freeze(item)
+  elif isinstance(value, dict):
+    for item in value.values():
+      _freeze(item)
+  return value
+
+
+def _nbytes(value: Any) -> int:
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if isinstance(value, pd.DataFrame):
+    return int(value.memory_usage(deep=True).sum())
+  if isinstance(value, pd.Series):
+    return int(value.memory_usage(deep=True))
+  if isinstance(value, (tuple, list)):
+    return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+  if isinstance(value, dict):
+    return sys.getsizeof(value) + sum(_nbytes(item) for item in value.values())
+  return sys.getsizeof(value)
+
+
+memo = CandleMemo()
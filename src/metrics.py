@@ -0,0 +1,90 @@
+import collections
+import threading
+
+from typing import Deque, Dict
+
+
+class Timer:
+  """
+    Keeps the most recent `capacity` samples of a duration (in seconds) and
+    reports count/mean/percentiles over them. Recording is a lock protected
+    append so it is cheap enough for order and ingest hot paths.
+  """
+  def __init__(self, capacity: int=10000):
+    self.capacity: int = capacity
+    self.count: int = 0
+    self.total: float = 0.0
+    self.__samples: Deque[float] = collections.deque(maxlen=capacity)
+    self.__lock = threading.Lock()
+
+  def record(self, seconds: float) -> None:
+    with self.__lock:
+      self.count += 1
+      self.total += seconds
+      self.__samples.append(seconds)
+
+  def summary(self) -> Dict[str, float]:
+    with self.__lock:
+      samples = sorted(self.__samples)
+      count, total = self.count, self.total
+    if not samples:
+      return {"count": count}
+
+    def percentile(p: float) -> float:
+      return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    return {
+      "count": count,
+      "mean_ms": total / count * 1000,
+      "p50_ms": percentile(0.50) * 1000,
+      "p90_ms": percentile(0.90) * 1000,
+      "p99_ms": percentile(0.99) * 1000,
+      "max_ms": samples[-1] * 1000,
+    }
+
+
+class Counter:
+  def __init__(self):
+    self.value: int = 0
+    self.__lock = threading.Lock()
+
+  def inc(self, amount: int=1) -> None:
+    with self.__lock:
+      self.value += amount
+
+
+class Metrics:
+  """
+    Process wide registry of named timers and counters.
+
+    Usage:
+      from src.metrics import metrics
+      metrics.timer("order.signal_to_wire").record(elapsed)
+      metrics.summary()
+  """
+  def __init__(self):
+    self.__timers: Dict[str, Timer] = {}
+    self.__counters: Dict[str, Counter] = {}
+    self.__lock = threading.Lock()
+
+  def timer(self, name: str) -> Timer:
+    timer = self.__timers.get(name)
+    if timer is None:
+      with self.__lock:
+        timer = self.__timers.setdefault(name, Timer())
+    return timer
+
+  def counter(self, name: str) -> Counter:
+    counter = self.__counters.get(name)
+    if counter is None:
+      with self.__lock:
+        counter = self.__counters.setdefault(name, Counter())
+    return counter
+
+  def summary(self) -> Dict[str, Dict]:
+    summary = {name: timer.summary() for name, timer in list(self.__timers.items())}
+    summary.update({name: {"count": counter.value} for name, counter in list(self.__counters.items())})
+    return summary
+
+
+metrics = Metrics()
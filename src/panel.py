@@ -0,0 +1,227 @@
+import threading
+
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from src.log import log
+l = log(__file__)
+
+FIELDS = ["Open", "High", "Low", "Close"]
+_MINUTE = np.timedelta64(1, "m")
+
+
+def to_minute(timestamp) -> np.datetime64:
+  """Floors a "%Y-%m-%d %H:%M:%S" timestamp (or datetime64) to its minute."""
+  if isinstance(timestamp, str):
+    timestamp = timestamp[:16]
+  return np.datetime64(timestamp, "m")
+
+
+class PanelView:
+  """
+    Read-only, aligned time x ticker x OHLC window handed to run_batch callbacks.
+    Missing candles are NaN.
+
+    Attributes:
+      times (np.ndarray): datetime64[m] minute of every row, oldest first.
+      tickers (List[str]): Ticker of every column.
+      values (np.ndarray): (time, ticker, 4) float64 array in Open, High, Low, Close order.
+  """
+  __slots__ = ("times", "tickers", "values")
+
+  def __init__(self, times: np.ndarray, tickers: List[str], values: np.ndarray):
+    self.times: np.ndarray = times
+    self.tickers: List[str] = tickers
+    self.values: np.ndarray = values
+
+  def __len__(self):
+    return len(self.times)
+
+  def field(self, name: str) -> np.ndarray:
+    """(time, ticker) array of one of Open, High, Low or Close."""
+    return self.values[:, :, FIELDS.index(name)]
+
+  @property
+  def open(self) -> np.ndarray:
+    return self.values[:, :, 0]
+
+  @property
+  def high(self) -> np.ndarray:
+    return self.values[:, :, 1]
+
+  @property
+  def low(self) -> np.ndarray:
+    return self.values[:, :, 2]
+
+  @property
+  def close(self) -> np.ndarray:
+    return self.values[:, :, 3]
+
+
+class CandlePanel:
+  """
+    Aligned OHLC history for a fixed universe of tickers, maintained one candle
+    at a time as DataCollection finalizes them.
+
+    Rows live in a buffer twice the window capacity. New minutes are appended at
+    the end, and when the buffer is full the last `capacity` rows are copied into
+    a new buffer, so appends are amortized O(tickers) and a view of the newest
+    rows is always a contiguous slice. Views handed out earlier keep pointing at
+    the old buffer and are never overwritten.
+
+    Once every ticker has a candle for the newest minute (or `grace` seconds
+    after the first one arrived) the minute is complete and listeners are called
+    with it.
+  """
+  def __init__(self, tickers: Sequence[str], capacity: int=1440, grace: float=5.0):
+    self.tickers: List[str] = list(tickers)
+    self.capacity: int = capacity
+    self.grace: float = grace
+
+    self.__columns: Dict[str, int] = {ticker: i for i, ticker in enumerate(self.tickers)}
+    self.__values = np.full((2 * capacity, len(self.tickers), len(FIELDS)), np.nan)
+    self.__times = np.full(2 * capacity, np.datetime64("NaT"), dtype="datetime64[m]")
+    self.__end: int = 0
+    # (values, times, end) swapped in as one reference so lock-free readers never
+    # pair a new buffer with an old end or the other way around
+    self.__published = (self.__values, self.__times, 0)
+    self.__pending: Dict[np.datetime64, set] = {}
+    self.__timers: Dict[np.datetime64, threading.Timer] = {}
+    self.__completed: Optional[np.datetime64] = None
+    self.__listeners: List[Callable[[np.datetime64], None]] = []
+    self.__lock = threading.Lock()
+
+  def add_listener(self, callback: Callable[[np.datetime64], None]) -> None:
+    self.__listeners.append(callback)
+
+  def view(self, max: Optional[int]=None) -> PanelView:
+    values, times, end = self.__published
+    start = end - max if max and end > max else 0
+    values_view = values[start:end]
+    values_view.flags.writeable = False
+    times_view = times[start:end]
+    times_view.flags.writeable = False
+    return PanelView(times_view, self.tickers, values_view)
+
+  def seed(self, ticker: str, timestamps: Sequence, ohlc: np.ndarray) -> None:
+    """Bulk loads a ticker's existing history. Seeded minutes never fire listeners."""
+    if len(timestamps) == 0:
+      return
+    if isinstance(timestamps, np.ndarray) and np.issubdtype(timestamps.dtype, np.datetime64):
+      minutes = timestamps.astype("datetime64[m]")
+    else:
+      minutes = np.array([to_minute(t) for t in timestamps], dtype="datetime64[m]")
+    with self.__lock:
+      if self.__end == 0:
+        span = int((minutes[-1] - minutes[0]) // _MINUTE) + 1
+        seeded = min(span, self.capacity)
+        self.__times[:seeded] = minutes[-1] - np.arange(seeded - 1, -1, -1) * _MINUTE
+        self.__end = seeded
+      else:
+        self.__advance_to(minutes[-1])
+      rows = ((minutes - self.__times[0]) // _MINUTE).astype(np.int64)
+      keep = (rows >= 0) & (rows < self.__end)
+      self.__values[rows[keep], self.__columns[ticker]] = np.asarray(ohlc, dtype=np.float64)[keep]
+      if self.__completed is None or self.__completed < minutes[-1]:
+        self.__completed = self.__times[self.__end - 1]
+      self.__published = (self.__values, self.__times, self.__end)
+
+  def add(self, ticker: str, timestamp, open_: float, high_: float, low_: float, close_: float) -> None:
+    if ticker not in self.__columns:
+      return
+    minute = to_minute(timestamp)
+    completed = None
+    with self.__lock:
+      if self.__completed is not None and minute <= self.__completed:
+        row = self.__row(minute)
+        if row is not None:
+          self.__values[row, self.__columns[ticker]] = (open_, high_, low_, close_)
+        return
+      self.__advance_to(minute)
+      row = self.__row(minute)
+      self.__values[row, self.__columns[ticker]] = (open_, high_, low_, close_)
+      self.__published = (self.__values, self.__times, self.__end)
+
+      pending = self.__pending.get(minute)
+      if pending is None:
+        pending = self.__pending[minute] = set(self.tickers)
+        if len(self.tickers) > 1:
+          timer = threading.Timer(self.grace, self.__complete, args=(minute,))
+          timer.daemon = True
+          self.__timers[minute] = timer
+          timer.start()
+      pending.discard(ticker)
+      if not pending:
+        completed = self.__mark_complete(minute)
+
+    if completed is not None:
+      self.__notify(completed)
+
+  def __complete(self, minute: np.datetime64) -> None:
+    with self.__lock:
+      if minute not in self.__pending:
+        return
+      missing = self.__pending[minute]
+      completed = self.__mark_complete(minute)
+    if completed is not None:
+      l.warn(f"Panel minute {minute} completed without {sorted(missing)} after {self.grace}s")
+      self.__notify(completed)
+
+  def __mark_complete(self, minute: np.datetime64) -> Optional[np.datetime64]:
+    self.__pending.pop(minute, None)
+    timer = self.__timers.pop(minute, None)
+    if timer is not None:
+      timer.cancel()
+    # Older minutes that were still waiting are superseded by this one
+    for older in [m for m in self.__pending if m < minute]:
+      self.__pending.pop(older)
+      older_timer = self.__timers.pop(older, None)
+      if older_timer is not None:
+        older_timer.cancel()
+    if self.__completed is not None and minute <= self.__completed:
+      return None
+    self.__completed = minute
+    return minute
+
+  def __notify(self, minute: np.datetime64) -> None:
+    for listener in self.__listeners:
+      try:
+        listener(minute)
+      except Exception as e:
+        l.warn(f"Panel listener raised: {e}")
+
+  def __row(self, minute: np.datetime64) -> Optional[int]:
+    if self.__end == 0:
+      return None
+    row = self.__end - 1 - int((self.__times[self.__end - 1] - minute) // _MINUTE)
+    if row < 0 or row >= self.__end:
+      return None
+    return row
+
+  def __advance_to(self, minute: np.datetime64) -> None:
+    if self.__end == 0:
+      self.__times[0] = minute
+      self.__end = 1
+      return
+    last = self.__times[self.__end - 1]
+    if minute <= last:
+      return
+    new_rows = int((minute - last) // _MINUTE)
+    if new_rows >= self.capacity:
+      # A gap longer than the window; start over at this minute
+      self.__values = np.full_like(self.__values, np.nan)
+      self.__times = np.full_like(self.__times, np.datetime64("NaT"))
+      self.__times[0] = minute
+      self.__end = 1
+      return
+    if self.__end + new_rows > len(self.__times):
+      keep = self.capacity - new_rows
+      values = np.full_like(self.__values, np.nan)
+      times = np.full_like(self.__times, np.datetime64("NaT"))
+      values[:keep] = self.__values[self.__end - keep:self.__end]
+      times[:keep] = self.__times[self.__end - keep:self.__end]
+      self.__values, self.__times, self.__end = values, times, keep
+    self.__times[self.__end:self.__end + new_rows] = last + np.arange(1, new_rows + 1) * _MINUTE
+    self.__end += new_rows
+
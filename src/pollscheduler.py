@@ -0,0 +1,131 @@
+import random
+import math
+import time
+import zlib
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.log import log
+l = log(__file__)
+
+
+class PollScheduler:
+  """
+    Plans when the collector polls get_best_bid_ask and for which tickers.
+
+    Every minute gets `requests_per_minute` slots on the monotonic clock,
+    anchored to the wall clock minute so request latency never pushes later
+    polls back. The first and last slots sit `open_offset` seconds after the
+    minute opens and `close_offset` seconds before it closes and always include
+    every ticker, so each candle's Open and Close are sampled at the edges of the
+    minute. The slots in between are evenly spaced with random jitter, so
+    samples don't cluster at the same second every minute.
+
+    Interior slots are shared out by recent volatility, measured against the
+    most volatile ticker or `reference_volatility` (stdev of log returns per
+    square root second), whichever is larger. Tickers close to it (and any with
+    an open position) are in every slot, quieter ones in every 2nd or 4th. A
+    slot with no ticker due is skipped, so a calm market uses fewer requests and
+    leaves more of the shared rate limit to orders.
+
+    Usage:
+      scheduler = PollScheduler(requests_per_minute=28, has_position=lambda t: t in open_tickers)
+      deadline, tickers = scheduler.next_poll(["BTC-USD", "ETH-USD"])
+  """
+  def __init__(self,
+               requests_per_minute: int=28,
+               open_offset: float=0.5,
+               close_offset: float=0.75,
+               jitter: float=0.25,
+               max_skip: int=4,
+               half_life: float=20.0,
+               reference_volatility: float=5e-5,
+               has_position: Optional[Callable[[str], bool]]=None,
+               seed: Optional[int]=None):
+    if requests_per_minute < 2:
+      raise ValueError("requests_per_minute must be at least 2 to sample both the open and the close of every minute.")
+    if not 0 <= jitter < 0.5:
+      raise ValueError("jitter must be in [0, 0.5) of the slot spacing.")
+    self.requests_per_minute: int = requests_per_minute
+    self.open_offset: float = open_offset
+    self.close_offset: float = close_offset
+    self.jitter: float = jitter
+    self.max_skip: int = max_skip
+    self.reference_volatility: float = reference_volatility
+    self.has_position: Optional[Callable[[str], bool]] = has_position
+
+    self.__alpha: float = 1 - 0.5 ** (1 / half_life)
+    self.__random = random.Random(seed)
+    self.__variance: Dict[str, float] = {}
+    self.__last_sample: Dict[str, Tuple[float, float]] = {}
+    self.__plan_minute: Optional[int] = None
+    self.__plan: List[float] = []
+    self.__last_deadline: float = float("-inf")
+
+  def observe(self, ticker: str, price: float, timestamp: Optional[float]=None) -> None:
+    """Feeds a sampled price into the ticker's volatility estimate (variance of log returns per second)."""
+    if timestamp is None:
+      timestamp = time.monotonic()
+    last = self.__last_sample.get(ticker)
+    self.__last_sample[ticker] = (timestamp, price)
+    if last is None or price <= 0 or last[1] <= 0 or timestamp <= last[0]:
+      return
+    variance = math.log(price / last[1]) ** 2 / (timestamp - last[0])
+    previous = self.__variance.get(ticker)
+    self.__variance[ticker] = variance if previous is None else previous + self.__alpha * (variance - previous)
+
+  def skip(self, ticker: str) -> int:
+    """Poll the ticker in every skip-th interior slot: 1, 2, 4, ... up to max_skip."""
+    if self.has_position is not None and self.has_position(ticker):
+      return 1
+    variance = self.__variance.get(ticker)
+    if not variance:
+      return 1
+    loudest = max(max(self.__variance.values()), self.reference_volatility ** 2)
+    ratio = math.sqrt(variance / loudest)
+    skip = 1
+    while skip < self.max_skip and ratio < 0.5 / skip:
+      skip *= 2
+    return skip
+
+  def next_poll(self, tickers: List[str]) -> Tuple[float, List[str]]:
+    """
+    Returns the time.monotonic() deadline of the next slot that has tickers due
+    and those tickers. Slots already in the past are skipped rather than
+    bunched up, so a slow request never causes a burst.
+    """
+    skips = {ticker: self.skip(ticker) for ticker in tickers}
+    wall, mono = time.time(), time.monotonic()
+    minute = int(wall // 60)
+    minute_start = mono - (wall - minute * 60)
+    while True:
+      plan = self.__plan_for(minute)
+      for slot, offset in enumerate(plan):
+        deadline = minute_start + offset
+        if deadline <= self.__last_deadline or deadline < mono:
+          continue
+        if slot == 0 or slot == len(plan) - 1:
+          due = list(tickers)
+        else:
+          due = [ticker for ticker in tickers if (slot + _phase(ticker)) % skips[ticker] == 0]
+        if due or not tickers:
+          self.__last_deadline = deadline
+          return deadline, due
+      minute += 1
+      minute_start += 60
+
+  def __plan_for(self, minute: int) -> List[float]:
+    if self.__plan_minute != minute:
+      interior = self.requests_per_minute - 2
+      span = 60 - self.open_offset - self.close_offset
+      spacing = span / (interior + 1)
+      self.__plan = [self.open_offset]
+      self.__plan += [self.open_offset + spacing * (j + 1 + self.__random.uniform(-self.jitter, self.jitter)) for j in range(interior)]
+      self.__plan.append(60 - self.close_offset)
+      self.__plan_minute = minute
+    return self.__plan
+
+
+def _phase(ticker: str) -> int:
+  # Stable across restarts so quiet tickers don't all land in the same slots
+  return zlib.crc32(ticker.encode())
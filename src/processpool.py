@@ -0,0 +1,189 @@
+import concurrent.futures
+import multiprocessing as mp
+import importlib
+import threading
+import inspect
+
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.log import log
+l = log(__file__)
+
+_COLUMNS = ["Timestamp", "Open", "High", "Low", "Close"]
+
+# Order methods a process callback may call. They are recorded in the worker
+# and executed by the parent through its single API client.
+_ORDER_INTENTS = ("long",)
+
+
+class SharedWindow:
+  """
+    Fixed size block of shared memory holding the latest candles of a ticker as
+    a (capacity, 5) float64 array of epoch seconds, Open, High, Low and Close.
+    The parent writes the window before each dispatch and workers map the same
+    block, so no DataFrame is pickled per callback.
+  """
+  def __init__(self, capacity: int):
+    self.capacity: int = capacity
+    self.shm = shared_memory.SharedMemory(create=True, size=capacity * len(_COLUMNS) * 8)
+    self.array = np.ndarray((capacity, len(_COLUMNS)), dtype=np.float64, buffer=self.shm.buf)
+
+  @property
+  def name(self) -> str:
+    return self.shm.name
+
+  def write(self, arrays: Dict[str, np.ndarray]) -> int:
+    rows = min(len(arrays["Timestamp"]), self.capacity)
+    if rows == 0:
+      return 0
+    self.array[:rows, 0] = arrays["Timestamp"][-rows:].astype("datetime64[s]").astype(np.int64)
+    for i, column in enumerate(_COLUMNS[1:], start=1):
+      self.array[:rows, i] = arrays[column][-rows:]
+    return rows
+
+  def close(self) -> None:
+    self.shm.close()
+    try:
+      self.shm.unlink()
+    except FileNotFoundError:
+      pass
+
+
+class ProcessContext:
+  """
+    Stand-in for the strategy instance inside a worker process. It serves
+    get_df()/get_arrays() from the shared window of the callback's ticker,
+    exposes the strategy attributes listed in its `process_attributes` as a
+    read-only snapshot, and records long() calls as order intents for the parent.
+  """
+  def __init__(self, ticker: str, window: np.ndarray, attributes: Dict[str, Any]):
+    self.__ticker = ticker
+    self.__window = window
+    self.__attributes = attributes
+    self.intents: List[Tuple[str, Dict[str, Any]]] = []
+
+  def __getattr__(self, name: str):
+    attributes = self.__dict__.get("_ProcessContext__attributes", {})
+    if name in attributes:
+      return attributes[name]
+    raise AttributeError(f"'{name}' is not available in a process callback. List it in the strategy's process_attributes to pass a snapshot.")
+
+  def __check_ticker(self, ticker: str) -> None:
+    if ticker != self.__ticker:
+      raise ValueError(f"Process callbacks only have the window of their own ticker ({self.__ticker}), not {ticker}.")
+
+  def get_arrays(self, ticker: str, max=None) -> Dict[str, np.ndarray]:
+    self.__check_ticker(ticker)
+    window = self.__window[-max:] if max else self.__window
+    arrays = {"Timestamp": window[:, 0].astype(np.int64).astype("datetime64[s]").astype("datetime64[ns]")}
+    # Columns of the row-major shared block are strided, and talib wants contiguous input
+    arrays.update({column: np.ascontiguousarray(window[:, i]) for i, column in enumerate(_COLUMNS) if i > 0})
+    return arrays
+
+  def get_df(self, ticker: str, max=None) -> pd.DataFrame:
+    self.__check_ticker(ticker)
+    arrays = self.get_arrays(ticker, max=max)
+    index = pd.DatetimeIndex(arrays.pop("Timestamp"), name="Timestamp")
+    return pd.DataFrame(arrays, index=index, copy=False)
+
+  def long(self, ticker: str, **kwargs) -> None:
+    self.intents.append(("long", dict(kwargs, ticker=ticker)))
+
+
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+  shm = _attached.get(name)
+  if shm is None:
+    # Workers share the parent's resource tracker, so attaching here does not
+    # hand ownership of the block to the worker; the parent unlinks it.
+    shm = shared_memory.SharedMemory(name=name)
+    _attached[name] = shm
+  return shm
+
+
+def _resolve(module: str, qualname: str):
+  obj = importlib.import_module(module)
+  for part in qualname.split("."):
+    obj = getattr(obj, part)
+  return inspect.unwrap(obj)
+
+
+def _run_callback(module: str,
+                  qualname: str,
+                  ticker: str,
+                  shm_name: str,
+                  capacity: int,
+                  rows: int,
+                  attributes: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+  func = _resolve(module, qualname)
+  shm = _attach(shm_name)
+  window = np.ndarray((capacity, len(_COLUMNS)), dtype=np.float64, buffer=shm.buf)[:rows]
+  window.flags.writeable = False
+  context = ProcessContext(ticker, window, attributes)
+  func(context, ticker)
+  return context.intents
+
+
+class ProcessCallbackRunner:
+  """
+    Runs @RobinCrypto.run(executor="process") callbacks in a process pool so
+    CPU heavy strategies across many tickers use every core instead of
+    serializing on the GIL.
+
+    Every call writes the latest `window` candles of its ticker into a
+    SharedWindow of that size that no other call is using: windows are handed
+    out from a free list per size and returned once the worker is done, so concurrent calls for one ticker never wait on each other and a
+    window is never overwritten while a worker reads it. The worker runs the
+    undecorated strategy function against a ProcessContext and returns the
+    order intents it recorded, which the parent executes on the real strategy.
+  """
+  def __init__(self, max_workers: Optional[int]=None, window: int=500, start_method: str="spawn"):
+    self.window: int = window
+    self.__pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=mp.get_context(start_method))
+    self.__free_windows: Dict[int, List[SharedWindow]] = {}
+    self.__all_windows: List[SharedWindow] = []
+    self.__lock = threading.Lock()
+
+  def __take_window(self, window: int) -> SharedWindow:
+    with self.__lock:
+      free = self.__free_windows.setdefault(window, [])
+      if free:
+        return free.pop()
+      shared_window = SharedWindow(window)
+      self.__all_windows.append(shared_window)
+      return shared_window
+
+  def __give_back(self, shared_window: SharedWindow) -> None:
+    with self.__lock:
+      self.__free_windows.setdefault(shared_window.capacity, []).append(shared_window)
+
+  def call(self, strategy, func, ticker: str, window: Optional[int]=None) -> None:
+    window = self.window if window is None else window
+    attributes = {name: getattr(strategy, name) for name in getattr(strategy, "process_attributes", ())}
+    shared_window = self.__take_window(window)
+    try:
+      rows = shared_window.write(strategy.get_arrays(ticker, max=window))
+      future = self.__pool.submit(_run_callback, func.__module__, func.__qualname__, ticker, shared_window.name, shared_window.capacity, rows, attributes)
+      intents = future.result()
+    finally:
+      self.__give_back(shared_window)
+
+    for method, kwargs in intents:
+      if method not in _ORDER_INTENTS:
+        l.warn(f"[{ticker}] Ignoring unknown order intent {method} from a process callback.")
+        continue
+      getattr(strategy, method)(**kwargs)
+
+  def shutdown(self) -> None:
+    self.__pool.shutdown(wait=True, cancel_futures=True)
+    with self.__lock:
+      for shared_window in self.__all_windows:
+        shared_window.close()
+      self.__all_windows.clear()
+      self.__free_windows.clear()
@@ -0,0 +1,124 @@
+import collections
+import threading
+import signal
+import time
+import sys
+import os
+
+from typing import Callable, Dict, Optional
+
+from src.log import log
+l = log(__file__)
+
+
+class CallbackProfiler:
+  """
+    Opt-in profiler for strategy callbacks run through @RobinCrypto.run(profile=True).
+
+    Every callback invocation records its wall and CPU time per ticker. While a
+    callback is running, a single sampler thread snapshots that thread's stack
+    every sample_interval seconds and counts it in collapsed-stack form
+    ("ticker;module:function;module:function count"), which flamegraph.pl and
+    speedscope read directly. Threads outside callbacks are never sampled.
+
+    The aggregated stacks can be dumped at any time with dump(), or by sending
+    the process dump_signal (SIGUSR1 by default) when it was installed from the
+    main thread.
+  """
+  def __init__(self,
+               sample_interval: float=0.005,
+               dump_path: Optional[str]=None,
+               dump_signal: Optional[int]=getattr(signal, "SIGUSR1", None)):
+    self.sample_interval: float = sample_interval
+    self.dump_path: str = dump_path or f"profile-{os.getpid()}.collapsed"
+
+    self.__active: Dict[int, str] = {}
+    self.__stacks: Dict[str, int] = collections.Counter()
+    self.__timings: Dict[str, Dict[str, float]] = {}
+    self.__lock = threading.Lock()
+    self.__stop_event = threading.Event()
+    self.__sampler: Optional[threading.Thread] = None
+    self.__dump_signal = dump_signal
+    self.__call_code = CallbackProfiler.call.__code__
+
+  def start(self) -> None:
+    if self.__sampler is not None and self.__sampler.is_alive():
+      return
+    self.__sampler = threading.Thread(target=self.__run_sampler, name="callback-profiler", daemon=True)
+    self.__sampler.start()
+    if self.__dump_signal is not None and threading.current_thread() is threading.main_thread():
+      # Dump from a fresh thread so the handler never waits on a lock the
+      # interrupted main thread might be holding.
+      signal.signal(self.__dump_signal, lambda signum, frame: threading.Thread(target=self.dump, daemon=True).start())
+
+  def call(self, ticker: str, func: Callable, *args, **kwargs):
+    thread_id = threading.get_ident()
+    self.__active[thread_id] = ticker
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      cpu = time.thread_time() - cpu_start
+      wall = time.perf_counter() - wall_start
+      self.__active.pop(thread_id, None)
+      self.__record(ticker, wall, cpu)
+
+  def __record(self, ticker: str, wall: float, cpu: float) -> None:
+    with self.__lock:
+      timing = self.__timings.get(ticker)
+      if timing is None:
+        timing = self.__timings[ticker] = {"calls": 0, "wall_total": 0.0, "wall_max": 0.0, "cpu_total": 0.0, "wall_last": 0.0, "cpu_last": 0.0}
+      timing["calls"] += 1
+      timing["wall_total"] += wall
+      timing["cpu_total"] += cpu
+      timing["wall_max"] = max(timing["wall_max"], wall)
+      timing["wall_last"] = wall
+      timing["cpu_last"] = cpu
+
+  def __run_sampler(self) -> None:
+    while not self.__stop_event.wait(self.sample_interval):
+      if not self.__active:
+        continue
+      frames = sys._current_frames()
+      samples = []
+      for thread_id, ticker in list(self.__active.items()):
+        frame = frames.get(thread_id)
+        if frame is None:
+          continue
+        stack = []
+        while frame is not None and frame.f_code is not self.__call_code:
+          code = frame.f_code
+          stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+          frame = frame.f_back
+        stack.append(ticker)
+        samples.append(";".join(reversed(stack)))
+      del frames
+      with self.__lock:
+        self.__stacks.update(samples)
+
+  def timings(self) -> Dict[str, Dict[str, float]]:
+    with self.__lock:
+      return {ticker: dict(timing) for ticker, timing in self.__timings.items()}
+
+  def collapsed(self) -> str:
+    with self.__lock:
+      stacks = list(self.__stacks.items())
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(stacks)) + "\n"
+
+  def dump(self, path: Optional[str]=None) -> str:
+    path = path or self.dump_path
+    with open(path, "w") as file:
+      file.write(self.collapsed())
+    for ticker, timing in self.timings().items():
+      l.info(f"[{ticker}] PROFILE [CALLS: {timing['calls']}][WALL AVG: {timing['wall_total'] / timing['calls'] * 1000:.2f}ms][WALL MAX: {timing['wall_max'] * 1000:.2f}ms][CPU AVG: {timing['cpu_total'] / timing['calls'] * 1000:.2f}ms]")
+    l.info(f"Wrote collapsed callback stacks to {path}")
+    return path
+
+  def reset(self) -> None:
+    with self.__lock:
+      self.__stacks.clear()
+      self.__timings.clear()
+
+  def stop(self) -> None:
+    self.__stop_event.set()
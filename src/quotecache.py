@@ -0,0 +1,149 @@
+import threading
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+from src.log import log
+l = log(__file__)
+
+
+class Quote:
+  """
+    Immutable price sample for a ticker. A newer sample is published by
+    replacing the Quote object, never by mutating one, so a reader always sees
+    price, bid, ask and estimates from the same moment.
+
+    Attributes:
+      price (float): Mid price reported by the best bid/ask endpoint.
+      bid (Optional[float]): Best bid including the sell spread.
+      ask (Optional[float]): Best ask including the buy spread.
+      estimates (Dict[Tuple[str, float], float]): Estimated execution price per (side, quantity) tier.
+      updated_at (float): time.monotonic() of the sample.
+  """
+  __slots__ = ("ticker", "price", "bid", "ask", "estimates", "updated_at")
+
+  def __init__(self,
+               ticker: str,
+               price: float,
+               bid: Optional[float]=None,
+               ask: Optional[float]=None,
+               estimates: Optional[Dict[Tuple[str, float], float]]=None,
+               updated_at: Optional[float]=None):
+    self.ticker: str = ticker
+    self.price: float = price
+    self.bid: Optional[float] = bid
+    self.ask: Optional[float] = ask
+    self.estimates: Dict[Tuple[str, float], float] = estimates if estimates is not None else {}
+    self.updated_at: float = updated_at if updated_at is not None else time.monotonic()
+
+  @property
+  def age(self) -> float:
+    return time.monotonic() - self.updated_at
+
+  def estimated_price(self, side: str, quantity: float) -> Optional[float]:
+    """Returns the estimate of the smallest cached tier that covers quantity."""
+    tiers = sorted(q for s, q in self.estimates if s == side and q >= quantity)
+    if not tiers:
+      return None
+    return self.estimates[(side, tiers[0])]
+
+
+class QuoteCache:
+  """
+    Latest Quote per ticker, shared between the collector and strategy threads.
+
+    The collector (or the exit engine's poller) publishes every best bid/ask
+    sample here. Reads are a plain dict lookup without locking; writers share a
+    lock because a new price keeps the previous quote's estimates and new
+    estimates keep the previous price. Only when the cached quote is older than
+    max_age does a reader fetch a new one, and concurrent stale readers of the
+    same ticker share that single request.
+
+    Usage:
+      quotes = QuoteCache(api, estimate_quantities=[0.01, 0.1, 1])
+      quotes.get("BTC-USD").ask
+  """
+  def __init__(self,
+               api=None,
+               max_age: float=5.0,
+               estimate_quantities: Optional[List[float]]=None):
+    self.max_age: float = max_age
+    self.estimate_quantities: List[float] = list(estimate_quantities or [])
+
+    self.__api = api
+    self.__quotes: Dict[str, Quote] = {}
+    self.__write_lock = threading.Lock()
+    self.__fetch_locks: Dict[str, threading.Lock] = {}
+    self.__fetch_locks_lock = threading.Lock()
+
+  def get(self, ticker: str, max_age: Optional[float]=None) -> Optional[Quote]:
+    quote = self.__quotes.get(ticker)
+    if quote is not None and quote.age <= (self.max_age if max_age is None else max_age):
+      return quote
+    if self.__api is None:
+      return quote
+    return self.__fetch(ticker, max_age) or quote
+
+  def peek(self, ticker: str) -> Optional[Quote]:
+    """Returns the cached quote no matter how old it is, without any API call."""
+    return self.__quotes.get(ticker)
+
+  def update(self, ticker: str, price: float, bid: Optional[float]=None, ask: Optional[float]=None) -> Quote:
+    with self.__write_lock:
+      previous = self.__quotes.get(ticker)
+      estimates = previous.estimates if previous is not None else None
+      quote = Quote(ticker, price, bid, ask, estimates)
+      self.__quotes[ticker] = quote
+    return quote
+
+  def update_from_best_bid_ask(self, resp) -> List[Quote]:
+    quotes = []
+    if not resp or not resp.get("results"):
+      return quotes
+    for resp_data in resp["results"]:
+      quotes.append(self.update(
+        resp_data["symbol"],
+        float(resp_data["price"]),
+        _float_or_none(resp_data.get("bid_inclusive_of_sell_spread")),
+        _float_or_none(resp_data.get("ask_inclusive_of_buy_spread")),
+      ))
+    return quotes
+
+  def update_estimates(self, ticker: str, resp) -> None:
+    if not resp or not resp.get("results"):
+      return
+    estimates = {}
+    for resp_data in resp["results"]:
+      estimates[(resp_data["side"], float(resp_data["quantity"]))] = float(resp_data["price"])
+    with self.__write_lock:
+      previous = self.__quotes.get(ticker)
+      if previous is None:
+        return
+      merged = dict(previous.estimates)
+      merged.update(estimates)
+      self.__quotes[ticker] = Quote(ticker, previous.price, previous.bid, previous.ask, merged, previous.updated_at)
+
+  def refresh_estimates(self, ticker: str) -> None:
+    if self.__api is None or not self.estimate_quantities:
+      return
+    quantities = ",".join(f"{q:g}" for q in self.estimate_quantities)
+    self.update_estimates(ticker, self.__api.get_estimated_price(ticker, "both", quantities))
+
+  def __fetch(self, ticker: str, max_age: Optional[float]) -> Optional[Quote]:
+    with self.__fetch_locks_lock:
+      fetch_lock = self.__fetch_locks.setdefault(ticker, threading.Lock())
+    with fetch_lock:
+      # Another reader may have refreshed the quote while this one waited
+      quote = self.__quotes.get(ticker)
+      if quote is not None and quote.age <= (self.max_age if max_age is None else max_age):
+        return quote
+      resp = self.__api.get_best_bid_ask(ticker)
+      quotes = self.update_from_best_bid_ask(resp)
+      if not quotes:
+        l.warn(lambda: f"[{ticker}] Could not fetch a fresh quote. Response: {resp}")
+        return None
+      return quotes[0]
+
+
+def _float_or_none(value) -> Optional[float]:
+  return float(value) if value is not None else None
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from functools import wraps
 import concurrent.futures
 import threading
@@ -6,9 +6,14 @@ import uuid
 import time 
 import os 
 
-from api.robinhood_api_trading import RobinhoodCryptoAPI
-from src.datacollection import DataCollection
+from src.covariance import ReturnCovariance
+from src.exitengine import Bracket
+from src.host import StrategyHost
+from src.memo import memo
+from src.metrics import metrics
+from src.profiler import CallbackProfiler
 
+import numpy as np
 import pandas as pd
 import concurrent
 
@@ -19,81 +24,242 @@ class RobinCrypto:
 
   def __init__(self, 
                ticker_data_folderpath: str =None, 
-               max_risk: float=None):
-    if ticker_data_folderpath is None:
-      import yaml
-      with open("data-collection-config.yaml") as stream:
-        try:
-            datacollection_config = yaml.safe_load(stream)
-        except yaml.YAMLError as exc:
-            print(exc)
-      if "ticker_data_folderpath" not in datacollection_config or datacollection_config["ticker_data_folderpath"] is None:
-        raise ValueError('"ticker_data_folderpath" is not in the data-collection-config.yaml file. Please enter a valid folderpath or enter an argument for this value.')
-      if "max_risk" not in datacollection_config or datacollection_config["max_risk"] is None:
-        raise ValueError('"max_risk" is not in the data-collection-config.yaml file. Please enter a valid total risk percentage or enter an argument for this value.')
-      self.ticker_data_folderpath = datacollection_config["ticker_data_folderpath"]
-      self.max_risk = datacollection_config["max_risk"]
-    else:
-      self.ticker_data_folderpath = ticker_data_folderpath
-      self.max_risk: float = max_risk
-
-    if not os.path.exists(ticker_data_folderpath):
-      raise ValueError(f"Folderpath {ticker_data_folderpath} does not exist. Please enter a valid path containing your collected data.")
-    if max_risk != 1 and (not isinstance(max_risk, float) or max_risk <= 0):
+               max_risk: float=None,
+               host: Optional[StrategyHost]=None,
+               estimate_quantities: Optional[List[float]]=None):
+    # Strategies created through StrategyHost.load() share that host's API
+    # client, data feed and exit engine. A standalone strategy gets a private host.
+    if host is None:
+      host = StrategyHost.current()
+    self.__owns_host: bool = host is None
+    if host is None:
+      host = StrategyHost(ticker_data_folderpath, max_risk, estimate_quantities=estimate_quantities)
+
+    self.host: StrategyHost = host
+    self.ticker_data_folderpath = host.ticker_data_folderpath
+    self.max_risk: float = max_risk if max_risk is not None else host.max_risk
+
+    if self.max_risk != 1 and (not isinstance(self.max_risk, float) or self.max_risk <= 0):
       raise ValueError("max_risk must be a float of the maximum percent of your buying power you are willing to risk in a single trade.")
     
-    self.ct = RobinhoodCryptoAPI()
-    self.data = DataCollection(ticker_data_folderpath)
+    self.ct = host.ct
+    self.account = host.account
+    self.quotes = host.quotes
+    self.data = host.data
+    self.exits = host.exits
     self.__stop_event = threading.Event()
     self.__ticker_analysis_executor = concurrent.futures.ThreadPoolExecutor()
+    self.__callback_context = threading.local()
+    self.profiler: Optional[CallbackProfiler] = None
   
   def get_df(self, ticker: str, max=None) -> pd.DataFrame:
+    # Inside a cached method, reads see the same candles the result is keyed by
+    window = getattr(self.__callback_context, "windows", {}).get(ticker)
+    if window is not None:
+      return window.tail(max)
     return self.data.get_ticker_df(ticker, max=max)
 
-  def run():
+  def get_arrays(self, ticker: str, max=None) -> Dict[str, np.ndarray]:
+    """Read-only Timestamp, Open, High, Low and Close arrays, ready for talib."""
+    window = getattr(self.__callback_context, "windows", {}).get(ticker)
+    if window is not None:
+      return window.arrays(max)
+    return self.data.get_arrays(ticker, max=max)
+
+  def cached(func=None):
+    """
+    Memoizes a method whose first argument is a ticker by (ticker, newest
+    candle, method, remaining arguments) in the process wide CandleMemo, so
+    strategies and callbacks needing the same derived series for a candle
+    compute it once. The result must only depend on the ticker's candles (read
+    with self.get_df) and the arguments, not on other instance state, since
+    every strategy using the method shares it. Treat the result as read-only.
+
+      @rc.cached
+      def ao(self, ticker: str, max: int=250):
+        arrays = self.get_arrays(ticker, max=max)
+        ...
+
+    memo.stats() reports the hit and miss rates.
+    """
+    def decorator(func):
+      name = f"{func.__module__}.{func.__qualname__}"
+
+      @wraps(func)
+      def wrapper(self, ticker: str, *args, **kwargs):
+        # Process callbacks have no shared window to key by
+        if not isinstance(self, RobinCrypto):
+          return func(self, ticker, *args, **kwargs)
+        window = self.data.get_window(ticker)
+        if window.last is None:
+          return func(self, ticker, *args, **kwargs)
+        try:
+          key_args = args + tuple(sorted(kwargs.items()))
+          hash(key_args)
+        except TypeError:
+          return func(self, ticker, *args, **kwargs)
+
+        def compute():
+          context = self.__callback_context
+          windows = getattr(context, "windows", {})
+          context.windows = {**windows, ticker: window}
+          try:
+            return func(self, ticker, *args, **kwargs)
+          finally:
+            context.windows = windows
+
+        return memo.get_or_compute(ticker, window.last[0], name, key_args, compute)
+      return wrapper
+
+    if func is not None:
+      return decorator(func)
+    return decorator
+
+  def run(profile: bool=False, executor: str="thread", window: int=500):
+    """
+    Runs the decorated method once per finalized candle for every ticker.
+
+    With profile=True each invocation's wall/CPU time is recorded per ticker and
+    callback stacks are sampled; see dump_profile().
+
+    With executor="process" the method runs in the host's process pool against
+    the last `window` candles passed through shared memory. Inside it, self only
+    offers get_df(), get_arrays(), long() (sent back and executed here) and the
+    attributes named in the strategy's process_attributes.
+    """
+    if executor not in ("thread", "process"):
+      raise ValueError('executor must be either "thread" or "process".')
+
     def decorator(func):
       @wraps(func)
       def wrapper(self, tickers: List[str]):
         self.__validate_tickers(tickers)
-        def __run_ticker(ticker: str, func):
-          self.data._add_ticker(ticker)
-          self.data._try_load_inmemory_ohcl(ticker)
-          signal = self.data.get_candle_signal(ticker)
-          while True:
-            signal.wait()
+        if profile and self.profiler is None:
+          self.profiler = CallbackProfiler()
+          self.profiler.start()
+        profiler = self.profiler if profile else None
+        process_runner = self.host.process_runner() if executor == "process" else None
+
+        def __call(ticker: str):
+          if process_runner is None:
             func(self, ticker)
-            signal.clear()
+          else:
+            process_runner.call(self, func, ticker, window=window)
+
+        def __on_candle(ticker: str):
+          if self.__stop_event.is_set():
+            return
+          self.__callback_context.signal_time = time.perf_counter()
+          if profiler is None:
+            __call(ticker)
+          else:
+            profiler.call(ticker, __call, ticker)
 
-        threads = []
         for ticker in tickers:
-          ticker_t = threading.Thread(target=__run_ticker, args=(ticker, func))
-          threads.append(ticker_t)
-          ticker_t.start()
+          self.host.subscribe(self, ticker, __on_candle)
 
       return wrapper
     return decorator
 
+  def run_batch(profile: bool=False, capacity: int=1440):
+    """
+    Runs the decorated method once per minute for the whole universe of tickers,
+    after every ticker's candle for that minute is in. The method is called with
+    the CandlePanel of those tickers; panel.view(max=...) gives an aligned,
+    read-only time x ticker x OHLC window for vectorized signals.
+
+      @rc.run_batch()
+      def rotate(self, panel):
+        view = panel.view(max=200)
+        momentum = view.close[-1] / view.close[-60] - 1
+    """
+    def decorator(func):
+      @wraps(func)
+      def wrapper(self, tickers: List[str]):
+        self.__validate_tickers(tickers)
+        if profile and self.profiler is None:
+          self.profiler = CallbackProfiler()
+          self.profiler.start()
+        profiler = self.profiler if profile else None
+
+        def __on_minute(panel):
+          if self.__stop_event.is_set():
+            return
+          self.__callback_context.signal_time = time.perf_counter()
+          if profiler is None:
+            func(self, panel)
+          else:
+            profiler.call("BATCH", func, self, panel)
+
+        self.host.subscribe_batch(self, tickers, __on_minute, capacity=capacity)
+
+      return wrapper
+    return decorator
+
+  def get_panel(self, tickers: List[str], capacity: int=1440):
+    return self.data.get_panel(tickers, capacity=capacity)
+
+  def get_covariance(self, tickers: List[str], half_life: Optional[float]=60.0, window: Optional[int]=None) -> ReturnCovariance:
+    """Streaming covariance/correlation of the tickers' one-minute returns; see ReturnCovariance."""
+    return self.data.get_covariance(tickers, half_life=half_life, window=window)
+
+  def checkpoint_state(self):
+    """
+    Override to return picklable strategy state (indicator state, position
+    flags, ...) that should survive a restart when the host checkpoints.
+    """
+    return None
+
+  def restore_checkpoint(self, state) -> None:
+    """Override to restore what checkpoint_state() returned. Open brackets are already back in self.exits."""
+    pass
+
+  def open_brackets(self, ticker: Optional[str]=None) -> List[Bracket]:
+    """The brackets this strategy opened that are still tracked. Other strategies' positions on the host are left out."""
+    return self.exits.open_brackets(ticker, strategy=self.host.strategy_name(self))
+
+  def dump_profile(self, path: Optional[str]=None) -> str:
+    """
+    Writes the collapsed callback stacks gathered so far (for flamegraph.pl or
+    speedscope) and logs per ticker timings. Requires @RobinCrypto.run(profile=True).
+    """
+    if self.profiler is None:
+      raise RuntimeError("Profiling is off. Use @RobinCrypto.run(profile=True) to enable it.")
+    return self.profiler.dump(path)
+
   def long(self, 
            ticker: str,
            single_position=True,
            risk_amount=None,
            risk_percentage=None,
            stop_loss_percent=None, 
-           take_price_percent=None) -> threading.Event():
+           take_price_percent=None,
+           trailing_stop_percent=None,
+           max_correlated_exposure=None,
+           covariance: Optional[ReturnCovariance]=None) -> threading.Event():
+      """
+      With max_correlated_exposure and a covariance from get_covariance(), the
+      position is shrunk so that the held positions of the covariance's tickers,
+      weighted by their positive correlation with ticker, plus the new one stay
+      under that fraction of buying power plus those positions.
+      """
       if risk_amount is not None and risk_percentage is not None:
         raise ValueError("Must only use either risk_amount or risk_percentage. Cannot utilize both parameters at once.")
       if risk_amount is None and risk_percentage is None:
         raise ValueError("Must specify either the numerical amount of currency you are risking (risk_amount) or a percentage of your buying power that you are risking (risk_percentage).")
+      if max_correlated_exposure is not None and covariance is None:
+        raise ValueError("max_correlated_exposure needs the covariance of your tickers. Pass covariance=self.get_covariance(tickers).")
       if risk_amount and risk_amount >= self.max_risk:
         l.warn(f"VOIDING LONG CALL [{ticker}][risk_amount: {risk_amount}] because risk amount is greater than max_risk")
         return
-      if stop_loss_percent < 0 or take_price_percent < 0:
-        self.in_position[ticker] = False      
-        l.warn(f"VOIDING LONG CALL [{ticker}] Stop loss and take price percentages must be greater than 0. Cancelling from long position")
+      if any(percent is not None and percent < 0 for percent in (stop_loss_percent, take_price_percent, trailing_stop_percent)):
+        l.warn(f"VOIDING LONG CALL [{ticker}] Stop loss, take price and trailing stop percentages must be greater than 0. Cancelling from long position")
         return
 
-      account_data: Dict[str] = self.ct.get_account()
-      buying_power: float = float(account_data["buying_power"])
+      buying_power: float = self.account.buying_power
+      if buying_power <= 0:
+        l.warn(f"VOIDING LONG CALL [{ticker}] because there is no buying power (or the account could not be read)")
+        return
 
       if risk_percentage and risk_percentage >= self.max_risk:
         l.warn(f"VOIDING LONG CALL [{ticker}][risk_percentage: {risk_percentage}] because risk amount ({risk_percentage}) is greater than max_risk")
@@ -102,37 +268,99 @@ class RobinCrypto:
       if risk_amount:
         risk_percentage = risk_amount / buying_power
 
-      sold_event = threading.Event()
+      close = self.data.get_price_estimate(ticker)
+      stop_loss = None
+      take_price = None
+      if stop_loss_percent:
+        stop_loss: float = close * (1 - stop_loss_percent)
+      if take_price_percent:
+        take_price: float = close * (1 + take_price_percent)
+
+      quote_amount = buying_power * risk_percentage
+      if max_correlated_exposure is not None:
+        quote_amount = self.__limit_correlated_exposure(ticker, quote_amount, buying_power, max_correlated_exposure, covariance)
+        if quote_amount <= 0:
+          l.warn(f"VOIDING LONG CALL [{ticker}] because correlated positions already use max_correlated_exposure ({max_correlated_exposure})")
+          return
+      asset_amount = round(quote_amount / self.__buy_price_estimate(ticker, quote_amount, close), 6)
+
+      # The entry order is sent from the strategy's own thread so nothing but
+      # sizing sits between the candle signal and the request. Waiting for the
+      # fill and placing the exits happens on the executor.
+      client_order_id = str(uuid.uuid4())
+      signal_time = getattr(self.__callback_context, "signal_time", None)
+      if signal_time is not None:
+        metrics.timer("order.signal_to_wire").record(time.perf_counter() - signal_time)
+      request_start = time.perf_counter()
+      order_response = self.__place_market_order(ticker, "buy", asset_amount, client_order_id)
+      metrics.timer("order.entry_request").record(time.perf_counter() - request_start)
 
-      threading.Thread(target=self.__long_position, args=(ticker, risk_percentage, stop_loss_percent, take_price_percent, account_data, sold_event)).start()
+      sold_event = threading.Event()
+      # Checkpointed until the fill places the exits, so a restart in between
+      # still protects the position
+      if stop_loss or take_price or trailing_stop_percent:
+        self.exits.add_pending(Bracket(
+          ticker=ticker,
+          asset_quantity=asset_amount,
+          entry_price=close,
+          stop_loss=stop_loss,
+          take_price=take_price,
+          trailing_percent=trailing_stop_percent,
+          client_order_id=client_order_id,
+          closed_event=sold_event,
+          strategy=self.host.strategy_name(self),
+        ))
+
+      self.__ticker_analysis_executor.submit(
+        self.__long_position, 
+        ticker, 
+        order_response, 
+        client_order_id, 
+        close, 
+        quote_amount, 
+        asset_amount, 
+        stop_loss, 
+        take_price, 
+        trailing_stop_percent, 
+        sold_event
+      )
 
       return sold_event
 
-
-  def __long_position(self, 
-                      ticker: str, 
-                      risk_percentage: float, 
-                      stop_loss_percent: float, 
-                      take_price_percent: float,
-                      account_data: Dict,
-                      sold_event: threading.Event) -> None:
-    
-    close = self.data.get_price_estimate(ticker)
-    stop_loss = None
-    take_price = None
-    if stop_loss_percent:
-      stop_loss: float = close * (1 - stop_loss_percent)
-    if take_price_percent:
-      take_price: float = close * (1 + take_price_percent)
-
-    buying_power = float(account_data["buying_power"])
-    quote_amount = buying_power * risk_percentage
-    asset_amount = round(quote_amount / close, 6)
-
-    client_order_id = str(uuid.uuid4())
-    order_response = self.ct.place_order(
+  def __limit_correlated_exposure(self,
+                                  ticker: str,
+                                  quote_amount: float,
+                                  buying_power: float,
+                                  max_correlated_exposure: float,
+                                  covariance: ReturnCovariance) -> float:
+    exposures = {}
+    for held in covariance.tickers:
+      # The total held, so coins locked by a bracket's resting stop-loss still count
+      quantity = self.account.holding(held.split("-")[0])
+      if quantity <= 0:
+        continue
+      quote = self.quotes.peek(held)
+      last = self.data.get_window(held).last
+      price = quote.price if quote is not None else last[4] if last is not None else None
+      if price is not None:
+        exposures[held] = quantity * price
+    allowed = max_correlated_exposure * (buying_power + sum(exposures.values()))
+    allowed -= covariance.snapshot().correlated_exposure(ticker, exposures)
+    return min(quote_amount, allowed)
+
+  def __buy_price_estimate(self, ticker: str, quote_amount: float, close: float) -> float:
+    # A market buy fills around the ask plus spread, or the estimated execution
+    # price for its size when the quote cache keeps estimates, not at the mid price
+    quote = self.quotes.peek(ticker)
+    if quote is None or quote.ask is None:
+      return close
+    estimate = quote.estimated_price("ask", quote_amount / quote.ask)
+    return estimate if estimate is not None else quote.ask
+
+  def __place_market_order(self, ticker: str, side: str, asset_amount: float, client_order_id: str):
+    return self.ct.place_order(
       client_order_id=client_order_id,
-      side="buy",
+      side=side,
       order_type="market",
       symbol=ticker,
       order_config={
@@ -140,109 +368,88 @@ class RobinCrypto:
       }
     )
 
+  def __long_position(self, 
+                      ticker: str, 
+                      order_response: Dict,
+                      client_order_id: str,
+                      close: float,
+                      quote_amount: float,
+                      asset_amount: float,
+                      stop_loss: float, 
+                      take_price: float,
+                      trailing_stop_percent: float,
+                      sold_event: threading.Event) -> None:
+
     retry_time = 10
+    order_status = None
     while retry_time >= 0:
       if order_response and "id" in order_response:
-        self.__wait_order_fill(ticker, order_response["id"])
+        order_status = self.__wait_order_fill(ticker, order_response["id"])
         break
       retry_time -= 1
       time.sleep(2)
+      order_response = self.__place_market_order(ticker, "buy", asset_amount, client_order_id)
 
-    l.info(f"[{ticker}] LONG POSITION FILLED [CLOSE: {close}][SL:{stop_loss}][TP:{take_price}][QUOTE_AMT: {quote_amount}][ASSET_AMT: {asset_amount}]")
+    if order_status is None:
+      self.exits.discard_pending(client_order_id)
+      sold_event.set()
+      return
+
+    fill_price = float(order_status.get("average_price") or close)
+    self.account.apply_fill(ticker, "buy", asset_amount, fill_price)
+    l.info(f"[{ticker}] LONG POSITION FILLED [CLOSE: {close}][FILL: {fill_price}][SL:{stop_loss}][TP:{take_price}][TRAIL:{trailing_stop_percent}][QUOTE_AMT: {quote_amount}][ASSET_AMT: {asset_amount}]")
 
-    if not stop_loss_percent and not take_price_percent:
+    if not stop_loss and not take_price and not trailing_stop_percent:
       sold_event.set()
       return
 
-    if take_price and not stop_loss:
-      tp_client_order_id = str(uuid.uuid4())
-      self.ct.place_order(
-        client_order_id=tp_client_order_id,
+    # The exchange side stop-loss stays as a safety net in case this process
+    # dies; the exit engine cancels it when it closes the position itself.
+    stop_loss_order_id = None
+    if stop_loss:
+      stop_loss_response = self.ct.place_order(
+        client_order_id=str(uuid.uuid4()),
         side="sell",
-        order_type="limit",
+        order_type="stop_loss",
         symbol=ticker,
         order_config={
           "asset_quantity": asset_amount,
-          "stop_price": f"{take_price:.2f}",
+          "stop_price": f"{stop_loss:.2f}",
           "time_in_force": "gtc"
         },
       )
-      sold_event.set()
-      return
-  
-    sl_client_order_id = str(uuid.uuid4())
-    self.ct.place_order(
-      client_order_id=sl_client_order_id,
-      side="sell",
-      order_type="stop_loss",
-      symbol=ticker,
-      order_config={
-        "asset_quantity": asset_amount,
-        "stop_price": f"{stop_loss:.2f}",
-        "time_in_force": "gtc"
-      },
-    )
-
-    __ticker_signal = self.data.get_candle_signal(ticker)
-
-    while not self.__stop_event.is_set():
-      curr_est_price = self.data.get_price_estimate(ticker)
-
-      stop_loss_status = self.ct.get_order(sl_client_order_id)
-      if stop_loss_status.get("status") == "filled":
-        l.info(f"[{ticker}]: Stop-loss executed for {client_order_id} at {curr_est_price}. {stop_loss} lost on trade.")
-        break
-
-      if curr_est_price and curr_est_price >= take_price:
-        l.info(f"[{ticker}]: Take-price executed for {client_order_id} at {curr_est_price}. {take_price} lost on trade.")
-
-        tp_client_order_id = str(uuid.uuid4())
-        take_price_response = self.ct.place_order(
-          client_order_id=tp_client_order_id,
-          side="sell",
-          order_type="market",
-          symbol=ticker,
-          order_config={
-            "asset_quantity": asset_amount
-          }
-        )
-
-        retry_time = 10
-        while retry_time >= 0:
-          if order_response and "id" in order_response:
-            self.__wait_order_fill(ticker, order_response["id"])
-            break
-          retry_time -= 1
-          time.sleep(2)
-
-        self.__wait_order_fill(ticker, take_price_response["id"])
-        break
-
-      __ticker_signal.wait()
-      time.sleep(0.01)
-      __ticker_signal.clear()
-      sold_event.set()
-
-    # self.in_position[ticker] = False
+      if stop_loss_response and "id" in stop_loss_response:
+        stop_loss_order_id = stop_loss_response["id"]
+
+    self.exits.add(Bracket(
+      ticker=ticker,
+      asset_quantity=asset_amount,
+      entry_price=close,
+      stop_loss=stop_loss,
+      take_price=take_price,
+      trailing_percent=trailing_stop_percent,
+      stop_loss_order_id=stop_loss_order_id,
+      client_order_id=client_order_id,
+      closed_event=sold_event,
+      strategy=self.host.strategy_name(self),
+    ))
 
-  def __wait_order_fill(self, ticker: str, order_id: str, error_retry=3):
+  def __wait_order_fill(self, ticker: str, order_id: str, error_retry=3) -> Optional[Dict]:
     while True:
       order_status = self.ct.get_order(order_id)
       if "error" in order_status:
         if error_retry == 0:
-          l.warn("Long position order request did not go through. Voiding long call and continuing.")
-          self.in_position[ticker] = False
-          return
+          l.warn(f"[{ticker}] Long position order request did not go through. Voiding long call and continuing.")
+          return None
         error_retry -= 1
         time.sleep(1)
         continue
       if order_status["state"] == "cancelled" or order_status["state"] == "failed":
-        l.warn("Long call was either cancelled or failed. Voiding long call and continuing.")
-        self.in_position[ticker] = False
-        return
+        l.warn(f"[{ticker}] Long call was either cancelled or failed. Voiding long call and continuing.")
+        return None
       if order_status["state"] == "filled":
-        return
-      l.info(f"{order_id}: Waiting to fill. State is {order_status["state"]}")
+        return order_status
+      l.info(lambda: f"{order_id}: Waiting to fill. State is {order_status['state']}")
       time.sleep(1)
 
   def __validate_tickers(self, tickers: List[str]):
@@ -264,6 +471,12 @@ class RobinCrypto:
   
   def stop(self):
     self.__stop_event.set()
+    if self.__owns_host:
+      self.host.stop()
+    else:
+      self.host.unload(self)
+    if self.profiler is not None:
+      self.profiler.stop()
     self.__ticker_analysis_executor.shutdown(wait=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,160 @@
+import concurrent.futures
+import multiprocessing as mp
+import math
+import os
+
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.log import log
+l = log(__file__)
+
+METHODS = ("bootstrap", "block", "shuffle")
+METRICS = ("total_return", "sharpe", "max_drawdown")
+
+# Resampled values held in memory at once per chunk (rows x returns)
+_CHUNK_ELEMENTS = 4_000_000
+
+
+def returns_from_stats(stats, on: str="trades") -> Tuple[np.ndarray, float]:
+  """
+  Extracts the return series of a backtesting.py result and how many of its
+  periods make up a year, for annualizing the Sharpe ratio.
+
+    on="trades": the ReturnPct of every closed trade, annualized by the number
+                 of trades per year over the backtest's span.
+    on="equity": daily returns of the equity curve, like the Sharpe Ratio
+                 backtesting.py reports.
+  """
+  equity = stats["_equity_curve"]["Equity"]
+  years = max((equity.index[-1] - equity.index[0]) / pd.Timedelta(days=365), 1 / 365)
+  if on == "trades":
+    returns = stats["_trades"]["ReturnPct"].to_numpy(dtype=float)
+    return returns, len(returns) / years
+  if on == "equity":
+    daily = equity.resample("D").last().dropna()
+    return daily.pct_change().dropna().to_numpy(dtype=float), 365.0
+  raise ValueError('on must be either "trades" or "equity".')
+
+
+def path_metrics(paths: np.ndarray, periods_per_year: float) -> Dict[str, np.ndarray]:
+  """Total return, annualized Sharpe and max drawdown of every row of a (paths, periods) return array."""
+  equity = np.cumprod(1 + paths, axis=1)
+  peaks = np.maximum.accumulate(equity, axis=1)
+  mean = paths.mean(axis=1)
+  std = paths.std(axis=1, ddof=1) if paths.shape[1] > 1 else np.zeros(len(paths))
+  with np.errstate(divide="ignore", invalid="ignore"):
+    sharpe = np.where(std > 0, mean / std * math.sqrt(periods_per_year), np.nan)
+  return {
+    "total_return": equity[:, -1] - 1,
+    "sharpe": sharpe,
+    "max_drawdown": np.max(1 - equity / np.maximum(peaks, 1), axis=1),
+  }
+
+
+def resample_paths(returns: np.ndarray,
+                   count: int,
+                   method: str,
+                   rng: np.random.Generator,
+                   block_size: Optional[int]=None) -> np.ndarray:
+  """
+  (count, len(returns)) resampled return paths.
+
+    bootstrap: periods drawn independently with replacement.
+    block:     circular moving blocks of block_size periods, which keeps
+               streaks and volatility clustering intact.
+    shuffle:   permutations of the original returns; same total return, but a
+               different order and so a different drawdown.
+  """
+  n = len(returns)
+  if method == "bootstrap":
+    return returns[rng.integers(0, n, (count, n))]
+  if method == "block":
+    block_size = block_size or max(1, round(n ** (1 / 3)))
+    blocks = -(-n // block_size)
+    starts = rng.integers(0, n, (count, blocks))
+    indices = (starts[:, :, None] + np.arange(block_size)) % n
+    return returns[indices.reshape(count, blocks * block_size)[:, :n]]
+  if method == "shuffle":
+    return rng.permuted(np.broadcast_to(returns, (count, n)), axis=1)
+  raise ValueError(f"Unknown resampling method {method}. Use one of {', '.join(METHODS)}.")
+
+
+def _resample_chunk(returns: np.ndarray,
+                    method: str,
+                    count: int,
+                    block_size: Optional[int],
+                    periods_per_year: float,
+                    seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+  rng = np.random.default_rng(seed)
+  return path_metrics(resample_paths(returns, count, method, rng, block_size), periods_per_year)
+
+
+def robustness(returns: Sequence[float],
+               periods_per_year: float,
+               resamples: int=10000,
+               methods: Sequence[str]=METHODS,
+               block_size: Optional[int]=None,
+               confidence: float=0.95,
+               max_workers: Optional[int]=None,
+               start_method: Optional[str]=None,
+               seed: int=0) -> Dict[str, Dict]:
+  """
+  Resamples a return series `resamples` times with each method and reports the
+  point estimate of every metric with its confidence interval, median and the
+  share of paths that lost money.
+
+  Sharpe is mean / std * sqrt(periods_per_year) of the series, the same for
+  the point estimate and every path, so its scale differs from the Sharpe Ratio
+  backtesting.py reports.
+
+  Paths are generated and scored in chunks of whole NumPy arrays. With more
+  than one chunk, the chunks are spread across a process pool using the
+  process's default start method unless `start_method` is given.
+
+  Usage:
+    returns, periods_per_year = returns_from_stats(stats)
+    report = robustness(returns, periods_per_year, resamples=10000)
+    report["block"]["sharpe"]  # {"point": ..., "low": ..., "high": ..., ...}
+  """
+  returns = np.asarray(returns, dtype=float)
+  returns = returns[np.isfinite(returns)]
+  if len(returns) < 2:
+    raise ValueError("Need at least two returns to resample.")
+  for method in methods:
+    if method not in METHODS:
+      raise ValueError(f"Unknown resampling method {method}. Use one of {', '.join(METHODS)}.")
+
+  chunk_size = max(1, min(resamples, _CHUNK_ELEMENTS // len(returns)))
+  jobs = []
+  seeds = iter(np.random.SeedSequence(seed).spawn(len(methods) * (-(-resamples // chunk_size))))
+  for method in methods:
+    for start in range(0, resamples, chunk_size):
+      jobs.append((returns, method, min(chunk_size, resamples - start), block_size, periods_per_year, next(seeds)))
+
+  workers = max_workers if max_workers is not None else os.cpu_count() or 1
+  if workers <= 1 or len(jobs) == 1:
+    results = [_resample_chunk(*job) for job in jobs]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=mp.get_context(start_method)) as pool:
+      results = list(pool.map(_resample_chunk, *zip(*jobs)))
+
+  point = {name: float(value[0]) for name, value in path_metrics(returns[None, :], periods_per_year).items()}
+  tail = (1 - confidence) / 2 * 100
+  report = {}
+  for method in methods:
+    chunks = [result for job, result in zip(jobs, results) if job[1] == method]
+    report[method] = {}
+    for name in METRICS:
+      values = np.concatenate([chunk[name] for chunk in chunks])
+      values = values[np.isfinite(values)]
+      low, median, high = np.percentile(values, [tail, 50, 100 - tail]) if len(values) else (np.nan, np.nan, np.nan)
+      report[method][name] = {"point": point[name], "median": float(median), "low": float(low), "high": float(high)}
+    total_returns = np.concatenate([chunk["total_return"] for chunk in chunks])
+    report[method]["p_loss"] = float(np.mean(total_returns < 0))
+  report["resamples"] = resamples
+  report["confidence"] = confidence
+  report["periods"] = len(returns)
+  return report
@@ -0,0 +1,222 @@
+import abc
+import time
+import os
+import threading
+
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.metrics import metrics
+from src.pollscheduler import PollScheduler
+from src.log import log
+l = log(__file__)
+
+
+class Tick(NamedTuple):
+  ticker: str
+  timestamp: float
+  price: float
+  bid: Optional[float] = None
+  ask: Optional[float] = None
+
+
+TICK_COLUMNS = ["Timestamp", "Ticker", "Price", "Bid", "Ask"]
+
+
+class MarketDataSource(abc.ABC):
+  """
+    Where DataCollection gets its prices from. A source runs on its own thread
+    and hands batches of Ticks to `emit` until `stop_event` is set or it runs out
+    of data.
+
+    Sources with `event_time = True` have minutes finalized from the tick
+    timestamps instead of the wall clock, which is what lets a replay run many
+    minutes per second. When such a source runs out of data, the candles still
+    in progress are finalized as well.
+  """
+  event_time: bool = False
+
+  @abc.abstractmethod
+  def run(self, tickers: List[str], emit: Callable[[List[Tick]], None], stop_event: threading.Event) -> None:
+    ...
+
+
+class RobinhoodSource(MarketDataSource):
+  """
+    Polls get_best_bid_ask on the timeline planned by a PollScheduler, which
+    also picks the tickers each request asks for. `tickers` is DataCollection's
+    own list, so tickers added while running are picked up on the next poll.
+  """
+  def __init__(self, api, scheduler: Optional[PollScheduler]=None):
+    self.api = api
+    self.scheduler: PollScheduler = scheduler if scheduler is not None else PollScheduler()
+
+  def run(self, tickers: List[str], emit: Callable[[List[Tick]], None], stop_event: threading.Event) -> None:
+    while not stop_event.is_set():
+      deadline, due = self.scheduler.next_poll(list(tickers))
+      delay = deadline - time.monotonic()
+      if delay > 0 and stop_event.wait(delay):
+        return
+      if not due:
+        continue
+      metrics.timer("data.poll_lateness").record(time.monotonic() - deadline)
+      metrics.counter("data.poll_requests").inc()
+
+      resp = self.api.get_best_bid_ask(*due)
+      if not resp or not resp.get("results"):
+        l.warn(f"Robinhood API is not responding at this time")
+        continue
+      now, sampled = time.time(), time.monotonic()
+      ticks = [
+        Tick(
+          resp_data["symbol"],
+          now,
+          float(resp_data["price"]),
+          _float_or_none(resp_data.get("bid_inclusive_of_sell_spread")),
+          _float_or_none(resp_data.get("ask_inclusive_of_buy_spread")),
+        ) for resp_data in resp["results"]
+      ]
+      for tick in ticks:
+        self.scheduler.observe(tick.ticker, tick.price, sampled)
+      emit(ticks)
+
+
+class ReplaySource(MarketDataSource):
+  """
+    Streams recorded or synthetic ticks in batches of `batch_size` at `rate`
+    ticks per second (as fast as possible when None). Minutes are finalized in
+    event time, so a folderpath used with a ReplaySource gets the same candle
+    CSVs the live collector would have written for those ticks.
+
+    Usage:
+      source = ReplaySource.from_tick_files(["ticks/2024-06-01.csv"], rate=20000)
+      source = ReplaySource(synthetic_ticks(["BTC-USD", "ETH-USD"], 1000000))
+      DataCollection(folderpath, tickers=["BTC-USD", "ETH-USD"], source=source).run()
+  """
+  event_time: bool = True
+
+  def __init__(self, ticks: Iterable[Tick], rate: Optional[float]=None, batch_size: int=256):
+    if rate is not None and rate <= 0:
+      raise ValueError("rate must be a positive number of ticks per second or None.")
+    self.ticks: Iterable[Tick] = ticks
+    self.rate: Optional[float] = rate
+    self.batch_size: int = batch_size
+    self.sent: int = 0
+
+  @classmethod
+  def from_tick_files(cls, filepaths: Sequence[str], rate: Optional[float]=None, batch_size: int=256, chunk_rows: int=100000) -> "ReplaySource":
+    """Replays files written by TickRecorder, in order."""
+    return cls(_read_tick_files(filepaths, chunk_rows), rate=rate, batch_size=batch_size)
+
+  @classmethod
+  def from_candle_files(cls, folderpath: str, tickers: Sequence[str], rate: Optional[float]=None, batch_size: int=256) -> "ReplaySource":
+    """
+    Replays collected one-minute CSVs as four ticks per candle (Open, High, Low,
+    Close at 0, 15, 30 and 45 seconds into the minute), merged across tickers.
+    """
+    frames = []
+    for ticker in tickers:
+      df = pd.read_csv(os.path.join(folderpath, f"{ticker}-1min-data.csv"), float_precision="round_trip")
+      minutes = pd.to_datetime(df["Timestamp"], format="%Y-%m-%d %H:%M:%S").dt.floor("min")
+      # The CSV timestamps are local time, like the ones time.localtime() gives back
+      seconds = np.array([time.mktime(minute.timetuple()) for minute in minutes], dtype=float)
+      for offset, column in zip((0, 15, 30, 45), ("Open", "High", "Low", "Close")):
+        frames.append(pd.DataFrame({"Timestamp": seconds + offset, "Ticker": ticker, "Price": df[column].to_numpy(dtype=float)}))
+    merged = pd.concat(frames, ignore_index=True).sort_values("Timestamp", kind="stable")
+    ticks = [Tick(ticker, timestamp, price) for timestamp, ticker, price in merged[["Timestamp", "Ticker", "Price"]].itertuples(index=False, name=None)]
+    return cls(ticks, rate=rate, batch_size=batch_size)
+
+  def run(self, tickers: List[str], emit: Callable[[List[Tick]], None], stop_event: threading.Event) -> None:
+    start = time.perf_counter()
+    batch: List[Tick] = []
+    for tick in self.ticks:
+      batch.append(tick)
+      if len(batch) < self.batch_size:
+        continue
+      if stop_event.is_set():
+        return
+      self.__send(batch, emit, start)
+      batch = []
+    if batch and not stop_event.is_set():
+      self.__send(batch, emit, start)
+
+  def __send(self, batch: List[Tick], emit: Callable[[List[Tick]], None], start: float) -> None:
+    emit(batch)
+    self.sent += len(batch)
+    if self.rate is not None:
+      delay = start + self.sent / self.rate - time.perf_counter()
+      if delay > 0:
+        time.sleep(delay)
+
+
+class TickRecorder(MarketDataSource):
+  """
+    Wraps another source and appends every tick it emits to a CSV file that
+    ReplaySource.from_tick_files can play back later.
+  """
+  def __init__(self, source: MarketDataSource, filepath: str):
+    self.source: MarketDataSource = source
+    self.filepath: str = filepath
+    self.event_time = source.event_time
+
+  def run(self, tickers: List[str], emit: Callable[[List[Tick]], None], stop_event: threading.Event) -> None:
+    write_header = not os.path.exists(self.filepath) or os.path.getsize(self.filepath) == 0
+    with open(self.filepath, "a") as file:
+      if write_header:
+        file.write(",".join(TICK_COLUMNS) + "\n")
+
+      def __record(ticks: List[Tick]) -> None:
+        file.write("".join(f"{t.timestamp},{t.ticker},{t.price},{_empty_if_none(t.bid)},{_empty_if_none(t.ask)}\n" for t in ticks))
+        file.flush()
+        emit(ticks)
+
+      self.source.run(tickers, __record, stop_event)
+
+
+def synthetic_ticks(tickers: Sequence[str],
+                    count: int,
+                    ticks_per_minute: int=60,
+                    start: Optional[float]=None,
+                    start_price: float=100000.0,
+                    volatility: float=0.0005,
+                    seed: int=0) -> Iterator[Tick]:
+  """
+  Yields `count` random walk ticks spread round robin over the tickers, with
+  each ticker receiving `ticks_per_minute` ticks per event-time minute.
+  """
+  if start is None:
+    start = (time.time() // 60) * 60
+  rng = np.random.default_rng(seed)
+  step = 60.0 / ticks_per_minute
+  rounds = -(-count // len(tickers))
+  chunk_rounds = 10000
+  prices = np.full(len(tickers), start_price)
+  emitted = 0
+  for first_round in range(0, rounds, chunk_rounds):
+    n = min(chunk_rounds, rounds - first_round)
+    walk = prices * np.exp(np.cumsum(rng.normal(0, volatility, (n, len(tickers))), axis=0))
+    prices = walk[-1]
+    timestamps = start + (first_round + np.arange(n)) * step
+    for timestamp, row in zip(timestamps.tolist(), walk.tolist()):
+      for ticker, price in zip(tickers, row):
+        if emitted == count:
+          return
+        yield Tick(ticker, timestamp, price)
+        emitted += 1
+
+
+def _read_tick_files(filepaths: Sequence[str], chunk_rows: int) -> Iterator[Tick]:
+  for filepath in filepaths:
+    for chunk in pd.read_csv(filepath, chunksize=chunk_rows, float_precision="round_trip"):
+      for timestamp, ticker, price, bid, ask in chunk[TICK_COLUMNS].itertuples(index=False, name=None):
+        yield Tick(ticker, timestamp, price, None if bid != bid else bid, None if ask != ask else ask)
+
+
+def _float_or_none(value) -> Optional[float]:
+  return float(value) if value is not None else None
+
+
+def _empty_if_none(value) -> str:
+  return "" if value is None else str(value)
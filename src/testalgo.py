@@ -14,8 +14,11 @@ class TestAlgorithm(rc):
 
     self.in_position: Dict[Optional[threading.Event]] = {ticker: None for ticker in tickers}
 
-  def __ao(self, high, low):
-    median_price = (high + low) / 2
+  # Shared by every strategy in the process, so the AO of a candle is computed once
+  @rc.cached
+  def __ao(self, ticker: str, max: int=250):
+    arrays = self.get_arrays(ticker, max=max)
+    median_price = (arrays["High"] + arrays["Low"]) / 2
     ao_short = talib.SMA(median_price, timeperiod=5)
     ao_long = talib.SMA(median_price, timeperiod=34)
     return ao_short - ao_long
@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from benchmarks.run import StubRobinhoodCryptoAPI
+from src.datacollection import DataCollection
+from src.sources import Tick
+
+TICKER = "BTC-USD"
+
+
+def test_tick_of_next_minute_before_finalizer_keeps_real_candle(tmp_path):
+  (tmp_path / f"{TICKER}-1min-data.csv").write_text("Timestamp,Open,High,Low,Close\n")
+  data = DataCollection(str(tmp_path), tickers=[TICKER], interpolate_missing_data=True, api=StubRobinhoodCryptoAPI())
+  data._add_ticker(TICKER)
+  data._try_load_inmemory_ohcl(TICKER)
+
+  minute = int(time.time() // 60) - 10
+  on_ticks = data._DataCollection__on_ticks
+  on_ticks([Tick(TICKER, minute * 60 + 1, 100.0), Tick(TICKER, minute * 60 + 20, 110.0), Tick(TICKER, minute * 60 + 40, 90.0), Tick(TICKER, minute * 60 + 58, 105.0)])
+  # The next minute's first tick lands before the wall clock finalizer of minute runs
+  on_ticks([Tick(TICKER, (minute + 1) * 60 + 0.05, 200.0)])
+  asyncio.run(data._DataCollection__finalize_ohlc(TICKER, time.localtime(minute * 60 + 59), minute))
+
+  _, open_, high_, low_, close_ = data.get_window(TICKER).last
+  assert (open_, high_, low_, close_) == (100.0, 110.0, 90.0, 105.0)
+  lines = (tmp_path / f"{TICKER}-1min-data.csv").read_text().splitlines()
+  assert lines[-1].split(",")[1:] == ["100.0", "110.0", "90.0", "105.0"]
+
+  # The candle in progress is untouched and finalizes on its own minute
+  asyncio.run(data._DataCollection__finalize_ohlc(TICKER, time.localtime((minute + 1) * 60 + 59), minute + 1))
+  assert data.get_window(TICKER).last[1:] == (200.0, 200.0, 200.0, 200.0)